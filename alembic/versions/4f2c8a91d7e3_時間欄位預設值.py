@@ -0,0 +1,33 @@
+"""時間欄位預設值改為CURRENT_TIMESTAMP
+
+Revision ID: 4f2c8a91d7e3
+Revises: 1d47756db72b
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2c8a91d7e3'
+down_revision = '1d47756db72b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 原server_default為建表時固定的時間字串
+    for column in ('created_at', 'updated_at'):
+        op.alter_column('test_table', column,
+                        existing_type=sa.DateTime(timezone=True),
+                        existing_nullable=True,
+                        server_default=sa.text('CURRENT_TIMESTAMP'))
+
+
+def downgrade():
+    for column in ('created_at', 'updated_at'):
+        op.alter_column('test_table', column,
+                        existing_type=sa.DateTime(timezone=True),
+                        existing_nullable=True,
+                        server_default='2023-07-10 18:43:50')
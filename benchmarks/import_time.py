@@ -0,0 +1,64 @@
+"""
+import core 的時間預算檢查
+以新的直譯器重複匯入取最小值，超過預算或載入了應延遲載入的模組時回傳1
+pytest由tests/test_import_time.py呼叫measure()檢查同一預算
+
+python benchmarks/import_time.py
+python benchmarks/import_time.py --budget-ms 400 --runs 10
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+BUDGET_MS = 500  # tests/test_import_time.py以同一預算檢查
+
+# 應於第一次使用時才載入的模組
+DEFERRED_MODULES = ['sqlalchemy.ext.asyncio', 'aioredis', 'redis', 'delorean', 'pytz']
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import core
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))
+'''
+
+
+def measure(runs=5) -> tuple[float, list]:
+    """回傳(最小匯入秒數, 已載入的延遲模組)"""
+    best, loaded = None, []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', _PROBE % DEFERRED_MODULES], cwd=ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        best = result['seconds'] if best is None else min(best, result['seconds'])
+        loaded = result['loaded']
+    return best, loaded
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='import core 時間預算')
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS, help='匯入時間預算(毫秒)')
+    parser.add_argument('--runs', type=int, default=5, help='重複次數(取最小值)')
+    args = parser.parse_args(argv)
+
+    seconds, loaded = measure(args.runs)
+    print(f'import core: {seconds * 1000:.1f}ms (預算 {args.budget_ms:.0f}ms)')
+    failed = False
+    if seconds * 1000 > args.budget_ms:
+        print('超過匯入時間預算')
+        failed = True
+    if loaded:
+        print(f'匯入時載入了應延遲載入的模組: {", ".join(loaded)}')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
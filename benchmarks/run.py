@@ -0,0 +1,357 @@
+"""
+Service層效能基準
+以SQLite/aiosqlite執行(快取相關以fakeredis取代Redis)，依資料量逐級測試
+回報吞吐量、延遲百分位數與峰值記憶體，並與baseline.json比較
+
+python benchmarks/run.py                          # 1k、10k
+python benchmarks/run.py --rows 1000,100000,1000000
+python benchmarks/run.py --save-baseline          # 更新baseline
+python benchmarks/run.py --only get,to_json       # 名稱包含任一關鍵字的項目
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.database import db, redis, CachePolicy  # noqa: E402
+from core.database.pool import percentile  # noqa: E402
+from core.models import Test  # noqa: E402
+from core.service import Service, AsyncService  # noqa: E402
+
+BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+
+CASES = []  # [(名稱, 'sync' | 'async', 建立函式)]
+
+
+def case(name: str, mode='sync', cache=False):
+    """
+    註冊基準項目
+    建立函式 build(ctx) -> (操作list, 每個操作處理的筆數)，準備資料的時間不計入
+    """
+    def decorator(build):
+        CASES.append((name, mode, cache, build))
+        return build
+    return decorator
+
+
+class TestService(Service):
+    __model__ = Test
+
+
+class AsyncTestService(AsyncService):
+    __model__ = Test
+
+
+class CachedTestService(Service):
+    __model__ = Test
+    __cache__ = CachePolicy(ttl=300)
+
+
+class AsyncCachedTestService(AsyncService):
+    __model__ = Test
+    __cache__ = CachePolicy(ttl=300)
+
+
+class Context:
+    """單一資料量的測試環境"""
+
+    def __init__(self, rows: int, ops: int, seed=0):
+        self.rows = rows
+        self.ops = ops
+        self.random = random.Random(seed)
+        self.service = TestService()
+        self.async_service = AsyncTestService()
+        self.cached_service = CachedTestService()
+        self.async_cached_service = AsyncCachedTestService()
+        self._counter = 0
+
+    def sample_ids(self) -> list:
+        return [self.random.randint(1, self.rows) for _ in range(self.ops)]
+
+    def unique_names(self, prefix: str, count: int) -> list:
+        start, self._counter = self._counter, self._counter + count
+        return [f'{prefix}-{i}' for i in range(start, start + count)]
+
+    def seed_for_delete(self) -> list:
+        return self.service.bulk_create(
+            [{'name': name} for name in self.unique_names('delete', self.ops)], returning='ids'
+        )
+
+
+# ---------- Service ----------
+@case('Service.create')
+def _create(ctx):
+    return [partial(ctx.service.create, name=name) for name in ctx.unique_names('create', ctx.ops)], 1
+
+
+@case('Service.get')
+def _get(ctx):
+    return [partial(ctx.service.get, id_) for id_ in ctx.sample_ids()], 1
+
+
+@case('Service.get[cache]', cache=True)
+def _cached_get(ctx):
+    ids = ctx.sample_ids()
+    ctx.cached_service.get_many(ids)  # 預熱快取
+    return [partial(ctx.cached_service.get, id_) for id_ in ids], 1
+
+
+@case('Service.first')
+def _first(ctx):
+    return [partial(ctx.service.first, name=f'row-{id_ - 1}') for id_ in ctx.sample_ids()], 1
+
+
+@case('Service.all')
+def _all(ctx):
+    return [ctx.service.all] * max(1, min(10, 100_000 // ctx.rows)), ctx.rows
+
+
+@case('Service.update')
+def _update(ctx):
+    instances = ctx.service.get_many(ctx.sample_ids())
+    return [partial(ctx.service.update, instance, is_active=not instance.is_active) for instance in instances], 1
+
+
+@case('Service.get_or_create')
+def _get_or_create(ctx):
+    existing = [f'row-{id_ - 1}' for id_ in ctx.sample_ids()[:ctx.ops // 2]]
+    names = existing + ctx.unique_names('goc', ctx.ops - len(existing))
+    ctx.random.shuffle(names)
+    return [partial(ctx.service.get_or_create, name=name) for name in names], 1
+
+
+@case('Service.delete')
+def _delete(ctx):
+    return [partial(ctx.service.delete, id_) for id_ in ctx.seed_for_delete()], 1
+
+
+# ---------- AsyncService ----------
+@case('AsyncService.create', 'async')
+def _acreate(ctx):
+    return [partial(ctx.async_service.create, name=name) for name in ctx.unique_names('acreate', ctx.ops)], 1
+
+
+@case('AsyncService.get', 'async')
+def _aget(ctx):
+    return [partial(ctx.async_service.get, id_) for id_ in ctx.sample_ids()], 1
+
+
+@case('AsyncService.get[cache]', 'async', cache=True)
+def _acached_get(ctx):
+    ids = ctx.sample_ids()
+    ctx.cached_service.get_many(ids)  # 快取key與同步Service相同
+    return [partial(ctx.async_cached_service.get, id_) for id_ in ids], 1
+
+
+@case('AsyncService.first', 'async')
+def _afirst(ctx):
+    return [partial(ctx.async_service.first, name=f'row-{id_ - 1}') for id_ in ctx.sample_ids()], 1
+
+
+@case('AsyncService.all', 'async')
+def _aall(ctx):
+    return [ctx.async_service.all] * max(1, min(10, 100_000 // ctx.rows)), ctx.rows
+
+
+@case('AsyncService.update', 'async')
+def _aupdate(ctx):
+    instances = ctx.service.get_many(ctx.sample_ids())
+    return [partial(ctx.async_service.update, i, is_active=not i.is_active) for i in instances], 1
+
+
+@case('AsyncService.get_or_create', 'async')
+def _aget_or_create(ctx):
+    existing = [f'row-{id_ - 1}' for id_ in ctx.sample_ids()[:ctx.ops // 2]]
+    names = existing + ctx.unique_names('agoc', ctx.ops - len(existing))
+    ctx.random.shuffle(names)
+    return [partial(ctx.async_service.get_or_create, name=name) for name in names], 1
+
+
+@case('AsyncService.delete', 'async')
+def _adelete(ctx):
+    return [partial(ctx.async_service.delete, id_) for id_ in ctx.seed_for_delete()], 1
+
+
+# ---------- ORM ----------
+@case('ORM.get_instance')
+def _get_instance(ctx):
+    with db.session_scope() as session:
+        models = list(session.scalars(db.query(Test).where(Test.id.in_(ctx.sample_ids()))))
+    return [model.get_instance for model in models], 1
+
+
+@case('ORMObject.to_json')
+def _to_json(ctx):
+    instances = ctx.service.get_many(ctx.sample_ids())
+    return [instance.to_json for instance in instances], 1
+
+
+@case('ORMObject.to_json_many')
+def _to_json_many(ctx):
+    instances = ctx.service.all()
+    return [partial(Test.to_json_many, instances)] * 3, len(instances)
+
+
+# ---------- 執行 ----------
+def _time_sync(ops: list) -> list:
+    durations = []
+    for op in ops:
+        start = time.perf_counter()
+        op()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def _time_async(ops: list) -> list:
+    durations = []
+    for op in ops:
+        start = time.perf_counter()
+        await op()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def _execute(loop, mode: str, ops: list) -> list:
+    if mode == 'async':
+        return loop.run_until_complete(_time_async(ops))
+    return _time_sync(ops)
+
+
+def run_case(ctx: Context, loop, mode: str, build) -> dict:
+    """計時一次，再以tracemalloc量測一次峰值記憶體(tracemalloc會拖慢執行，兩者分開)"""
+    ops, items = build(ctx)
+    gc.collect()
+    durations = sorted(_execute(loop, mode, ops))
+    total = sum(durations)
+    ops, _ = build(ctx)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        _execute(loop, mode, ops)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'ops': len(durations),
+        'items_per_s': round(len(durations) * items / total, 1) if total else None,
+        'p50_ms': round(percentile(durations, 50) * 1000, 4),
+        'p99_ms': round(percentile(durations, 99) * 1000, 4),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def setup_database(path: str, rows: int, loop):
+    """建立SQLite資料庫並寫入rows筆資料(name為row-0 ~ row-{rows-1}，id為1 ~ rows)"""
+    loop.run_until_complete(db.close_engine())
+    if os.path.exists(path):
+        os.remove(path)
+    db.sync_url = f'sqlite:///{path}'
+    db.async_url = f'sqlite+aiosqlite:///{path}'
+    db.Model.metadata.create_all(db.engine)
+    TestService().bulk_create(({'name': f'row-{i}'} for i in range(rows)), batch_size=5000)
+
+
+def setup_redis() -> bool:
+    """以fakeredis取代Redis，未安裝時略過快取項目"""
+    try:
+        import fakeredis
+    except ImportError:
+        return False
+    server = fakeredis.FakeServer()
+    redis._sync_redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+    redis._async_redis = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    return True
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """吞吐量低於或p50高於baseline超過tolerance時視為退步"""
+    regressions = []
+    for key, result in results.items():
+        if (base := baseline.get(key)) is None or 'error' in result or 'error' in base:
+            continue
+        if base['items_per_s'] and result['items_per_s'] < base['items_per_s'] * (1 - tolerance):
+            regressions.append(f"{key}: items/s {result['items_per_s']} < {base['items_per_s']}")
+        if result['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{key}: p50 {result['p50_ms']}ms > {base['p50_ms']}ms")
+    return regressions
+
+
+def _print(key: str, result: dict, base: dict = None):
+    if 'error' in result:
+        print(f'{key:<40} ERROR {result["error"]}')
+        return
+    change = ''
+    if base and base.get('items_per_s') and result['items_per_s']:
+        change = f'{(result["items_per_s"] / base["items_per_s"] - 1) * 100:+.1f}%'
+    print(f'{key:<40} {result["items_per_s"]:>14,.1f} {result["p50_ms"]:>10.3f} {result["p99_ms"]:>10.3f} '
+          f'{result["peak_kb"]:>12,.1f} {change:>8}')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Service層效能基準')
+    parser.add_argument('--rows', default='1000,10000', help='資料量，逗號分隔(例: 1000,100000,1000000)')
+    parser.add_argument('--ops', type=int, default=500, help='逐筆操作項目的操作次數')
+    parser.add_argument('--only', default='', help='只執行名稱包含任一關鍵字的項目，逗號分隔')
+    parser.add_argument('--baseline', default=str(BASELINE), help='baseline檔案')
+    parser.add_argument('--save-baseline', action='store_true', help='將本次結果寫入baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='容許的退步比例')
+    parser.add_argument('--json', dest='json_path', help='結果輸出為JSON檔')
+    args = parser.parse_args(argv)
+
+    keywords = [k for k in args.only.split(',') if k]
+    cases = [c for c in CASES if not keywords or any(k in c[0] for k in keywords)]
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    has_redis = setup_redis()
+    loop = asyncio.new_event_loop()
+    results = {}
+    print(f'{"case":<40} {"items/s":>14} {"p50 ms":>10} {"p99 ms":>10} {"peak KiB":>12} {"vs base":>8}')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        try:
+            for rows in (int(r) for r in args.rows.split(',')):
+                setup_database(path, rows, loop)
+                if has_redis:
+                    redis.sync_.flushall()
+                ctx = Context(rows, min(args.ops, rows))
+                for name, mode, cache, build in cases:
+                    if cache and not has_redis:
+                        continue
+                    key = f'{rows}:{name}'
+                    try:
+                        results[key] = run_case(ctx, loop, mode, build)
+                    except Exception as e:
+                        results[key] = {'error': f'{type(e).__name__}: {e}'[:200]}
+                    _print(key, results[key], baseline.get(key))
+        finally:
+            loop.run_until_complete(db.close_engine())
+            loop.close()
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.save_baseline:
+        baseline.update(results)
+        baseline_path.write_text(json.dumps(baseline, indent=2, ensure_ascii=False, sort_keys=True) + '\n')
+        print(f'baseline已更新: {baseline_path}')
+        return 0
+    if regressions := compare(results, baseline, args.tolerance):
+        print('\n效能退步:')
+        for line in regressions:
+            print(f'  {line}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
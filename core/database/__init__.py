@@ -3,10 +3,12 @@
 """
 from ..database.base import *
 from ..database.mysqldb import _SqlalchemyManager
-from ..database.redisdb import _RedisManager
+from ..database.redisdb import _RedisManager, redis
 from ..database.orm import *
 from ..database.mixins import *
+from ..database.cache import CachePolicy
+from ..database.dedup import DedupPolicy
+from ..database.shard import ShardMap, HashShardMap, RangeShardMap
 
 
 db = _SqlalchemyManager()
-redis = _RedisManager()
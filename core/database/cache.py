@@ -0,0 +1,534 @@
+"""
+Service查詢快取(本機LRU + Redis)
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, Iterable, Optional, Sequence, Union
+from ..database.redisdb import dumps_json, loads_json
+
+logger = logging.getLogger(__name__)
+
+MISS = object()  # 快取未命中
+
+
+class CachePolicy:
+    """
+    Service快取設定，設定於Service.__cache__
+    :param ttl: Redis快取秒數
+    :param key_fields: 可快取的查詢鍵，字串為單欄位，tuple為複合鍵；get(id)對應'id'
+    :param local_size: 本機LRU筆數，0為不使用
+    :param local_ttl: 本機LRU秒數，預設與ttl相同
+    :param use_redis: 是否使用Redis層
+    :param prefix: Redis key前綴
+    :param count_ttl: count結果的Redis快取秒數，0為不快取；任何寫入都會清除
+    """
+
+    def __init__(self, ttl=300, key_fields: Sequence[Union[str, tuple]] = ('id',), local_size=0,
+                 local_ttl=None, use_redis=True, prefix='cache', count_ttl=0):
+        self.ttl = ttl
+        self.key_fields: tuple = tuple((f,) if isinstance(f, str) else tuple(f) for f in key_fields)
+        self.local_size = local_size
+        self.local_ttl = ttl if local_ttl is None else local_ttl
+        self.use_redis = use_redis
+        self.prefix = prefix
+        self.count_ttl = count_ttl
+
+
+class LocalLRU:
+    """執行緒安全的本機LRU(含過期時間)"""
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISS
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return MISS
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class _Flight:
+    """單飛請求：同一key同時只有一個請求打到資料庫"""
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _decoder(column):
+    """依欄位型別建立反序列化函式"""
+    try:
+        python_type = column.type.python_type
+    except (AttributeError, NotImplementedError):
+        return None
+    if python_type is datetime:
+        return datetime.fromisoformat
+    if python_type is date:
+        return date.fromisoformat
+    if python_type is Decimal:
+        return Decimal
+    return None
+
+
+class ServiceCache:
+    """
+    單一model的讀穿快取
+    快取內容為依converter欄位順序排列的值list(不含欄位名稱)，命中時重建新的ORMObject
+    """
+
+    def __init__(self, policy: CachePolicy, model, manager):
+        self.policy = policy
+        self.model = model
+        self.manager = manager  # _RedisManager
+        converter = model.get_converter()
+        self.converter = converter
+        self.fields: tuple = converter.fields + tuple(
+            name for name, _ in converter.modifiers if name not in converter.fields
+        )
+        columns = dict(zip(converter.column_fields, converter.columns))
+        self._decoders: tuple = tuple(
+            (index, decoder) for index, name in enumerate(self.fields)
+            if name in columns and (decoder := _decoder(columns[name])) is not None
+        )
+        self.local = LocalLRU(policy.local_size, policy.local_ttl) if policy.local_size else None
+        self._namespace = f'{policy.prefix}:{model.__tablename__}'
+        self._counts_key = f'{self._namespace}:counts'  # hash: 查詢條件 -> [筆數, 到期時間]
+        self._mutex = threading.Lock()
+        self._flights: dict = {}
+        self._async_flights = weakref.WeakKeyDictionary()  # event loop -> {key: future}，future只能在建立的loop上等待
+
+    # ---------- key ----------
+    def key_for(self, kws: dict) -> Optional[str]:
+        """查詢條件 -> 快取key，條件不屬於key_fields時回傳None(不快取)"""
+        names = tuple(sorted(kws))
+        for fields in self.policy.key_fields:
+            if names == tuple(sorted(fields)):
+                return self._key(fields, kws)
+        return None
+
+    def _key(self, fields: tuple, values) -> str:
+        if isinstance(values, dict):
+            parts = '|'.join(f'{f}={values[f]}' for f in fields)
+        else:
+            parts = '|'.join(f'{f}={getattr(values, f, None)}' for f in fields)
+        return f'{self._namespace}:{parts}'
+
+    @property
+    def caches_id(self) -> bool:
+        """是否以id快取(get/get_many可使用)"""
+        return ('id',) in self.policy.key_fields
+
+    def id_key(self, id_) -> str:
+        return self._key(('id',), {'id': id_})
+
+    def keys_of(self, instance) -> list[str]:
+        """ORMObject所有可快取的key"""
+        return [self._key(fields, instance) for fields in self.policy.key_fields]
+
+    @staticmethod
+    def count_field(kws: dict) -> str:
+        return '|'.join(f'{f}={kws[f]}' for f in sorted(kws)) or '*'
+
+    @property
+    def caches_count(self) -> bool:
+        return self.policy.count_ttl > 0 and self.policy.use_redis
+
+    def _count_payload(self, raw) -> Optional[int]:
+        """hash欄位無法個別設定過期，值內帶到期時間"""
+        if raw is None:
+            return None
+        count, expires_at = self._loads(raw)
+        return count if expires_at > time.time() else None
+
+    def _count_mapping(self, field: str, count: int) -> dict:
+        return {field: self._dumps([count, time.time() + self.policy.count_ttl])}
+
+    # ---------- 編碼 ----------
+    def encode(self, instance) -> list:
+        values = instance.__dict__
+        return [_encode_value(values.get(name)) for name in self.fields]
+
+    def decode(self, payload: list):
+        payload = list(payload)
+        for index, decoder in self._decoders:
+            if payload[index] is not None:
+                payload[index] = decoder(payload[index])
+        return self.converter._new(zip(self.fields, payload))
+
+    _dumps = staticmethod(dumps_json)
+    _loads = staticmethod(loads_json)
+
+    # ---------- 同步 ----------
+    @property
+    def _sync_client(self):
+        return self.manager.sync_ if self.policy.use_redis else None
+
+    def _get(self, key):
+        if self.local is not None and (payload := self.local.get(key)) is not MISS:
+            return payload
+        client = self._sync_client
+        if client is None:
+            return MISS
+        try:
+            raw = client.get(key)
+        except Exception as e:
+            logger.warning('讀取Redis快取失敗 %s: %s', key, e)
+            return MISS
+        if raw is None:
+            return MISS
+        payload = self._loads(raw)
+        if self.local is not None:
+            self.local.set(key, payload)
+        return payload
+
+    def _get_many(self, keys: list) -> dict:
+        """批次讀取：先查本機LRU，其餘以一次MGET讀取Redis"""
+        found, remote = {}, []
+        for key in keys:
+            if self.local is not None and (payload := self.local.get(key)) is not MISS:
+                found[key] = payload
+            else:
+                remote.append(key)
+        client = self._sync_client
+        if client is None or not remote:
+            return found
+        try:
+            raws = client.mget(remote)
+        except Exception as e:
+            logger.warning('批次讀取Redis快取失敗: %s', e)
+            return found
+        for key, raw in zip(remote, raws):
+            if raw is not None:
+                found[key] = payload = self._loads(raw)
+                if self.local is not None:
+                    self.local.set(key, payload)
+        return found
+
+    def _set_many(self, mapping: dict):
+        if self.local is not None:
+            for key, payload in mapping.items():
+                self.local.set(key, payload)
+        client = self._sync_client
+        if client is None or not mapping:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, payload in mapping.items():
+                pipe.set(key, self._dumps(payload), ex=self.policy.ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.warning('寫入Redis快取失敗: %s', e)
+
+    def _delete(self, keys: Iterable[str]):
+        keys = list(keys)
+        if self.local is not None:
+            self.local.delete(*keys)
+        client = self._sync_client
+        if client is None or not keys:
+            return
+        try:
+            client.delete(*keys)
+        except Exception as e:
+            logger.warning('刪除Redis快取失敗: %s', e)
+
+    def fetch(self, kws: dict, loader: Callable):
+        """讀穿查詢：快取未命中時以單飛方式呼叫loader"""
+        key = self.key_for(kws)
+        if key is None:
+            return loader()
+        if (payload := self._get(key)) is not MISS:
+            return self.decode(payload)
+        with self._mutex:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return None if flight.value is None else self.decode(flight.value)
+        try:
+            instance = loader()
+            if instance is not None:
+                flight.value = self.encode(instance)
+                self._set_many({k: flight.value for k in self.keys_of(instance)})
+            return instance
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._mutex:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def _store(self, instances: Iterable) -> dict:
+        mapping = {}
+        for instance in instances:
+            payload = self.encode(instance)
+            mapping.update((key, payload) for key in self.keys_of(instance))
+        return mapping
+
+    def fetch_many(self, ids: Iterable, loader: Callable) -> dict:
+        """
+        批次讀穿查詢
+        :param ids: id
+        :param loader: loader(未命中的id list) -> {id: ORMObject}
+        :return: {id: ORMObject}
+        """
+        keys = {id_: self.id_key(id_) for id_ in ids}
+        payloads = self._get_many(list(keys.values()))
+        found = {id_: self.decode(payloads[key]) for id_, key in keys.items() if key in payloads}
+        if missing := [id_ for id_ in keys if id_ not in found]:
+            loaded = loader(missing)
+            self._set_many(self._store(loaded.values()))
+            found.update(loaded)
+        return found
+
+    def refresh(self, instance, old=None):
+        """寫入後更新快取；old的key與新值不同時一併刪除"""
+        keys = self.keys_of(instance)
+        if old is not None:
+            self._delete(k for k in self.keys_of(old) if k not in keys)
+        payload = self.encode(instance)
+        self._set_many({k: payload for k in keys})
+
+    def invalidate(self, instance):
+        """刪除後清除快取"""
+        self._delete(self.keys_of(instance))
+
+    def fetch_count(self, kws: dict, loader: Callable) -> int:
+        """count讀穿快取(Redis hash，寫入時整個刪除)"""
+        client = self._sync_client
+        if client is None or not self.caches_count:
+            return loader()
+        field = self.count_field(kws)
+        try:
+            if (count := self._count_payload(client.hget(self._counts_key, field))) is not None:
+                return count
+        except Exception as e:
+            logger.warning('讀取count快取失敗: %s', e)
+        count = loader()
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.hset(self._counts_key, mapping=self._count_mapping(field, count))
+            pipe.expire(self._counts_key, self.policy.count_ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.warning('寫入count快取失敗: %s', e)
+        return count
+
+    def invalidate_counts(self):
+        """寫入後清除count快取"""
+        client = self._sync_client
+        if client is None or not self.caches_count:
+            return
+        try:
+            client.delete(self._counts_key)
+        except Exception as e:
+            logger.warning('刪除count快取失敗: %s', e)
+
+    # ---------- 異步 ----------
+    @property
+    def _async_client(self):
+        return self.manager.async_ if self.policy.use_redis else None
+
+    async def _aget(self, key):
+        if self.local is not None and (payload := self.local.get(key)) is not MISS:
+            return payload
+        client = self._async_client
+        if client is None:
+            return MISS
+        try:
+            raw = await client.get(key)
+        except Exception as e:
+            logger.warning('讀取Redis快取失敗 %s: %s', key, e)
+            return MISS
+        if raw is None:
+            return MISS
+        payload = self._loads(raw)
+        if self.local is not None:
+            self.local.set(key, payload)
+        return payload
+
+    async def _aget_many(self, keys: list) -> dict:
+        """異步批次讀取"""
+        found, remote = {}, []
+        for key in keys:
+            if self.local is not None and (payload := self.local.get(key)) is not MISS:
+                found[key] = payload
+            else:
+                remote.append(key)
+        client = self._async_client
+        if client is None or not remote:
+            return found
+        try:
+            raws = await client.mget(remote)
+        except Exception as e:
+            logger.warning('批次讀取Redis快取失敗: %s', e)
+            return found
+        for key, raw in zip(remote, raws):
+            if raw is not None:
+                found[key] = payload = self._loads(raw)
+                if self.local is not None:
+                    self.local.set(key, payload)
+        return found
+
+    async def _aset_many(self, mapping: dict):
+        if self.local is not None:
+            for key, payload in mapping.items():
+                self.local.set(key, payload)
+        client = self._async_client
+        if client is None or not mapping:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, payload in mapping.items():
+                pipe.set(key, self._dumps(payload), ex=self.policy.ttl)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning('寫入Redis快取失敗: %s', e)
+
+    async def _adelete(self, keys: Iterable[str]):
+        keys = list(keys)
+        if self.local is not None:
+            self.local.delete(*keys)
+        client = self._async_client
+        if client is None or not keys:
+            return
+        try:
+            await client.delete(*keys)
+        except Exception as e:
+            logger.warning('刪除Redis快取失敗: %s', e)
+
+    async def afetch(self, kws: dict, loader: Callable):
+        """異步讀穿查詢，loader為回傳coroutine的函式"""
+        key = self.key_for(kws)
+        if key is None:
+            return await loader()
+        if (payload := await self._aget(key)) is not MISS:
+            return self.decode(payload)
+        loop = asyncio.get_running_loop()
+        with self._mutex:
+            flights = self._async_flights.setdefault(loop, {})
+        while (future := flights.get(key)) is not None:
+            try:
+                payload = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():  # 查詢中的leader被取消，等待者重新選出leader
+                    continue
+                raise
+            return None if payload is None else self.decode(payload)
+        future = flights[key] = loop.create_future()
+        try:
+            instance = await loader()
+            payload = None
+            if instance is not None:
+                payload = self.encode(instance)
+                await self._aset_many({k: payload for k in self.keys_of(instance)})
+            future.set_result(payload)
+            return instance
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 無其他等待者時避免未取回例外的警告
+            raise
+        finally:
+            flights.pop(key, None)
+
+    async def afetch_many(self, ids: Iterable, loader: Callable) -> dict:
+        """異步批次讀穿查詢，loader為回傳coroutine的函式"""
+        keys = {id_: self.id_key(id_) for id_ in ids}
+        payloads = await self._aget_many(list(keys.values()))
+        found = {id_: self.decode(payloads[key]) for id_, key in keys.items() if key in payloads}
+        if missing := [id_ for id_ in keys if id_ not in found]:
+            loaded = await loader(missing)
+            await self._aset_many(self._store(loaded.values()))
+            found.update(loaded)
+        return found
+
+    async def arefresh(self, instance, old=None):
+        """異步寫入後更新快取"""
+        keys = self.keys_of(instance)
+        if old is not None:
+            await self._adelete(k for k in self.keys_of(old) if k not in keys)
+        payload = self.encode(instance)
+        await self._aset_many({k: payload for k in keys})
+
+    async def ainvalidate(self, instance):
+        """異步刪除後清除快取"""
+        await self._adelete(self.keys_of(instance))
+
+    async def afetch_count(self, kws: dict, loader: Callable) -> int:
+        """異步count讀穿快取，loader為回傳coroutine的函式"""
+        client = self._async_client
+        if client is None or not self.caches_count:
+            return await loader()
+        field = self.count_field(kws)
+        try:
+            if (count := self._count_payload(await client.hget(self._counts_key, field))) is not None:
+                return count
+        except Exception as e:
+            logger.warning('讀取count快取失敗: %s', e)
+        count = await loader()
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.hset(self._counts_key, mapping=self._count_mapping(field, count))
+            pipe.expire(self._counts_key, self.policy.count_ttl)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning('寫入count快取失敗: %s', e)
+        return count
+
+    async def ainvalidate_counts(self):
+        """異步寫入後清除count快取"""
+        client = self._async_client
+        if client is None or not self.caches_count:
+            return
+        try:
+            await client.delete(self._counts_key)
+        except Exception as e:
+            logger.warning('刪除count快取失敗: %s', e)
@@ -0,0 +1,230 @@
+"""
+寫入前去重(Redis set / Bloom filter)
+爬蟲大量重複抓到已入庫的資料時，先以自然鍵在Redis判斷是否看過，只有未看過的資料才送進MySQL
+"""
+import hashlib
+import math
+from typing import Iterable, Optional, Sequence, Union
+from ..database.statements import chunked
+
+BACKENDS = ('bloom', 'set', 'local')
+
+
+def bloom_size(capacity: int, error_rate: float, max_bytes: Optional[int] = None) -> tuple[int, int]:
+    """
+    依預估筆數與誤判率計算(位元數, 雜湊數)
+    max_bytes限制記憶體時位元數取上限，實際誤判率會高於error_rate(見expected_error_rate)
+    """
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    if max_bytes is not None:
+        bits = min(bits, max_bytes * 8)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def expected_error_rate(bits: int, hashes: int, count: int) -> float:
+    """放入count筆後的誤判率"""
+    return (1 - math.exp(-hashes * count / bits)) ** hashes
+
+
+class DedupPolicy:
+    """
+    AsyncService去重設定，設定於AsyncService.__dedup__
+    :param key_fields: 自然鍵欄位
+    :param backend: bloom(Redis位元陣列，SETBIT/GETBIT) / set(Redis set，無誤判但記憶體與筆數成正比)
+        / local(本機位元陣列，不使用Redis，單一程序或測試用)
+    :param capacity: bloom預估筆數
+    :param error_rate: bloom誤判率(未看過的資料被判定為看過而略過的機率)
+    :param max_bytes: bloom位元陣列的記憶體上限(bytes)
+    :param ttl: Redis key過期秒數(每次寫入時延長)，None為不過期
+    :param local: bloom在本機保留一份位元陣列，本程序看過的資料不必再查詢Redis(設定ttl時不使用)
+    :param prefix: Redis key前綴
+    """
+
+    def __init__(self, key_fields: Union[str, Sequence[str]], backend='bloom', capacity=1_000_000,
+                 error_rate=0.001, max_bytes: Optional[int] = None, ttl: Optional[int] = None, local=True,
+                 prefix='dedup'):
+        if backend not in BACKENDS:
+            raise ValueError(f'backend必須為{"/".join(BACKENDS)}其中之一')
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate必須介於0與1之間')
+        if capacity <= 0:
+            raise ValueError('capacity必須大於0')
+        self.key_fields: tuple = (key_fields,) if isinstance(key_fields, str) else tuple(key_fields)
+        self.backend = backend
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.ttl = ttl
+        self.local = local
+        self.prefix = prefix
+        self.bits, self.hashes = bloom_size(capacity, error_rate, max_bytes)
+        if backend != 'set' and self.bits > 2 ** 32:
+            raise ValueError('bloom位元數超過Redis字串上限(512MB)，請降低capacity或提高error_rate')
+
+    @property
+    def expected_error_rate(self) -> float:
+        """放滿capacity筆時的誤判率(max_bytes限制時高於error_rate)"""
+        return expected_error_rate(self.bits, self.hashes, self.capacity)
+
+
+class BitArray:
+    """純Python位元陣列"""
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self._data = bytearray((bits + 7) // 8)
+
+    def set(self, position: int):
+        self._data[position >> 3] |= 1 << (position & 7)
+
+    def get(self, position: int) -> bool:
+        return bool(self._data[position >> 3] & (1 << (position & 7)))
+
+    def set_all(self, positions: Iterable[int]):
+        for position in positions:
+            self.set(position)
+
+    def get_all(self, positions: Iterable[int]) -> bool:
+        return all(self.get(position) for position in positions)
+
+    def clear(self):
+        self._data = bytearray(len(self._data))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._data)
+
+
+class Deduplicator:
+    """
+    單一model的去重過濾
+    判定看過的資料不再寫入：bloom有error_rate的機率誤判(略過實際未入庫的資料)，set無誤判
+    資料刪除後仍視為看過，需要重新寫入時請clear
+    """
+
+    def __init__(self, policy: DedupPolicy, model, manager, batch_size=1000):
+        self.policy = policy
+        self.model = model
+        self.manager = manager  # _RedisManager
+        self.batch_size = batch_size  # 每次pipeline的key數
+        self.redis_key = f'{policy.prefix}:{model.__tablename__}:{policy.backend}'
+        # Redis key會過期時不保留本機陣列(過期後本機仍會判定為看過)
+        use_local = policy.backend == 'local' or (policy.backend == 'bloom' and policy.local and policy.ttl is None)
+        self.local: Optional[BitArray] = BitArray(policy.bits) if use_local else None
+
+    def key_of(self, item) -> str:
+        """dict或ORMObject的自然鍵"""
+        fields = self.policy.key_fields
+        if isinstance(item, dict):
+            return '|'.join(str(item[f]) for f in fields)
+        return '|'.join(str(getattr(item, f)) for f in fields)
+
+    def positions(self, key: str) -> list[int]:
+        """bloom位元位置(雙重雜湊，跨程序一致)"""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        bits = self.policy.bits
+        return [(h1 + i * h2) % bits for i in range(self.policy.hashes)]
+
+    def _local_seen(self, keys: list) -> list:
+        """本機位元陣列判定看過的key(未使用本機陣列時全為False)"""
+        if self.local is None:
+            return [False] * len(keys)
+        return [self.local.get_all(self.positions(key)) for key in keys]
+
+    def _remember(self, keys: list):
+        if self.local is not None:
+            for key in keys:
+                self.local.set_all(self.positions(key))
+
+    def _queue_seen(self, pipe, keys: list):
+        for key in keys:
+            if self.policy.backend == 'set':
+                pipe.sismember(self.redis_key, key)
+            else:
+                for position in self.positions(key):
+                    pipe.getbit(self.redis_key, position)
+
+    def _parse_seen(self, results: list, keys: list) -> list:
+        if self.policy.backend == 'set':
+            return [bool(result) for result in results]
+        hashes = self.policy.hashes
+        return [all(results[index * hashes:(index + 1) * hashes]) for index in range(len(keys))]
+
+    def _queue_add(self, pipe, keys: list):
+        for key in keys:
+            if self.policy.backend == 'set':
+                pipe.sadd(self.redis_key, key)
+            else:
+                for position in self.positions(key):
+                    pipe.setbit(self.redis_key, position, 1)
+        if self.policy.ttl is not None:
+            pipe.expire(self.redis_key, self.policy.ttl)
+
+    # ---------- 同步 ----------
+    def seen_many(self, keys: Iterable[str]) -> list[bool]:
+        """依輸入順序回傳是否看過，本機未命中的key每批以一次pipeline查詢"""
+        keys = list(keys)
+        seen = self._local_seen(keys)
+        if self.policy.backend == 'local':
+            return seen
+        missing = [index for index, hit in enumerate(seen) if not hit]
+        for chunk in chunked(missing, self.batch_size):
+            chunk_keys = [keys[index] for index in chunk]
+            pipe = self.manager.sync_.pipeline(transaction=False)
+            self._queue_seen(pipe, chunk_keys)
+            for index, hit in zip(chunk, self._parse_seen(pipe.execute(), chunk_keys)):
+                seen[index] = hit
+        self._remember([key for key, hit in zip(keys, seen) if hit])
+        return seen
+
+    def add_many(self, keys: Iterable[str]):
+        """標記為看過(寫入資料庫成功後呼叫)"""
+        keys = list(keys)
+        self._remember(keys)
+        if self.policy.backend == 'local':
+            return
+        for chunk in chunked(keys, self.batch_size):
+            pipe = self.manager.sync_.pipeline(transaction=False)
+            self._queue_add(pipe, chunk)
+            pipe.execute()
+
+    def clear(self):
+        if self.local is not None:
+            self.local.clear()
+        if self.policy.backend != 'local':
+            self.manager.sync_.delete(self.redis_key)
+
+    # ---------- 異步 ----------
+    async def aseen_many(self, keys: Iterable[str]) -> list[bool]:
+        """異步seen_many"""
+        keys = list(keys)
+        seen = self._local_seen(keys)
+        if self.policy.backend == 'local':
+            return seen
+        missing = [index for index, hit in enumerate(seen) if not hit]
+        for chunk in chunked(missing, self.batch_size):
+            chunk_keys = [keys[index] for index in chunk]
+            pipe = self.manager.async_.pipeline(transaction=False)
+            self._queue_seen(pipe, chunk_keys)
+            for index, hit in zip(chunk, self._parse_seen(await pipe.execute(), chunk_keys)):
+                seen[index] = hit
+        self._remember([key for key, hit in zip(keys, seen) if hit])
+        return seen
+
+    async def aadd_many(self, keys: Iterable[str]):
+        """異步add_many"""
+        keys = list(keys)
+        self._remember(keys)
+        if self.policy.backend == 'local':
+            return
+        for chunk in chunked(keys, self.batch_size):
+            pipe = self.manager.async_.pipeline(transaction=False)
+            self._queue_add(pipe, chunk)
+            await pipe.execute()
+
+    async def aclear(self):
+        if self.local is not None:
+            self.local.clear()
+        if self.policy.backend != 'local':
+            await self.manager.async_.delete(self.redis_key)
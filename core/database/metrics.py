@@ -0,0 +1,256 @@
+"""
+查詢計時與慢查詢紀錄
+db.instrument(slow_ms=200)後，Service/AsyncService每個方法與每個SQL語句都會計時
+db.metrics.snapshot() -> p50/p99、筆數、慢查詢次數、連線池等待時間
+"""
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from ..database.pool import percentile, _ms
+from ..database.redisdb import dumps_json
+
+logger = logging.getLogger(__name__)
+
+_current_op: ContextVar[Optional[str]] = ContextVar('current_op', default=None)  # 'Model.method'
+_MAX_PARAMS_LENGTH = 500
+_EXPLAIN_PREFIX = {'mysql': 'EXPLAIN ', 'sqlite': 'EXPLAIN QUERY PLAN '}
+
+
+class Histogram:
+    """延遲分佈(保留最近samples筆樣本計算百分位數)"""
+
+    def __init__(self, samples=1000):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples: deque = deque(maxlen=samples)
+
+    def record(self, seconds: float, rows: Optional[int] = None, error=False):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._samples.append(seconds)
+        if rows is not None and rows > 0:
+            self.rows += rows
+        if error:
+            self.errors += 1
+
+    def snapshot(self) -> dict:
+        samples = sorted(self._samples)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'avg_ms': _ms(self.total / self.count) if self.count else None,
+            'p50_ms': _ms(percentile(samples, 50)),
+            'p90_ms': _ms(percentile(samples, 90)),
+            'p99_ms': _ms(percentile(samples, 99)),
+            'max_ms': _ms(self.max),
+        }
+
+
+class QueryMetrics:
+    """
+    查詢統計
+    operations: 依 'Model.method' 統計Service方法的延遲與回傳筆數
+    statements: 依SQL動詞(SELECT/INSERT/...)統計語句延遲，慢查詢依所屬方法紀錄
+    """
+
+    def __init__(self, slow_ms: Optional[float] = 200, explain=False, samples=1000, pool_stats=None):
+        """
+        :param slow_ms: 慢查詢門檻(毫秒)，超過時記錄語句與參數；None為不記錄
+        :param explain: 慢SELECT是否同時記錄EXPLAIN結果(會多一次查詢)
+        :param samples: 每個分佈保留的樣本數
+        :param pool_stats: 回傳連線池統計的函式(db.pool_stats)
+        """
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.samples = samples
+        self.slow_queries = 0
+        self.operations: dict[str, Histogram] = {}
+        self.statements: dict[str, Histogram] = {}
+        self._pool_stats = pool_stats
+        self._lock = threading.Lock()
+        self._engines: list = []
+
+    def _histogram(self, table: dict, key: str) -> Histogram:
+        if (histogram := table.get(key)) is None:
+            with self._lock:
+                histogram = table.setdefault(key, Histogram(self.samples))
+        return histogram
+
+    # ---------- Service方法 ----------
+    def record(self, op: str, seconds: float, rows: Optional[int] = None, error=False):
+        """記錄Service方法"""
+        self._histogram(self.operations, op).record(seconds, rows, error)
+
+    # ---------- SQL語句 ----------
+    def attach(self, engine):
+        """綁定同步engine(異步engine請傳入async_engine.sync_engine)"""
+        if engine in self._engines:
+            return self
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+        self._engines.append(engine)
+        return self
+
+    def detach(self):
+        for engine in self._engines:
+            event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.remove(engine, 'handle_error', self._handle_error)
+        self._engines.clear()
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start')
+        if not starts:
+            return
+        seconds = time.perf_counter() - starts.pop()
+        if conn.info.get('explaining'):
+            return
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+        rowcount = cursor.rowcount if verb != 'SELECT' else None
+        self._histogram(self.statements, verb).record(seconds, rowcount)
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            self._log_slow(conn, statement, parameters, seconds, verb, executemany)
+
+    def _handle_error(self, context):
+        conn = context.connection
+        if conn is not None and (starts := conn.info.get('query_start')):
+            starts.pop()
+            if context.statement:
+                verb = context.statement.lstrip().split(None, 1)[0].upper()
+                self._histogram(self.statements, verb).errors += 1
+
+    def _log_slow(self, conn, statement: str, parameters, seconds: float, verb: str, executemany: bool):
+        with self._lock:
+            self.slow_queries += 1
+        params = repr(parameters)
+        if len(params) > _MAX_PARAMS_LENGTH:
+            params = params[:_MAX_PARAMS_LENGTH] + '...'
+        plan = None
+        if self.explain and verb == 'SELECT' and not executemany:
+            plan = self._explain(conn, statement, parameters)
+        logger.warning(
+            '慢查詢 %.1fms [%s] %s | params=%s%s',
+            seconds * 1000, _current_op.get() or '-', ' '.join(statement.split()), params,
+            f' | explain={plan}' if plan is not None else '',
+        )
+
+    @staticmethod
+    def _explain(conn, statement: str, parameters):
+        prefix = _EXPLAIN_PREFIX.get(conn.dialect.name)
+        if prefix is None:
+            return None
+        conn.info['explaining'] = True
+        try:
+            return [tuple(row) for row in conn.exec_driver_sql(prefix + statement, parameters)]
+        except Exception as e:
+            return f'EXPLAIN失敗: {e}'
+        finally:
+            conn.info['explaining'] = False
+
+    # ---------- 輸出 ----------
+    def snapshot(self) -> dict:
+        """統計快照"""
+        return {
+            'operations': {op: histogram.snapshot() for op, histogram in sorted(self.operations.items())},
+            'statements': {verb: histogram.snapshot() for verb, histogram in sorted(self.statements.items())},
+            'slow_queries': self.slow_queries,
+            'pool': self._pool_stats() if self._pool_stats is not None else None,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+            self.statements.clear()
+            self.slow_queries = 0
+
+    def push(self, client, key='metrics:db', ttl=300):
+        """寫入Redis供dashboard讀取"""
+        client.set(key, dumps_json(self.snapshot()), ex=ttl)
+
+    async def apush(self, client, key='metrics:db', ttl=300):
+        """異步寫入Redis"""
+        await client.set(key, dumps_json(self.snapshot()), ex=ttl)
+
+
+def _row_count(result) -> Optional[int]:
+    """Service方法回傳值的筆數: list為長度，單筆為1，None為0，其他(int等)不計"""
+    if isinstance(result, list):
+        return len(result)
+    if result is None:
+        return 0
+    if isinstance(result, (int, bool, float, dict, str)):
+        return None
+    return 1
+
+
+def instrument_method(fn, metrics_of):
+    """
+    包裝Service方法計時
+    :param metrics_of: 回傳目前QueryMetrics(未啟用時為None)的函式
+    巢狀呼叫同名方法(子類別super())只記錄最外層
+    """
+    name = fn.__name__
+
+    def op_of(service) -> str:
+        model = service.__model__
+        return f'{model.__name__ if model is not None else type(service).__name__}.{name}'
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            if (metrics := metrics_of()) is None or _current_op.get() == (op := op_of(self)):
+                return await fn(self, *args, **kwargs)
+            token = _current_op.set(op)
+            start = time.perf_counter()
+            try:
+                result = await fn(self, *args, **kwargs)
+            except BaseException:
+                metrics.record(op, time.perf_counter() - start, error=True)
+                raise
+            finally:
+                _current_op.reset(token)
+            metrics.record(op, time.perf_counter() - start, _row_count(result))
+            return result
+    else:
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            if (metrics := metrics_of()) is None or _current_op.get() == (op := op_of(self)):
+                return fn(self, *args, **kwargs)
+            token = _current_op.set(op)
+            start = time.perf_counter()
+            try:
+                result = fn(self, *args, **kwargs)
+            except BaseException:
+                metrics.record(op, time.perf_counter() - start, error=True)
+                raise
+            finally:
+                _current_op.reset(token)
+            metrics.record(op, time.perf_counter() - start, _row_count(result))
+            return result
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_class(cls, metrics_of):
+    """包裝類別自身定義的公開方法(不含generator與staticmethod/classmethod)"""
+    for name, attr in list(vars(cls).items()):
+        if (name.startswith('_') or not inspect.isfunction(attr) or getattr(attr, '__instrumented__', False)
+                or inspect.isgeneratorfunction(attr) or inspect.isasyncgenfunction(attr)):
+            continue
+        setattr(cls, name, instrument_method(attr, metrics_of))
@@ -2,13 +2,22 @@
 model mixin
 """
 from ..database.base import TableTypes as Types
-from utils import taipei_now
+from utils import local_now_naive
 
 
 class Mixin:
     """混合類"""
     __mixin_columns__ = ['id', 'created_at', 'updated_at']
+    __timestamp_columns__ = ('created_at', 'updated_at')  # 批次新增時整批共用同一時間
 
     id = Types.Column(Types.Integer, primary_key=True, autoincrement=True)
-    created_at = Types.Column(Types.DateTime(timezone=True), server_default=taipei_now())
-    updated_at = Types.Column(Types.DateTime(timezone=True), server_default=taipei_now(), onupdate=taipei_now())
+    # default/onupdate於每次寫入時取當地時間；server_default供不經過ORM的寫入使用(raw SQL、LOAD DATA)
+    # CURRENT_TIMESTAMP依連線的session time_zone，db的連線已設為LOCAL_TZ(見_SqlalchemyManager的time_zone)，
+    # 其他客戶端直接寫入時需先 SET time_zone = '+08:00'，否則時間會差一個時區
+    created_at = Types.Column(
+        Types.DateTime(timezone=True), default=local_now_naive, server_default=Types.func.current_timestamp()
+    )
+    updated_at = Types.Column(
+        Types.DateTime(timezone=True), default=local_now_naive, onupdate=local_now_naive,
+        server_default=Types.func.current_timestamp(),
+    )
@@ -1,25 +1,115 @@
 """
 伺服器Mysql資料庫封裝
 """
+import asyncio
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Iterator, Optional, Sequence, Union
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, declarative_base, sessionmaker, scoped_session
 from sqlalchemy import delete, select, update
-from constants import MYSQL_URL
+from constants import LOCAL_TZ, MYSQL_REPLICA_URLS, MYSQL_URL
+from exceptions import DBOptionError
+from utils import utc_offset
 from ..database.base import DBInterface, TableTypes
+from ..database.pool import PoolStats
+from ..database.metrics import QueryMetrics
+from ..database.replica import Replica, ReplicaSet, replication_lag
+from ..database.shard import HashShardMap, Shard, ShardMap
+from ..database.statements import replica_status_stmt
+
+if TYPE_CHECKING:  # sqlalchemy.ext.asyncio於第一次使用異步engine時才載入
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+_current_uow: ContextVar[Optional['UnitOfWork']] = ContextVar('current_uow', default=None)
+_last_write: ContextVar[Optional[float]] = ContextVar('last_write', default=None)  # 目前context最後一次寫入時間
+_force_primary: ContextVar[bool] = ContextVar('force_primary', default=False)
+_current_shard: ContextVar[Optional[str]] = ContextVar('current_shard', default=None)
+
+
+class UnitOfWork:
+    """異步工作單元：多個AsyncService呼叫共用同一個session/連線，離開時一次提交"""
+
+    def __init__(self, session: 'AsyncSession'):
+        self.session = session
+
+    async def commit(self):
+        """提前提交"""
+        await self.session.commit()
+
+    async def rollback(self):
+        """回滾"""
+        await self.session.rollback()
 
 
 class _SqlalchemyManager(DBInterface, TableTypes):
-    """Mysql資料庫"""
-    def __init__(self):
-        self.sync_url = f'mysql:{MYSQL_URL}'
-        self.async_url = f'mysql+aiomysql:{MYSQL_URL}'
-        self.engine = None
-        self.session_factory = None
-        self.async_engine = None
-        self.async_session_factory = None
+    """
+    Mysql資料庫
+    engine與連線池於第一次使用時才建立，同步與異步分開建立(只用其中一種的程序不會建立另一個)
+    fork後子程序會捨棄繼承的連線池，於第一次使用時重建
+    設定從庫時讀取分流至從庫，寫入、交易與工作單元使用主庫
+    設定分片時，db.using_shard()區塊內的session改用該分片的engine(分片模型由Service依分片鍵路由)
+    """
+    def __init__(self, url=MYSQL_URL, echo=False, pool_size=10, max_overflow=20, pool_recycle=3600,
+                 pool_pre_ping=True, pool_timeout=30, leak_after=60, replica_urls: Sequence[str] = MYSQL_REPLICA_URLS,
+                 read_strategy='round_robin', read_your_writes: float = 2, replica_retry: float = 30,
+                 max_replica_lag: Optional[float] = None, local_infile=False, time_zone: Optional[str] = LOCAL_TZ):
+        """
+        :param url: 資料庫位址(不含driver)
+        :param echo: 是否輸出SQL(除錯用)
+        :param pool_size: 連線池常駐連線數
+        :param max_overflow: 連線池可額外建立的連線數
+        :param pool_recycle: 連線回收秒數
+        :param pool_pre_ping: 借出前是否檢查連線
+        :param pool_timeout: 等待連線逾時秒數
+        :param leak_after: 連線借出超過此秒數視為疑似洩漏
+        :param replica_urls: 從庫位址(不含driver)
+        :param read_strategy: 從庫選擇策略 round_robin/least_connections
+        :param read_your_writes: 同一context寫入後此秒數內的讀取仍使用主庫(避免讀到複製延遲前的資料)
+        :param replica_retry: 從庫連線失敗後停用的秒數，之後再次嘗試
+        :param max_replica_lag: check_replicas時複製延遲超過此秒數即停用該從庫，None為不檢查
+        :param local_infile: 允許LOAD DATA LOCAL INFILE(Service.load_file使用，伺服器也需開啟local_infile)
+        :param time_zone: 連線的session time_zone(建立engine時換算為時差)，使CURRENT_TIMESTAMP等server_default
+            與Python端寫入的當地時間一致；None為沿用伺服器設定
+        """
+        self.sync_url = f'mysql:{url}'
+        self.async_url = f'mysql+aiomysql:{url}'
+        self.echo = echo
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_recycle = pool_recycle
+        self.pool_pre_ping = pool_pre_ping
+        self.pool_timeout = pool_timeout
+        self.leak_after = leak_after
+        self._engine = None
+        self._session_factory = None
+        self._scoped_session: Optional[scoped_session] = None
+        self._local = threading.local()  # 同步交易深度(與scoped_session同為thread-local)
+        self._async_engine = None
+        self._async_session_factory = None
+        self._engine_lock = threading.Lock()
+        self.sync_pool_stats: Optional[PoolStats] = None
+        self.async_pool_stats: Optional[PoolStats] = None
+        self.metrics: Optional[QueryMetrics] = None  # db.instrument()後啟用
+        self.read_your_writes = read_your_writes
+        self.max_replica_lag = max_replica_lag
+        self.local_infile = local_infile
+        self.time_zone = time_zone
+        self.replicas = ReplicaSet(read_strategy, replica_retry)
+        for replica_url in replica_urls:
+            self.add_replica(f'mysql:{replica_url}', f'mysql+aiomysql:{replica_url}')
+        self.shards: dict[str, Shard] = {}
+        self.shard_map: Optional[ShardMap] = None  # 未設定時依分片名稱雜湊(HashShardMap)
+        self._default_shard_map: Optional[ShardMap] = None
         self.Model = declarative_base()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
 
     @property
     def query(self):
@@ -36,31 +126,685 @@ class _SqlalchemyManager(DBInterface, TableTypes):
         """更新"""
         return update
 
+    @property
+    def engine(self):
+        """同步engine(第一次使用時建立)"""
+        if self._engine is None:
+            self.create_sync_engine()
+        return self._engine
+
+    @property
+    def session_factory(self) -> sessionmaker:
+        if self._session_factory is None:
+            self.create_sync_engine()
+        return self._session_factory
+
+    @property
+    def scoped_session(self) -> scoped_session:
+        if self._scoped_session is None:
+            self.create_sync_engine()
+        return self._scoped_session
+
+    @property
+    def async_engine(self):
+        """異步engine(第一次使用時建立)"""
+        if self._async_engine is None:
+            self.create_async_engine()
+        return self._async_engine
+
+    @property
+    def async_session_factory(self) -> sessionmaker:
+        if self._async_session_factory is None:
+            self.create_async_engine()
+        return self._async_session_factory
+
     @property
     def session(self) -> scoped_session:
-        """會話"""
-        return scoped_session(self.session_factory)
+        """會話(thread-local，同一執行緒共用)"""
+        return self.scoped_session
+
+    @property
+    def in_transaction(self) -> bool:
+        """目前執行緒是否在db.transaction()區塊內"""
+        return getattr(self._local, 'depth', 0) > 0
+
+    @contextmanager
+    def transaction(self) -> Iterator[Session]:
+        """
+        同步交易
+        with db.transaction():
+            service_a.create(...)
+            service_b.update(...)
+        區塊內的Service呼叫共用同一session且只flush，離開時一次提交，發生錯誤時回滾
+        """
+        session = self.scoped_session()
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+        try:
+            yield session
+            if self._local.depth == 1:
+                session.commit()
+                self._mark_written()
+        except BaseException:
+            if self._local.depth == 1:
+                session.rollback()
+            raise
+        finally:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                self.scoped_session.remove()
+
+    @contextmanager
+    def session_scope(self, commit=False, isolated=False) -> Iterator[Session]:
+        """
+        Service使用的session範圍
+        :param commit: 寫入操作，結束時提交(在transaction內只flush)；讀取操作不提交
+        :param isolated: 使用獨立session(串流查詢跨越yield時避免被同執行緒的其他呼叫關閉)
+        設定從庫時讀取操作使用從庫的獨立session，從庫皆不可用時改用主庫
+        在db.using_shard()內時使用該分片的獨立session(不加入db.transaction())
+        """
+        if (shard := self._active_shard()) is not None:
+            with self._shard_scope(shard, commit) as session:
+                yield session
+            return
+        if self.in_transaction:
+            session = self.scoped_session()
+            yield session
+            if commit:
+                session.flush()
+            return
+        session, replica = self._replica_session() if not commit and self._reads_replica() else (None, None)
+        if session is None:
+            session = self.session_factory() if isolated else self.scoped_session()
+        try:
+            if replica is None:
+                self._checkout(session)
+            yield session
+            if commit:
+                session.commit()
+                self._mark_written()
+        except BaseException as e:
+            session.rollback()
+            if replica is not None:
+                self._replica_failed(replica, e)
+            raise
+        finally:
+            if replica is not None:
+                replica.release()
+                session.close()
+            elif isolated:
+                session.close()
+            else:
+                self.scoped_session.remove()
+
+    # ---------- 分片 ----------
+    def add_shard(self, name: str, sync_url: str, async_url: str) -> Shard:
+        """
+        新增分片(含driver的完整位址)
+        db.add_shard('s0', 'mysql://...', 'mysql+aiomysql://...')
+        """
+        shard = self.shards[name] = Shard(name, sync_url, async_url)
+        self._default_shard_map = HashShardMap(list(self.shards))
+        return shard
+
+    def shard_for(self, model, value) -> str:
+        """分片鍵值對應的分片名稱(model的__shard_map__優先，其次為db.shard_map)"""
+        shard_map = getattr(model, '__shard_map__', None) or self.shard_map or self._default_shard_map
+        if shard_map is None:
+            raise DBOptionError('尚未設定分片。', payload={'model': model.__name__})
+        name = shard_map.shard_for(value)
+        if name not in self.shards:
+            raise DBOptionError('分片不存在。', payload={'shard': name, 'value': value})
+        return name
+
+    def shards_for(self, model, values) -> list:
+        """多個分片鍵值(IN條件)對應的分片名稱"""
+        shard_map = getattr(model, '__shard_map__', None) or self.shard_map or self._default_shard_map
+        if shard_map is None:
+            raise DBOptionError('尚未設定分片。', payload={'model': model.__name__})
+        names = shard_map.shards_for(values)
+        if unknown := [name for name in names if name not in self.shards]:
+            raise DBOptionError('分片不存在。', payload={'shard': unknown})
+        return names
+
+    @property
+    def current_shard(self) -> Optional[str]:
+        """目前context使用的分片"""
+        return _current_shard.get()
+
+    @contextmanager
+    def using_shard(self, name: str) -> Iterator[None]:
+        """
+        區塊內的Service呼叫使用指定分片(同步與異步皆可用)
+        with db.using_shard('s0'):
+            service.count()
+        """
+        if name not in self.shards:
+            raise ValueError(f'分片不存在: {name}')
+        token = _current_shard.set(name)
+        try:
+            yield
+        finally:
+            _current_shard.reset(token)
+
+    def _active_shard(self) -> Optional[Shard]:
+        return self.shards[name] if (name := _current_shard.get()) is not None else None
+
+    @contextmanager
+    def _shard_scope(self, shard: Shard, commit: bool) -> Iterator[Session]:
+        session = self._node_factory(shard)()
+        try:
+            self._checkout(session, shard.sync_pool_stats)
+            yield session
+            if commit:
+                session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    @asynccontextmanager
+    async def _ashard_scope(self, shard: Shard, commit: bool) -> AsyncIterator['AsyncSession']:
+        session = self._node_async_factory(shard)()
+        try:
+            await self._acquire(session, shard.async_pool_stats)
+            yield session
+            if commit:
+                await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+    def _nodes(self) -> list:
+        """從庫與分片"""
+        return [*self.replicas, *self.shards.values()]
+
+    # ---------- 讀寫分離 ----------
+    def add_replica(self, sync_url: str, async_url: str, name: Optional[str] = None) -> Replica:
+        """
+        新增從庫(含driver的完整位址)
+        db.add_replica('mysql://...', 'mysql+aiomysql://...')
+        """
+        return self.replicas.add(sync_url, async_url, name)
+
+    @staticmethod
+    @contextmanager
+    def use_primary() -> Iterator[None]:
+        """
+        區塊內的讀取使用主庫(同步與異步皆可用)
+        with db.use_primary():
+            service.get(id_)
+        """
+        token = _force_primary.set(True)
+        try:
+            yield
+        finally:
+            _force_primary.reset(token)
 
-    async def async_session(self) -> AsyncSession:
-        """異步會話"""
+    @staticmethod
+    def _mark_written():
+        _last_write.set(time.monotonic())
+
+    def _reads_replica(self) -> bool:
+        """
+        目前的讀取是否使用從庫
+        寫入時間記錄於context，只影響同一執行緒/task之後的讀取；db.gather等背景task內的寫入不會傳回呼叫端
+        """
+        if not len(self.replicas) or _force_primary.get():
+            return False
+        last_write = _last_write.get()
+        return last_write is None or time.monotonic() - last_write >= self.read_your_writes
+
+    def _replica_session(self) -> tuple[Optional[Session], Optional[Replica]]:
+        """依策略取得從庫session，連線失敗的從庫停用後嘗試下一個，皆失敗時回傳(None, None)"""
+        for replica in self.replicas.candidates():
+            session = self._node_factory(replica)()
+            try:
+                self._checkout(session, replica.sync_pool_stats)
+            except (DBAPIError, PoolTimeoutError) as e:
+                session.close()
+                if isinstance(e, DBAPIError):
+                    self.replicas.mark_down(replica, e)
+                continue
+            if not replica.healthy:
+                replica.mark_up()
+            replica.acquire()
+            return session, replica
+        return None, None
+
+    async def _replica_async_session(self) -> tuple[Optional['AsyncSession'], Optional[Replica]]:
+        """_replica_session的異步版本"""
+        for replica in self.replicas.candidates():
+            session = self._node_async_factory(replica)()
+            try:
+                await self._acquire(session, replica.async_pool_stats)
+            except (DBAPIError, PoolTimeoutError) as e:
+                await session.close()
+                if isinstance(e, DBAPIError):
+                    self.replicas.mark_down(replica, e)
+                continue
+            if not replica.healthy:
+                replica.mark_up()
+            replica.acquire()
+            return session, replica
+        return None, None
+
+    def _replica_failed(self, replica: Replica, error: BaseException):
+        """查詢中斷線時停用從庫(SQL錯誤等不影響)"""
+        if isinstance(error, DBAPIError) and error.connection_invalidated:
+            self.replicas.mark_down(replica, error)
+
+    def _node_factory(self, node: Union[Replica, Shard]) -> sessionmaker:
+        """從庫/分片的同步session工廠(第一次使用時建立engine)"""
+        if node.session_factory is None:
+            with self._engine_lock:
+                if node.session_factory is None:
+                    engine = create_engine(node.sync_url, **self._engine_options(node.sync_url))
+                    node.sync_pool_stats = PoolStats(
+                        f'sync:{node.name}', self._capacity(node.sync_url), self.leak_after
+                    ).attach(engine)
+                    if self.metrics is not None:
+                        self.metrics.attach(engine)
+                    node.engine = engine
+                    node.session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+        return node.session_factory
+
+    def _node_async_factory(self, node: Union[Replica, Shard]) -> sessionmaker:
+        """從庫/分片的異步session工廠(第一次使用時建立engine)"""
+        if node.async_session_factory is None:
+            from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+            with self._engine_lock:
+                if node.async_session_factory is None:
+                    engine = create_async_engine(node.async_url, **self._engine_options(node.async_url))
+                    node.async_pool_stats = PoolStats(
+                        f'async:{node.name}', self._capacity(node.async_url), self.leak_after
+                    ).attach(engine.sync_engine)
+                    if self.metrics is not None:
+                        self.metrics.attach(engine.sync_engine)
+                    node.async_engine = engine
+                    node.async_session_factory = sessionmaker(
+                        bind=engine, class_=AsyncSession, expire_on_commit=False
+                    )
+        return node.async_session_factory
+
+    def _check_result(self, replica: Replica, status, dialect: str):
+        """依複製狀態更新健康狀態"""
+        if self.max_replica_lag is not None and replica_status_stmt(dialect) is not None:
+            lag = replication_lag(status)
+            if lag is None:
+                self.replicas.mark_down(replica, '複製未執行')
+                return
+            if lag > self.max_replica_lag:
+                self.replicas.mark_down(replica, f'複製延遲{lag:.0f}秒')
+                return
+        replica.mark_up()
+
+    def check_replicas(self) -> list[dict]:
+        """
+        主動檢查所有從庫(SELECT 1，設定max_replica_lag時另檢查複製延遲)並更新健康狀態
+        可由排程定期呼叫；未呼叫時僅在連線失敗時停用從庫
+        """
+        for replica in self.replicas:
+            try:
+                with self._node_factory(replica)() as session:
+                    session.execute(select(1))
+                    dialect = session.bind.dialect.name
+                    status = None
+                    if self.max_replica_lag is not None and (stmt := replica_status_stmt(dialect)) is not None:
+                        status = session.execute(stmt).mappings().first()
+            except Exception as e:
+                self.replicas.mark_down(replica, e)
+                continue
+            self._check_result(replica, status, dialect)
+        return self.replicas.snapshot()
+
+    async def acheck_replicas(self) -> list[dict]:
+        """check_replicas的異步版本"""
+        for replica in self.replicas:
+            try:
+                async with self._node_async_factory(replica)() as session:
+                    await session.execute(select(1))
+                    dialect = session.bind.dialect.name
+                    status = None
+                    if self.max_replica_lag is not None and (stmt := replica_status_stmt(dialect)) is not None:
+                        status = (await session.execute(stmt)).mappings().first()
+            except Exception as e:
+                self.replicas.mark_down(replica, e)
+                continue
+            self._check_result(replica, status, dialect)
+        return self.replicas.snapshot()
+
+    async def monitor_replicas(self, interval: float = 5):
+        """
+        定期檢查從庫，於背景task執行
+        task = asyncio.create_task(db.monitor_replicas())
+        """
+        while True:
+            await self.acheck_replicas()
+            await asyncio.sleep(interval)
+
+    @property
+    def in_unit_of_work(self) -> bool:
+        """目前context是否在db.unit_of_work()區塊內"""
+        return _current_uow.get() is not None
+
+    @staticmethod
+    def detach_unit_of_work():
+        """
+        目前context脫離工作單元(於背景task開頭呼叫)
+        create_task會複製呼叫端的context，未脫離時背景task會與呼叫端並行使用同一session
+        """
+        _current_uow.set(None)
+
+    async def async_session(self) -> 'AsyncSession':
+        """異步會話(呼叫端需自行關閉，Service請使用async_scope)"""
         return self.async_session_factory()
 
-    def create_engine(self):
-        """建立連建"""
-        self.engine = create_engine(self.sync_url)
-        self.session_factory = sessionmaker(bind=self.engine)
-        self.async_engine = create_async_engine(self.async_url, future=True, echo=True)
-        self.async_session_factory = sessionmaker(bind=self.async_engine, class_=AsyncSession)
+    @property
+    def pool_capacity(self) -> Optional[int]:
+        """連線池上限，sqlite不設定連線池大小時為None"""
+        return self._capacity(self.sync_url)
+
+    def _capacity(self, url: str) -> Optional[int]:
+        if url.startswith('sqlite'):
+            return None
+        return self.pool_size + self.max_overflow
+
+    def _engine_options(self, url: str) -> dict:
+        """engine連線池參數，sqlite由sqlalchemy自行決定連線池"""
+        options = {'echo': self.echo, 'pool_recycle': self.pool_recycle, 'pool_pre_ping': self.pool_pre_ping}
+        if not url.startswith('sqlite'):
+            options.update(pool_size=self.pool_size, max_overflow=self.max_overflow, pool_timeout=self.pool_timeout)
+            connect_args = {}
+            if self.local_infile:
+                connect_args['local_infile'] = True
+            if self.time_zone is not None:
+                connect_args['init_command'] = f"SET time_zone = '{utc_offset(self.time_zone)}'"
+            if connect_args:
+                options['connect_args'] = connect_args
+        return options
+
+    def create_engine(self, sync=True, async_=True):
+        """
+        建立連建(可省略，engine會在第一次使用時建立)
+        :param sync: 建立同步engine
+        :param async_: 建立異步engine
+        """
+        if sync:
+            self.create_sync_engine()
+        if async_:
+            self.create_async_engine()
+
+    def create_sync_engine(self):
+        """建立同步engine與session工廠(已建立時略過)"""
+        with self._engine_lock:
+            if self._engine is not None:
+                return
+            engine = create_engine(self.sync_url, **self._engine_options(self.sync_url))
+            # expire_on_commit=False: 提交後仍可讀取屬性，轉ORMObject不需再查詢
+            self._session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+            self._scoped_session = scoped_session(self._session_factory)
+            self.sync_pool_stats = PoolStats('sync', self.pool_capacity, self.leak_after).attach(engine)
+            if self.metrics is not None:
+                self.metrics.attach(engine)
+            self._engine = engine
+
+    def create_async_engine(self):
+        """建立異步engine與session工廠(已建立時略過)"""
+        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+        with self._engine_lock:
+            if self._async_engine is not None:
+                return
+            engine = create_async_engine(self.async_url, **self._engine_options(self.async_url))
+            # expire_on_commit=False: 提交後仍可讀取屬性，轉ORMObject不需再查詢
+            self._async_session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+            self.async_pool_stats = PoolStats('async', self.pool_capacity, self.leak_after).attach(
+                engine.sync_engine
+            )
+            if self.metrics is not None:
+                self.metrics.attach(engine.sync_engine)
+            self._async_engine = engine
+
+    def _after_fork(self):
+        """
+        子程序捨棄繼承的連線(不關閉，父程序仍在使用)，第一次使用時重建
+        """
+        self._engine_lock = threading.Lock()
+        self._local = threading.local()
+        if self._engine is not None:
+            self._engine.dispose(close=False)
+            self._scoped_session = scoped_session(self._session_factory)
+            self.sync_pool_stats.reset()
+        if self._async_engine is not None:
+            self._async_engine.sync_engine.dispose(close=False)
+            self.async_pool_stats.reset()
+        for replica in self.replicas:
+            replica.reset()
+        for node in self._nodes():
+            if node.engine is not None:
+                node.engine.dispose(close=False)
+                node.sync_pool_stats.reset()
+            if node.async_engine is not None:
+                node.async_engine.sync_engine.dispose(close=False)
+                node.async_pool_stats.reset()
+
+    def instrument(self, slow_ms: Optional[float] = 200, explain=False, samples=1000) -> QueryMetrics:
+        """
+        啟用查詢計時(Service方法與SQL語句)，參數見QueryMetrics
+        metrics = db.instrument(slow_ms=200)
+        metrics.snapshot()
+        """
+        self.uninstrument()
+        self.metrics = QueryMetrics(slow_ms, explain, samples, pool_stats=self.pool_stats)
+        for engine in self._sync_engines():
+            self.metrics.attach(engine)
+        return self.metrics
+
+    def _sync_engines(self) -> Iterator:
+        """已建立的engine(異步engine取其sync_engine)，含從庫與分片"""
+        engines = [self._engine, self._async_engine and self._async_engine.sync_engine]
+        for node in self._nodes():
+            engines += [node.engine, node.async_engine and node.async_engine.sync_engine]
+        return (engine for engine in engines if engine is not None)
+
+    def uninstrument(self):
+        """停用查詢計時"""
+        if self.metrics is not None:
+            self.metrics.detach()
+            self.metrics = None
 
     async def close_engine(self):
-        """關閉連線"""
-        self.engine.dispose()
-        await self.async_engine.dispose()
+        """關閉連線，之後再使用時會重新建立"""
+        if self._engine is not None:
+            self._scoped_session.remove()
+            self._engine.dispose()
+            self._engine = self._session_factory = self._scoped_session = None
+        if self._async_engine is not None:
+            await self._async_engine.dispose()
+            self._async_engine = self._async_session_factory = None
+        for node in self._nodes():
+            if node.engine is not None:
+                node.engine.dispose()
+                node.engine = node.session_factory = None
+            if node.async_engine is not None:
+                await node.async_engine.dispose()
+                node.async_engine = node.async_session_factory = None
 
     @staticmethod
     def close_session(session):
         """關閉會話"""
         session.close()
 
+    def _checkout(self, session: Session, stats: Optional[PoolStats] = None):
+        """取得同步連線並記錄等待時間(stats預設為主庫)"""
+        stats = stats or self.sync_pool_stats
+        start = time.perf_counter()
+        try:
+            session.connection()
+        except PoolTimeoutError:
+            stats.record_timeout()
+            raise
+        stats.record_wait(time.perf_counter() - start)
+
+    async def _acquire(self, session: 'AsyncSession', stats: Optional[PoolStats] = None):
+        """取得連線並記錄等待時間(stats預設為主庫)"""
+        stats = stats or self.async_pool_stats
+        start = time.perf_counter()
+        try:
+            await session.connection()
+        except PoolTimeoutError:
+            stats.record_timeout()
+            raise
+        stats.record_wait(time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[UnitOfWork]:
+        """
+        異步工作單元
+        async with db.unit_of_work() as uow:
+            await service_a.create(...)
+            await service_b.update(...)
+        區塊內的AsyncService呼叫共用同一session，正常離開時提交，發生錯誤時回滾，最後歸還連線
+        """
+        if (uow := _current_uow.get()) is not None:
+            yield uow
+            return
+        session = self.async_session_factory()
+        uow = UnitOfWork(session)
+        token = _current_uow.set(uow)
+        try:
+            await self._acquire(session)
+            yield uow
+            await session.commit()
+            self._mark_written()
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            _current_uow.reset(token)
+            await session.close()
+
+    @asynccontextmanager
+    async def async_scope(self, commit=False) -> AsyncIterator['AsyncSession']:
+        """
+        AsyncService使用的session範圍
+        在unit_of_work內時共用其session(寫入只flush)，否則建立新session並於結束時關閉
+        設定從庫時讀取操作使用從庫，從庫皆不可用時改用主庫
+        在db.using_shard()內時使用該分片的獨立session(不加入unit_of_work)
+        """
+        if (shard := self._active_shard()) is not None:
+            async with self._ashard_scope(shard, commit) as session:
+                yield session
+            return
+        if (uow := _current_uow.get()) is not None:
+            yield uow.session
+            if commit:
+                await uow.session.flush()
+            return
+        session, replica = await self._replica_async_session() if not commit and self._reads_replica() \
+            else (None, None)
+        if session is None:
+            session = self.async_session_factory()
+        try:
+            if replica is None:
+                await self._acquire(session)
+            yield session
+            if commit:
+                await session.commit()
+                self._mark_written()
+        except BaseException as e:
+            await session.rollback()
+            if replica is not None:
+                self._replica_failed(replica, e)
+            raise
+        finally:
+            if replica is not None:
+                replica.release()
+            await session.close()
+
+    def _fan_out_limit(self, limit: Optional[int]) -> int:
+        """並行上限，預設為連線池上限(sqlite為pool_size)"""
+        return limit or self.pool_capacity or self.pool_size
+
+    async def gather(self, *aws: Awaitable, limit: Optional[int] = None, cancel_on_error=False,
+                     return_exceptions=False) -> list:
+        """
+        並行執行多個查詢，依傳入順序回傳結果
+        results = await db.gather(*(service.count(day=d) for d in days))
+        每個查詢在獨立task中執行並脫離工作單元，各自取得連線池中的session
+        :param limit: 同時執行數，預設為連線池上限，避免連線池耗盡
+        :param cancel_on_error: 第一個錯誤發生時取消其餘查詢並拋出
+        :param return_exceptions: 錯誤放入結果而不拋出
+        """
+        semaphore = asyncio.Semaphore(self._fan_out_limit(limit))
+
+        async def run(aw):
+            self.detach_unit_of_work()
+            try:
+                async with semaphore:
+                    return await aw
+            finally:
+                if inspect.iscoroutine(aw) and inspect.getcoroutinestate(aw) == inspect.CORO_CREATED:
+                    aw.close()  # 取消時尚未開始的coroutine
+
+        tasks = [asyncio.ensure_future(run(aw)) for aw in aws]
+        if not tasks:
+            return []
+        try:
+            if cancel_on_error and not return_exceptions:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                if pending:
+                    for task in pending:
+                        task.cancel()
+                    await asyncio.wait(pending)
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        if not return_exceptions:
+            # 依傳入順序拋出第一個非取消的錯誤
+            errors = [r for r in results if isinstance(r, BaseException)]
+            if errors:
+                raise next((e for e in errors if not isinstance(e, asyncio.CancelledError)), errors[0])
+        return results
 
+    def thread_gather(self, *calls: Callable, limit: Optional[int] = None, cancel_on_error=False,
+                      return_exceptions=False) -> list:
+        """
+        gather的同步版本，以執行緒池並行呼叫，依傳入順序回傳結果
+        results = db.thread_gather(*(partial(service.count, day=d) for d in days))
+        每個執行緒使用自己的scoped_session(不共用呼叫端的db.transaction)
+        參數同gather
+        """
+        if not calls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self._fan_out_limit(limit), len(calls))) as executor:
+            futures = [executor.submit(call) for call in calls]
+            if cancel_on_error and not return_exceptions:
+                done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in pending:
+                    future.cancel()
+                wait(futures)
+        results = []
+        for future in futures:
+            if future.cancelled():
+                continue
+            if (error := future.exception()) is not None:
+                if not return_exceptions:
+                    raise error
+                results.append(error)
+            else:
+                results.append(future.result())
+        return results
 
+    def pool_stats(self) -> dict:
+        """連線池統計(含借出中與疑似洩漏的連線數)"""
+        return {
+            'sync': self.sync_pool_stats.snapshot() if self.sync_pool_stats else None,
+            'async': self.async_pool_stats.snapshot() if self.async_pool_stats else None,
+            'replicas': self.replicas.snapshot(),
+            'shards': {name: shard.snapshot() for name, shard in self.shards.items()},
+        }
@@ -1,9 +1,17 @@
 """
 ORM
 """
-from typing import Optional
+import inspect
+import json
+from operator import attrgetter
+from typing import Iterable, Optional
 from exceptions import DBOrmError, DBOptionError
 
+try:
+    import orjson
+except ImportError:  # 選用套件，未安裝時以json輸出
+    orjson = None
+
 
 class ORMObject:
     """伺服器內部ORM物件"""
@@ -23,6 +31,9 @@ class ORMObject:
 
     def to_json(self):
         """object -> dict"""
+        serializer = getattr(type(self), '_serializer', None)
+        if serializer is not None:
+            return serializer.dump(self)
         rv = {}
         for key, value in vars(self).items():
             if self._public and key in self._public:
@@ -37,6 +48,162 @@ class ORMObject:
             yield column
 
 
+class ORMSerializer:
+    """
+    ORMObject -> dict 序列化器
+    由__json_public__/__json_hidden__/__json_modifiers__預先編譯出輸出欄位，
+    實例欄位與預期相同時直接依投影取值，不再逐鍵掃描list。
+    """
+
+    def __init__(self, fields: Iterable[str], public=None, hidden=None):
+        self.public: frozenset = frozenset(public or ())
+        self.hidden: frozenset = frozenset(hidden or ())
+        self.fields: frozenset = frozenset(fields)
+        self.projection: tuple = tuple(key for key in fields if self._visible(key))
+
+    def _visible(self, key) -> bool:
+        """與ORMObject.to_json相同的公開規則"""
+        if self.public and key in self.public:
+            return True
+        return not key.startswith('_') and key not in self.hidden
+
+    def _dump_slow(self, obj) -> dict:
+        """實例欄位被增減時逐鍵判斷"""
+        return {key: value for key, value in vars(obj).items() if self._visible(key)}
+
+    def dump(self, obj) -> dict:
+        """單筆序列化"""
+        values = obj.__dict__
+        if values.keys() == self.fields:
+            return {key: values[key] for key in self.projection}
+        return self._dump_slow(obj)
+
+    def dump_many(self, objects: Iterable) -> list[dict]:
+        """批次序列化"""
+        fields, projection, dump_slow = self.fields, self.projection, self._dump_slow
+        return [
+            {key: values[key] for key in projection} if (values := obj.__dict__).keys() == fields else dump_slow(obj)
+            for obj in objects
+        ]
+
+
+def to_json_many(objects: Iterable[ORMObject]) -> list[dict]:
+    """批次ORMObject -> dict，同一model的連續物件共用序列化器"""
+    rv, batch, serializer = [], [], None
+    for obj in objects:
+        current = getattr(type(obj), '_serializer', None)
+        if current is not serializer:
+            if batch:
+                rv.extend(serializer.dump_many(batch) if serializer else [o.to_json() for o in batch])
+            batch, serializer = [], current
+        batch.append(obj)
+    if batch:
+        rv.extend(serializer.dump_many(batch) if serializer else [o.to_json() for o in batch])
+    return rv
+
+
+def _json_default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def to_json_bytes(objects: Iterable[ORMObject]) -> bytes:
+    """批次ORMObject -> JSON bytes，有安裝orjson時直接輸出bytes"""
+    data = to_json_many(objects)
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default)
+    return json.dumps(data, ensure_ascii=False, default=_json_default).encode('utf-8')
+
+
+class ORMConverter:
+    """
+    Sqlalchemy物件/Row -> ORMObject 轉換器
+    每個model只編譯一次：欄位tuple、取值器與共用的class層級metadata都預先建立，
+    轉換時只需一次取值與一次__dict__.update。
+    """
+
+    def __init__(self, model_cls):
+        mapper = model_cls.__mapper__
+        self.model = model_cls
+        self.fields: tuple = tuple(p.key for p in mapper.iterate_properties)
+        self.column_fields: tuple = tuple(attr.key for attr in mapper.column_attrs)
+        self.columns: tuple = tuple(getattr(model_cls, key) for key in self.column_fields)
+        self.required: tuple = tuple(getattr(model_cls, '__mixin_columns__', ()))
+        self.modifiers: tuple = tuple(model_cls.__json_modifiers__.items())
+        self._getter = attrgetter(*self.fields) if len(self.fields) > 1 else lambda obj: (getattr(obj, self.fields[0]),)
+        self._missing: dict = dict.fromkeys(key for key in self.fields if key not in self.column_fields)
+        self._row_modifiers: tuple = tuple(
+            (name, self._row_value_getter(name), method) for name, method in self.modifiers
+        )
+        # per-model ORMObject子類，metadata放在class上由所有實例共用
+        self.orm_class = type(f'{model_cls.__name__}ORMObject', (model_cls.__default_orm__,), {
+            '_cls': model_cls.__name__,
+            '_db_columns': list(self.fields),
+            '_public': model_cls.__json_public__,
+            '_hidden': model_cls.__json_hidden__,
+            '_modifiers': model_cls.__json_modifiers__,
+        })
+        self.serializer = ORMSerializer(
+            self.fields + tuple(name for name, _ in self.modifiers if name not in self.fields),
+            public=model_cls.__json_public__,
+            hidden=model_cls.__json_hidden__,
+        )
+        self.orm_class._serializer = self.serializer
+
+    def _row_value_getter(self, name):
+        """Row轉換時擴充欄位的取值方式：property以ORMObject呼叫，欄位直接取值"""
+        attr = inspect.getattr_static(self.model, name, None)
+        if isinstance(attr, property):
+            return attr.fget
+        return lambda instance: getattr(instance, name, None)
+
+    def _new(self, values: dict) -> ORMObject:
+        instance = self.orm_class.__new__(self.orm_class)
+        instance.__dict__.update(values)
+        return instance
+
+    def _valid(self, instance):
+        values = instance.__dict__
+        for column in self.required:
+            if values.get(column) is None:
+                raise DBOrmError('伺服器ORM物件實例化錯誤', payload={'instance': instance})
+        return instance
+
+    def from_model(self, model) -> ORMObject:
+        """Sqlalchemy物件 -> ORMObject"""
+        instance = self._new(zip(self.fields, self._getter(model)))
+        for name, method in self.modifiers:
+            instance.__dict__[name] = method(model, getattr(model, name))
+        return self._valid(instance)
+
+    def row_modifiers(self, names: Iterable[str]) -> tuple:
+        """只計算指定擴充欄位時傳給from_row的modifiers"""
+        names = set(names)
+        return tuple(modifier for modifier in self._row_modifiers if modifier[0] in names)
+
+    def from_row(self, row, modifiers: Optional[tuple] = None) -> ORMObject:
+        """
+        select(*converter.columns)查詢出的Row -> ORMObject，不經過Sqlalchemy物件
+        擴充欄位的method以ORMObject作為self呼叫
+        :param modifiers: 只計算的擴充欄位(row_modifiers)，預設全部
+        """
+        instance = self._new(self._missing)
+        instance.__dict__.update(zip(self.column_fields, row))
+        for name, getter, method in self._row_modifiers if modifiers is None else modifiers:
+            instance.__dict__[name] = method(instance, getter(instance))
+        return self._valid(instance)
+
+    def from_dict(self, values: dict) -> ORMObject:
+        """欄位值dict -> ORMObject，擴充欄位規則同from_row"""
+        return self.from_row(tuple(values.get(key) for key in self.column_fields))
+
+    def from_rows(self, rows) -> list[ORMObject]:
+        """批次轉換Row"""
+        from_row = self.from_row
+        return [from_row(row) for row in rows]
+
+
 class ORM:
     """ORMObject Manager -> 給Sqlalchemy Table繼承"""
     __default_orm__: ORMObject = ORMObject
@@ -44,6 +211,30 @@ class ORM:
     __json_hidden__: list = []  # 隱藏欄位
     __json_modifiers__: dict = {}  # 擴充欄位
 
+    @classmethod
+    def get_converter(cls) -> ORMConverter:
+        """取得(並快取)此model的轉換器"""
+        converter = cls.__dict__.get('__orm_converter__')
+        if converter is None:
+            converter = ORMConverter(cls)
+            cls.__orm_converter__ = converter
+        return converter
+
+    @classmethod
+    def get_serializer(cls) -> ORMSerializer:
+        """取得此model的序列化器"""
+        return cls.get_converter().serializer
+
+    @classmethod
+    def to_json_many(cls, objects: Iterable[ORMObject]) -> list[dict]:
+        """批次序列化此model的ORMObject"""
+        return cls.get_serializer().dump_many(objects)
+
+    @classmethod
+    def from_row(cls, row) -> ORMObject:
+        """Row -> ORMObject"""
+        return cls.get_converter().from_row(row)
+
     def get_field_names(self):
         """self.__mapper__ -> sqlalchemy物件屬性"""
         for p in self.__mapper__.iterate_properties:
@@ -57,24 +248,4 @@ class ORM:
         self = Sqlalchemy object
         instance = Server object
         """
-        db_columns = list(self.get_field_names())
-        instance = self.__default_orm__(
-            cls=self.__class__.__name__,
-            db_columns=db_columns,
-            hidden=self.__json_hidden__,
-            public=self.__json_public__,
-            modifiers=self.__json_modifiers__
-        )
-        for field in db_columns:
-            setattr(instance, field, getattr(self, field))
-        for attr_name, method in self.__json_modifiers__.items():
-            value = getattr(self, attr_name)
-            setattr(instance, attr_name, method(self, value))
-        return self._valid_instance(instance)
-
-    def _valid_instance(self, instance):
-        """校驗ORM物件"""
-        for column in self.__mixin_columns__:
-            if getattr(instance, column) is None:
-                raise DBOrmError('伺服器ORM物件實例化錯誤', payload={'instance': instance})
-        return instance
+        return self.get_converter().from_model(self)
@@ -0,0 +1,112 @@
+"""
+連線池統計
+"""
+import threading
+import time
+from collections import deque
+from typing import Optional, Sequence
+from sqlalchemy import event
+
+
+def percentile(samples: Sequence[float], q: float) -> Optional[float]:
+    """取百分位數(samples需已排序)"""
+    if not samples:
+        return None
+    index = min(len(samples) - 1, max(0, round(q / 100 * (len(samples) - 1))))
+    return samples[index]
+
+
+class PoolStats:
+    """
+    連線池計數器
+    checkout/checkin/connect由pool事件累計；取得連線的等待時間由_SqlalchemyManager量測後寫入
+    借出超過leak_after秒仍未歸還的連線視為疑似洩漏
+    """
+
+    def __init__(self, name: str, capacity: Optional[int] = None, leak_after: float = 60, samples=1000):
+        self.name = name
+        self.capacity = capacity  # pool_size + max_overflow，None為不限制(sqlite)
+        self.leak_after = leak_after
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.exhausted = 0  # checkout後連線池已滿的次數(後續請求須等待)
+        self.timeouts = 0  # 等待連線逾時次數
+        self._waits: deque = deque(maxlen=samples)
+        self._borrowed: dict = {}  # id(connection_record) -> 借出時間
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        """綁定同步engine(異步engine請傳入async_engine.sync_engine)的pool事件"""
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        self._engine = engine  # dispose後engine.pool會換成新的連線池
+        return self
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self._borrowed[id(connection_record)] = time.monotonic()
+            if self.capacity is not None and self._engine.pool.checkedout() >= self.capacity:
+                self.exhausted += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+            self._borrowed.pop(id(connection_record), None)
+
+    def reset(self):
+        """fork後清除繼承自父程序的借出紀錄"""
+        self._lock = threading.Lock()
+        self._borrowed.clear()
+
+    def record_wait(self, seconds: float):
+        """記錄取得連線的等待時間"""
+        self._waits.append(seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    @property
+    def checked_out(self) -> int:
+        """目前借出的連線數"""
+        engine = getattr(self, '_engine', None)
+        pool = engine.pool if engine is not None else None
+        return pool.checkedout() if pool is not None and hasattr(pool, 'checkedout') else 0
+
+    def leaked(self) -> int:
+        """借出超過leak_after秒的連線數"""
+        deadline = time.monotonic() - self.leak_after
+        with self._lock:
+            return sum(1 for borrowed_at in self._borrowed.values() if borrowed_at < deadline)
+
+    def snapshot(self) -> dict:
+        """統計快照"""
+        waits = sorted(self._waits)
+        return {
+            'name': self.name,
+            'capacity': self.capacity,
+            'checked_out': self.checked_out,
+            'leaked': self.leaked(),
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'checkins': self.checkins,
+            'exhausted': self.exhausted,
+            'timeouts': self.timeouts,
+            'checkout_wait_ms': {
+                'p50': _ms(percentile(waits, 50)),
+                'p99': _ms(percentile(waits, 99)),
+                'max': _ms(waits[-1] if waits else None),
+            },
+        }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
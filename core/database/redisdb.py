@@ -1,23 +1,153 @@
 """
 伺服器Redis資料庫封裝
 """
-from typing import Optional
-from redis import Redis, ConnectionPool
-import aioredis
+import asyncio
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Iterable, Optional
 from ..database.base import DBInterface
 from constants import REDIS_HOST, REDIS_PORT
 
+try:
+    import orjson
+except ImportError:  # 選用套件，未安裝時以json編碼
+    orjson = None
+
+if TYPE_CHECKING:  # redis/aioredis於第一次建立連線時才載入
+    import aioredis
+    from redis import Redis
+
+
+def _aioredis():
+    """
+    異步redis模組
+    aioredis 2.x已併入redis-py(redis.asyncio)，且在Python 3.11以上無法匯入，此時改用redis.asyncio
+    """
+    try:
+        import aioredis
+    except (ImportError, TypeError):
+        from redis import asyncio as aioredis
+    return aioredis
+
+
+def dumps_json(value) -> Any:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads_json(raw):
+    if raw is None:
+        return None
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+class AutoPipeline:
+    """
+    自動合併的異步pipeline
+    同一個event loop tick內送出的指令合併為一次往返，每個指令回傳可await的結果
+        counter = redis.auto_pipeline()
+        await asyncio.gather(*(counter.incr(f'item:{id_}') for id_ in ids))
+    作為context使用時離開前會送出所有指令
+        async with redis.auto_pipeline() as pipe:
+            for id_ in ids:
+                pipe.incr(f'item:{id_}')
+    """
+
+    def __init__(self, client: 'aioredis.Redis', max_batch=1000):
+        self._client = client
+        self._max_batch = max_batch
+        self._pending: list = []  # [(指令, args, kwargs, future)]
+        self._scheduled = False
+        self._inflight: set = set()
+
+    def __getattr__(self, name: str):
+        if name.startswith('_') or not callable(getattr(self._client, name, None)):
+            raise AttributeError(name)
+
+        def command(*args, **kwargs) -> asyncio.Future:
+            return self._enqueue(name, args, kwargs)
+        return command
+
+    def _enqueue(self, name: str, args: tuple, kwargs: dict) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((name, args, kwargs, future))
+        if len(self._pending) >= self._max_batch:
+            self._send()
+        elif not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._send)
+        return future
+
+    def _send(self):
+        """送出目前累積的指令(不等待結果)"""
+        self._scheduled = False
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._execute(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, batch: list):
+        pipe = self._client.pipeline(transaction=False)
+        for name, args, kwargs, _ in batch:
+            getattr(pipe, name)(*args, **kwargs)
+        try:
+            results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (*_, future), result in zip(batch, results):
+            if future.done():  # 呼叫端已取消
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def flush(self):
+        """立即送出並等待所有指令完成"""
+        self._send()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def __aenter__(self) -> 'AutoPipeline':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.flush()
+
 
 class _RedisManager(DBInterface):
-    def __init__(self, host=REDIS_HOST, port=REDIS_PORT, db_=0):
+    """
+    Redis連線
+    連線池於第一次使用時建立(每個db一個)，fork後子程序由redis-py依pid自動重建連線
+    """
+    def __init__(self, host=REDIS_HOST, port=REDIS_PORT, db_=0, max_connections=50, pool_timeout=20):
+        """
+        :param max_connections: 每個db連線池的連線上限，用盡時等待歸還
+        :param pool_timeout: 等待連線逾時秒數
+        """
         self._redis_url = f'redis://{host}:{port}'
         self.db = db_
+        self.max_connections = max_connections
+        self.pool_timeout = pool_timeout
 
-        self._sync_pool: Optional[ConnectionPool] = None
-        self._sync_redis: Optional[Redis] = None
+        self._lock = threading.Lock()
+        self._sync_clients: dict[int, 'Redis'] = {}  # db -> client(共用該db的連線池)
+        self._async_clients: dict[int, 'aioredis.Redis'] = {}
 
-        self._async_pool: Optional[aioredis.ConnectionPool] = None
-        self._async_redis: Optional[aioredis.Redis] = None
+        self._sync_pool = None
+        self._sync_redis: Optional['Redis'] = None
+
+        self._async_pool = None
+        self._async_redis: Optional['aioredis.Redis'] = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
 
     def create_engine(self):
         """啟動引擎"""
@@ -29,41 +159,128 @@ class _RedisManager(DBInterface):
         self._sync_close()
         await self._async_close()
 
-    def choose(self, db: int):
-        pool = ConnectionPool.from_url(self._redis_url, decode_responses=True, encoding='utf-8')
-        return Redis(connection_pool=pool, db=db)
+    def _pool_options(self) -> dict:
+        return {
+            'max_connections': self.max_connections, 'timeout': self.pool_timeout,
+            'decode_responses': True, 'encoding': 'utf-8',
+        }
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def choose(self, db: int) -> 'Redis':
+        """指定db的同步client(每個db只建立一個連線池)"""
+        if (client := self._sync_clients.get(db)) is None:
+            from redis import Redis, BlockingConnectionPool
+            with self._lock:
+                if (client := self._sync_clients.get(db)) is None:
+                    pool = BlockingConnectionPool.from_url(self._redis_url, db=db, **self._pool_options())
+                    client = self._sync_clients[db] = Redis(connection_pool=pool)
+        return client
+
+    def achoose(self, db: int) -> 'aioredis.Redis':
+        """指定db的異步client"""
+        if (client := self._async_clients.get(db)) is None:
+            aioredis = _aioredis()
+            with self._lock:
+                if (client := self._async_clients.get(db)) is None:
+                    pool = aioredis.BlockingConnectionPool.from_url(self._redis_url, db=db, **self._pool_options())
+                    client = self._async_clients[db] = aioredis.Redis(connection_pool=pool)
+        return client
 
     def _sync_connect(self):
         """創建同步連線"""
-        self._sync_pool = ConnectionPool.from_url(self._redis_url, decode_responses=True, encoding='utf-8')
-        self._sync_redis = Redis(connection_pool=self._sync_pool, db=self.db)
+        self._sync_redis = self.choose(self.db)
+        self._sync_pool = self._sync_redis.connection_pool
 
     def _async_connect(self):
         """創建異步連線"""
-        self._async_pool = aioredis.ConnectionPool.from_url(self._redis_url, decode_responses=True, encoding='utf-8')
-        self._async_redis = aioredis.Redis(connection_pool=self._async_pool, db=self.db)
+        self._async_redis = self.achoose(self.db)
+        self._async_pool = self._async_redis.connection_pool
 
     def _sync_close(self):
         """關閉同步連線"""
-        if self._sync_pool is not None:
-            self._sync_redis.close()
-            self._sync_pool.disconnect()
+        for client in self._sync_clients.values():
+            client.close()
+            client.connection_pool.disconnect()
+        self._sync_clients.clear()
+        self._sync_redis = self._sync_pool = None
 
     async def _async_close(self):
         """關閉異步連線"""
-        if self._async_pool is not None:
-            await self._async_redis.close()
-            await self._async_pool.disconnect()
+        for client in self._async_clients.values():
+            await client.close()
+            await client.connection_pool.disconnect()
+        self._async_clients.clear()
+        self._async_redis = self._async_pool = None
 
     @property
-    def sync_(self):
-        """同步調用"""
+    def sync_(self) -> 'Redis':
+        """同步調用(第一次使用時連線)"""
+        if self._sync_redis is None:
+            self._sync_connect()
         return self._sync_redis
 
     @property
-    def async_(self) -> aioredis.Redis:
-        """異步調用"""
+    def async_(self) -> 'aioredis.Redis':
+        """異步調用(第一次使用時連線)"""
+        if self._async_redis is None:
+            self._async_connect()
         return self._async_redis
 
+    def _sync_client(self, db: Optional[int]) -> 'Redis':
+        return self.sync_ if db is None else self.choose(db)
+
+    def _async_client(self, db: Optional[int]) -> 'aioredis.Redis':
+        return self.async_ if db is None else self.achoose(db)
+
+    # ---------- 批次 ----------
+    def mget_json(self, keys: Iterable[str], db: Optional[int] = None) -> list:
+        """一次MGET讀取多個JSON值，不存在的key為None"""
+        keys = list(keys)
+        if not keys:
+            return []
+        return [loads_json(raw) for raw in self._sync_client(db).mget(keys)]
+
+    def mset_json(self, mapping: dict, ttl: Optional[int] = None, db: Optional[int] = None):
+        """
+        一次往返寫入多個JSON值
+        :param ttl: 過期秒數，None為不過期(MSET)；有ttl時以pipeline送出SET EX
+        """
+        if not mapping:
+            return
+        client = self._sync_client(db)
+        if ttl is None:
+            client.mset({key: dumps_json(value) for key, value in mapping.items()})
+            return
+        pipe = client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, dumps_json(value), ex=ttl)
+        pipe.execute()
+
+    async def amget_json(self, keys: Iterable[str], db: Optional[int] = None) -> list:
+        """異步mget_json"""
+        keys = list(keys)
+        if not keys:
+            return []
+        return [loads_json(raw) for raw in await self._async_client(db).mget(keys)]
+
+    async def amset_json(self, mapping: dict, ttl: Optional[int] = None, db: Optional[int] = None):
+        """異步mset_json"""
+        if not mapping:
+            return
+        client = self._async_client(db)
+        if ttl is None:
+            await client.mset({key: dumps_json(value) for key, value in mapping.items()})
+            return
+        pipe = client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, dumps_json(value), ex=ttl)
+        await pipe.execute()
+
+    def auto_pipeline(self, db: Optional[int] = None, max_batch=1000) -> AutoPipeline:
+        """同一tick內的指令自動合併為一次往返的異步pipeline"""
+        return AutoPipeline(self._async_client(db), max_batch)
+
 
 redis = _RedisManager()
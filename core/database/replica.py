@@ -0,0 +1,132 @@
+"""
+讀寫分離：從庫集合與健康狀態
+"""
+import itertools
+import threading
+import time
+from typing import Iterator, Optional
+
+STRATEGIES = ('round_robin', 'least_connections')
+
+
+class Replica:
+    """
+    從庫
+    engine於第一次讀取時由_SqlalchemyManager建立
+    連線失敗時標記為停用，retry_after秒後允許再次嘗試(成功即恢復)
+    """
+
+    def __init__(self, name: str, sync_url: str, async_url: str):
+        self.name = name
+        self.sync_url = sync_url
+        self.async_url = async_url
+        self.engine = None
+        self.session_factory = None
+        self.async_engine = None
+        self.async_session_factory = None
+        self.sync_pool_stats = None
+        self.async_pool_stats = None
+        self.healthy = True
+        self.down_until = 0.0
+        self.failures = 0  # 連續失敗次數
+        self.last_error: Optional[str] = None
+        self.active = 0  # 進行中的讀取數(least_connections使用)
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """可讀取(健康，或停用已超過重試間隔)"""
+        return self.healthy or time.monotonic() >= self.down_until
+
+    def mark_down(self, error, retry_after: float):
+        with self._lock:
+            self.healthy = False
+            self.failures += 1
+            self.down_until = time.monotonic() + retry_after
+            self.last_error = str(error)
+
+    def mark_up(self):
+        with self._lock:
+            self.healthy = True
+            self.failures = 0
+            self.down_until = 0.0
+            self.last_error = None
+
+    def acquire(self):
+        with self._lock:
+            self.active += 1
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def reset(self):
+        """fork後捨棄繼承的計數"""
+        self._lock = threading.Lock()
+        self.active = 0
+
+    def snapshot(self) -> dict:
+        return {
+            'name': self.name,
+            'healthy': self.healthy,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'active': self.active,
+            'sync': self.sync_pool_stats.snapshot() if self.sync_pool_stats else None,
+            'async': self.async_pool_stats.snapshot() if self.async_pool_stats else None,
+        }
+
+
+class ReplicaSet:
+    """
+    從庫集合，依策略排列本次讀取嘗試的順序
+    round_robin: 輪流
+    least_connections: 進行中讀取數最少者優先(相同時輪流)
+    """
+
+    def __init__(self, strategy='round_robin', retry_after: float = 30):
+        if strategy not in STRATEGIES:
+            raise ValueError(f'strategy必須為{"/".join(STRATEGIES)}其中之一')
+        self.strategy = strategy
+        self.retry_after = retry_after
+        self._replicas: list[Replica] = []
+        self._counter = itertools.count()
+
+    def add(self, sync_url: str, async_url: str, name: Optional[str] = None) -> Replica:
+        replica = Replica(name or f'replica{len(self._replicas)}', sync_url, async_url)
+        self._replicas.append(replica)
+        return replica
+
+    def __len__(self) -> int:
+        return len(self._replicas)
+
+    def __iter__(self) -> Iterator[Replica]:
+        return iter(self._replicas)
+
+    def candidates(self) -> list[Replica]:
+        """本次讀取依序嘗試的從庫(不含停用中者)，全部不可用時為空，由呼叫端改讀主庫"""
+        available = [replica for replica in self._replicas if replica.available]
+        if not available:
+            return []
+        offset = next(self._counter) % len(available)
+        rotated = available[offset:] + available[:offset]
+        if self.strategy == 'least_connections':
+            rotated.sort(key=lambda replica: replica.active)
+        return rotated
+
+    def mark_down(self, replica: Replica, error):
+        replica.mark_down(error, self.retry_after)
+
+    def snapshot(self) -> list[dict]:
+        return [replica.snapshot() for replica in self._replicas]
+
+
+def replication_lag(status) -> Optional[float]:
+    """
+    由SHOW REPLICA STATUS的結果取得複製延遲秒數
+    非從庫(無結果)或複製停止(值為NULL)時回傳None
+    """
+    if status is None:
+        return None
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return None if lag is None else float(lag)
@@ -0,0 +1,77 @@
+"""
+水平分片：分片對應與分片engine
+"""
+import bisect
+import zlib
+from typing import Iterable, Sequence
+
+
+class ShardMap:
+    """
+    分片對應(分片鍵值 -> 分片名稱)
+    自訂對應時繼承並實作shard_for，設定於db.shard_map或model的__shard_map__
+    """
+
+    def shard_for(self, value) -> str:
+        raise NotImplementedError
+
+    def shards_for(self, values: Iterable) -> list:
+        """多個值(IN條件)對應的分片，依名稱排序"""
+        return sorted({self.shard_for(value) for value in values})
+
+
+class HashShardMap(ShardMap):
+    """
+    雜湊分片：整數取餘數，其他值以crc32(跨程序穩定，不使用hash())
+    分片數變更時大部分資料需要搬移
+    """
+
+    def __init__(self, names: Sequence[str]):
+        if not names:
+            raise ValueError('names不可為空')
+        self.names = list(names)
+
+    def shard_for(self, value) -> str:
+        if isinstance(value, int):
+            index = value % len(self.names)
+        else:
+            index = zlib.crc32(str(value).encode()) % len(self.names)
+        return self.names[index]
+
+
+class RangeShardMap(ShardMap):
+    """
+    範圍分片
+    RangeShardMap([(1000, 's0'), (5000, 's1')], default='s2')  # <1000 -> s0，<5000 -> s1，其餘 -> s2
+    """
+
+    def __init__(self, ranges: Sequence[tuple], default: str):
+        ranges = sorted(ranges)
+        self.bounds = [upper for upper, _ in ranges]
+        self.names = [name for _, name in ranges]
+        self.default = default
+
+    def shard_for(self, value) -> str:
+        index = bisect.bisect_right(self.bounds, value)
+        return self.names[index] if index < len(self.names) else self.default
+
+
+class Shard:
+    """分片(engine於第一次使用時由_SqlalchemyManager建立，屬性同Replica)"""
+
+    def __init__(self, name: str, sync_url: str, async_url: str):
+        self.name = name
+        self.sync_url = sync_url
+        self.async_url = async_url
+        self.engine = None
+        self.session_factory = None
+        self.async_engine = None
+        self.async_session_factory = None
+        self.sync_pool_stats = None
+        self.async_pool_stats = None
+
+    def snapshot(self) -> dict:
+        return {
+            'sync': self.sync_pool_stats.snapshot() if self.sync_pool_stats else None,
+            'async': self.async_pool_stats.snapshot() if self.async_pool_stats else None,
+        }
@@ -0,0 +1,226 @@
+"""
+SQL語句建構
+"""
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Sequence
+from sqlalchemy import func, insert, text, tuple_
+from exceptions import DBOptionError
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    """依批次大小切分"""
+    if size <= 0:
+        raise ValueError('batch_size必須大於0')
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def dialect_of(session) -> str:
+    """取得會話綁定的資料庫方言名稱"""
+    return session.bind.dialect.name
+
+
+def _dialect_insert(dialect: str, model):
+    """依方言選擇insert建構器(方言模組於使用時才載入)"""
+    if dialect == 'mysql':
+        from sqlalchemy.dialects import mysql
+        return mysql.insert(model)
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects import sqlite
+        return sqlite.insert(model)
+    return insert(model)
+
+
+def _check_keys(rows: Sequence[dict]):
+    """多列INSERT需要同批資料欄位一致"""
+    keys = rows[0].keys()
+    for row in rows:
+        if row.keys() != keys:
+            raise DBOptionError('批次寫入的資料欄位不一致。', payload={'expected': list(keys), 'row': row})
+
+
+def _onupdate_set(model, update_fields: Sequence[str]) -> dict:
+    """ON DUPLICATE KEY UPDATE / ON CONFLICT DO UPDATE不套用onupdate，補上Python端的onupdate值(如updated_at)"""
+    return {
+        column.key: column.onupdate.arg(None) for column in model.__table__.columns
+        if column.onupdate is not None and column.onupdate.is_callable and column.key not in update_fields
+    }
+
+
+def insert_many(dialect: str, model, rows: Sequence[dict], returning_ids=False):
+    """多列INSERT"""
+    _check_keys(rows)
+    stmt = _dialect_insert(dialect, model).values(list(rows))
+    if returning_ids and dialect != 'mysql':
+        stmt = stmt.returning(model.id)
+    return stmt
+
+
+def insert_ignore_many(dialect: str, model, rows: Sequence[dict]):
+    """
+    多列INSERT，略過重複鍵的資料
+    mysql: INSERT IGNORE / sqlite: INSERT ... ON CONFLICT DO NOTHING
+    """
+    stmt = insert_many(dialect, model, rows)
+    if dialect == 'mysql':
+        return stmt.prefix_with('IGNORE')
+    if dialect == 'sqlite':
+        return stmt.on_conflict_do_nothing()
+    raise DBOptionError('此資料庫不支援批次略過重複資料。', payload={'dialect': dialect})
+
+
+def load_data_stmt(model, path: str, fields: Sequence[str]):
+    """
+    mysql LOAD DATA LOCAL INFILE(tab分隔、\\跳脫、\\N為NULL，重複鍵略過)
+    檔名不可使用bind參數，以字串常數跳脫後組入語句
+    """
+    filename = path.replace('\\', '\\\\').replace("'", "\\'")
+    columns = ', '.join(f'`{field}`' for field in fields)
+    return text(
+        f"LOAD DATA LOCAL INFILE '{filename}' IGNORE INTO TABLE `{model.__tablename__}` CHARACTER SET utf8mb4 "
+        f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({columns})"
+    )
+
+
+def upsert_many(dialect: str, model, rows: Sequence[dict], conflict_keys: Sequence[str],
+                update_fields: Optional[Sequence[str]] = None):
+    """
+    多列UPSERT
+    mysql: INSERT ... ON DUPLICATE KEY UPDATE
+    sqlite: INSERT ... ON CONFLICT (...) DO UPDATE
+    """
+    _check_keys(rows)
+    if update_fields is None:
+        update_fields = [k for k in rows[0] if k not in conflict_keys and k != 'id']
+    stmt = _dialect_insert(dialect, model).values(list(rows))
+    if dialect == 'mysql':
+        if not update_fields:
+            # 無欄位需更新時以id=id作為no-op，避免觸發重複鍵錯誤
+            return stmt.on_duplicate_key_update(id=model.id)
+        return stmt.on_duplicate_key_update(
+            {f: stmt.inserted[f] for f in update_fields} | _onupdate_set(model, update_fields)
+        )
+    if dialect == 'sqlite':
+        if not update_fields:
+            return stmt.on_conflict_do_nothing(index_elements=list(conflict_keys))
+        return stmt.on_conflict_do_update(
+            index_elements=list(conflict_keys),
+            set_={f: stmt.excluded[f] for f in update_fields} | _onupdate_set(model, update_fields),
+        )
+    raise DBOptionError('此資料庫不支援批次UPSERT。', payload={'dialect': dialect})
+
+
+def get_or_create_stmt(dialect: str, model, values: dict):
+    """
+    get_or_create的單列新增，rowcount為1時表示新增
+    mysql: 一般INSERT，由呼叫端包在SAVEPOINT內並攔截重複鍵錯誤(is_duplicate_key)
+        (sqlalchemy固定開啟CLIENT_FOUND_ROWS，ON DUPLICATE KEY UPDATE的no-op更新與新增的affected rows皆為1，無法判斷)
+    sqlite: INSERT ... ON CONFLICT DO NOTHING，rowcount為0時表示已存在
+    """
+    stmt = _dialect_insert(dialect, model).values(**values)
+    if dialect == 'mysql':
+        return stmt
+    if dialect == 'sqlite':
+        return stmt.on_conflict_do_nothing()
+    raise DBOptionError('此資料庫不支援原子get_or_create。', payload={'dialect': dialect})
+
+
+def is_duplicate_key(error) -> bool:
+    """mysql重複鍵錯誤(1062)"""
+    args = getattr(getattr(error, 'orig', None), 'args', None)
+    return bool(args) and args[0] == 1062
+
+
+def upsert_stmt(dialect: str, model, values: dict, conflict_keys: Sequence[str],
+                update_fields: Optional[Sequence[str]] = None):
+    """
+    單列UPSERT，執行後可取得資料id
+    mysql: lastrowid(透過LAST_INSERT_ID(id)) / sqlite: RETURNING id
+    """
+    if update_fields is None:
+        update_fields = [k for k in values if k not in conflict_keys and k != 'id']
+    stmt = _dialect_insert(dialect, model).values(**values)
+    if dialect == 'mysql':
+        updates = {f: stmt.inserted[f] for f in update_fields}
+        if update_fields:
+            updates.update(_onupdate_set(model, update_fields))
+        updates['id'] = func.last_insert_id(model.id)
+        return stmt.on_duplicate_key_update(updates)
+    if dialect == 'sqlite':
+        # 無欄位需更新時以唯一鍵自身做no-op更新，確保RETURNING有資料
+        fields = update_fields or conflict_keys[:1]
+        set_ = {f: stmt.excluded[f] for f in fields}
+        if update_fields:
+            set_.update(_onupdate_set(model, update_fields))
+        return stmt.on_conflict_do_update(index_elements=list(conflict_keys), set_=set_).returning(model.id)
+    raise DBOptionError('此資料庫不支援UPSERT。', payload={'dialect': dialect})
+
+
+def upserted_id(dialect: str, result) -> int:
+    """upsert_stmt執行後的資料id"""
+    if dialect == 'mysql':
+        return result.lastrowid
+    return result.scalar_one()
+
+
+def inserted_ids(dialect: str, result, count: int) -> list:
+    """
+    取得多列INSERT產生的id
+    mysql不支援RETURNING，以lastrowid(第一筆)推算連續id，前提為資料不含id、auto_increment_increment=1
+    且innodb_autoinc_lock_mode不為2(見check_inferred_ids)；無法保證時以唯一鍵回讀
+    """
+    if dialect == 'mysql':
+        first = result.lastrowid
+        return list(range(first, first + count))
+    return list(result.scalars())
+
+
+def autoinc_settings_stmt(dialect: str):
+    """mysql自增id設定(推算多列INSERT的id前檢查)，其他方言回傳None"""
+    if dialect == 'mysql':
+        return text('SELECT @@auto_increment_increment, @@innodb_autoinc_lock_mode')
+    return None
+
+
+def check_inferred_ids(settings: Sequence, rows: Sequence[dict]):
+    """以lastrowid推算id的前提不成立時拋錯(id可能不連續，回傳的id會對應到其他資料)"""
+    increment, lock_mode = settings
+    if increment != 1 or lock_mode == 2:
+        raise DBOptionError('自增id可能不連續，無法推算新增的id，請指定key_fields以唯一鍵回讀。', payload={
+            'auto_increment_increment': increment, 'innodb_autoinc_lock_mode': lock_mode,
+        })
+    if any(row.get('id') is not None for row in rows):
+        raise DBOptionError('資料指定了id，無法推算新增的id，請指定key_fields以唯一鍵回讀。')
+
+
+def key_filter(model, keys: Sequence[str], rows: Iterable[dict]):
+    """依自然鍵組成 WHERE (k1, k2) IN (...) 條件"""
+    if len(keys) == 1:
+        column = getattr(model, keys[0])
+        return column.in_([row[keys[0]] for row in rows])
+    columns = tuple_(*[getattr(model, k) for k in keys])
+    return columns.in_([tuple(row[k] for k in keys) for row in rows])
+
+
+def approximate_count_stmt(dialect: str, model):
+    """
+    資料表估計筆數(InnoDB統計值，不掃描資料表)
+    不支援的方言回傳None，由呼叫端改為精確計算
+    """
+    if dialect == 'mysql':
+        return text(
+            'SELECT TABLE_ROWS FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table'
+        ).bindparams(table=model.__tablename__)
+    return None
+
+
+def replica_status_stmt(dialect: str):
+    """
+    從庫複製狀態(MySQL 8.0.22以上，舊版欄位名稱為Seconds_Behind_Master)
+    不支援的方言回傳None，不檢查複製延遲
+    """
+    if dialect == 'mysql':
+        return text('SHOW REPLICA STATUS')
+    return None
@@ -0,0 +1,275 @@
+"""
+Service批次匯出
+service.export('/data/report.csv', format='csv', workers=4)
+依id切成區間，由執行緒池(或程序池)各自以連線池的連線讀取並序列化，主執行緒依id順序串流寫入檔案
+同時在途的區間數為workers*2，記憶體用量與資料表大小無關
+"""
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Optional, Sequence
+
+try:
+    import orjson
+except ImportError:  # 選用套件，未安裝時以json輸出
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+
+class ExportStats:
+    """匯出進度"""
+
+    def __init__(self, total_chunks=0):
+        self.rows = 0
+        self.chunks = 0
+        self.total_chunks = total_chunks
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    def record(self, rows: int):
+        self.rows += rows
+        self.chunks += 1
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rows_per_second(self) -> Optional[float]:
+        elapsed = self.elapsed
+        return round(self.rows / elapsed, 1) if elapsed else None
+
+    def snapshot(self) -> dict:
+        return {
+            'rows': self.rows,
+            'chunks': self.chunks,
+            'total_chunks': self.total_chunks,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': self.rows_per_second,
+        }
+
+
+def _json_default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _encode_csv(rows: list, fields: Sequence[str]) -> str:
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore').writerows(rows)
+    return buffer.getvalue()
+
+
+def _encode_jsonl(rows: list, fields: Sequence[str]) -> bytes:
+    if orjson is not None:
+        return b''.join(orjson.dumps(row, default=_json_default) + b'\n' for row in rows)
+    return ''.join(json.dumps(row, ensure_ascii=False, default=_json_default) + '\n' for row in rows).encode('utf-8')
+
+
+def _encode_parquet(rows: list, fields: Sequence[str]) -> list:
+    return rows  # 由寫入端轉為pyarrow Table
+
+
+_ENCODERS = {'csv': _encode_csv, 'jsonl': _encode_jsonl, 'parquet': _encode_parquet}
+
+
+def _read_range(service, low: int, high: int, kws: dict, format_: str, fields: Sequence[str]) -> tuple[int, object]:
+    """worker: 讀取 low <= id < high 的資料並序列化(依__json_hidden__/__json_public__/__json_modifiers__)"""
+    rows = service._export_rows(low, high, kws)
+    return len(rows), _ENCODERS[format_](rows, fields)
+
+
+class _CsvWriter:
+    def __init__(self, path: str, fields: Sequence[str], model):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        csv.writer(self.file).writerow(fields)
+
+    def write(self, payload: str):
+        self.file.write(payload)
+
+    def close(self):
+        self.file.close()
+
+
+class _JsonlWriter:
+    def __init__(self, path: str, fields: Sequence[str], model):
+        self.file = open(path, 'wb')
+
+    def write(self, payload: bytes):
+        self.file.write(payload)
+
+    def close(self):
+        self.file.close()
+
+
+def _to_text(value) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=_json_default)
+    return str(value)
+
+
+def _arrow_type(pa, column_type):
+    """
+    sqlalchemy欄位型別 -> pyarrow型別，無對應時為None(以字串輸出)
+    DateTime一律為不含時區的timestamp(資料表存放的是當地時間)
+    """
+    from sqlalchemy import types
+    if isinstance(column_type, types.Boolean):
+        return pa.bool_()
+    if isinstance(column_type, types.Integer):
+        return pa.int64()
+    if isinstance(column_type, types.Float):
+        return pa.float64()
+    if isinstance(column_type, types.Numeric):
+        return pa.decimal128(column_type.precision, column_type.scale or 0) if column_type.precision else None
+    if isinstance(column_type, types.DateTime):
+        return pa.timestamp('us')
+    if isinstance(column_type, types.Date):
+        return pa.date32()
+    if isinstance(column_type, types.Time):
+        return pa.time64('us')
+    if isinstance(column_type, types.Interval):
+        return pa.duration('us')
+    if isinstance(column_type, types._Binary):
+        return pa.binary()
+    if isinstance(column_type, (types.String, types.Enum)):
+        return pa.string()
+    return None
+
+
+class _ParquetWriter:
+    """
+    pyarrow為選用套件，匯出parquet時才載入
+    schema由model欄位型別決定(不依資料推斷，前幾批全為NULL的欄位之後有值也不會不一致)
+    擴充欄位與無對應型別的欄位以字串輸出
+    """
+
+    def __init__(self, path: str, fields: Sequence[str], model):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError('匯出parquet需要安裝pyarrow') from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.schema, self.text_fields = self._schema(model, fields)
+        self.writer = None
+
+    def _schema(self, model, fields: Sequence[str]) -> tuple:
+        columns = model.__table__.columns
+        schema, text_fields = [], []
+        for field in fields:
+            arrow_type = _arrow_type(self.pa, columns[field].type) if field in columns else None
+            if arrow_type is None:
+                arrow_type = self.pa.string()
+                text_fields.append(field)
+            schema.append(self.pa.field(field, arrow_type))
+        return self.pa.schema(schema), tuple(text_fields)
+
+    def write(self, rows: list):
+        if not rows:
+            return
+        if self.text_fields:
+            rows = [{**row, **{f: _to_text(row.get(f)) for f in self.text_fields}} for row in rows]
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        if self.writer is None:  # 沒有資料時輸出只有欄位的空檔案
+            self.pq.write_table(self.schema.empty_table(), self.path)
+            return
+        self.writer.close()
+
+
+_WRITERS = {'csv': _CsvWriter, 'jsonl': _JsonlWriter, 'parquet': _ParquetWriter}
+
+
+def _executor(workers: int, processes: bool):
+    if not processes:
+        return ThreadPoolExecutor(max_workers=workers)
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        raise ValueError('processes=True需要支援fork的平台')
+    # fork後子程序沿用db設定，繼承的連線池由_after_fork捨棄後重建
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+
+
+def _stream(executor, writer, service, ranges: list, kws: dict, format_: str, fields: Sequence[str],
+            window: int, stats: ExportStats, on_progress: Optional[Callable], report_every: float, path: str):
+    """最多window個區間在途，依id順序取回結果寫入"""
+    pending: deque = deque()
+    remaining = iter(ranges)
+
+    def submit():
+        for start, stop in islice(remaining, window - len(pending)):
+            pending.append(executor.submit(_read_range, service, start, stop, kws, format_, fields))
+
+    submit()
+    last_report = time.monotonic()
+    try:
+        while pending:
+            count, payload = pending.popleft().result()
+            submit()
+            writer.write(payload)
+            stats.record(count)
+            if on_progress is not None:
+                on_progress(stats)
+            if time.monotonic() - last_report >= report_every:
+                last_report = time.monotonic()
+                logger.info('匯出%s: %d筆 %s筆/秒 (%d/%d)', path, stats.rows, stats.rows_per_second,
+                            stats.chunks, stats.total_chunks)
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        raise
+
+
+def export_service(service, path: str, format_='csv', workers=4, chunk_size=10000, processes=False,
+                   on_progress: Optional[Callable] = None, report_every: float = 5, kws: Optional[dict] = None
+                   ) -> ExportStats:
+    """
+    匯出Service的資料表，參數見Service.export
+    先寫入path.tmp，完成後才改名為path(失敗時刪除暫存檔)
+    """
+    if format_ not in FORMATS:
+        raise ValueError(f'format必須為{"/".join(FORMATS)}其中之一')
+    if workers <= 0 or chunk_size <= 0:
+        raise ValueError('workers與chunk_size必須大於0')
+    kws = kws or {}
+    low, high = service._id_bounds(kws)
+    ranges = [] if low is None else [
+        (start, min(start + chunk_size, high + 1)) for start in range(low, high + 1, chunk_size)
+    ]
+    fields = service.__model__.get_serializer().projection
+    stats = ExportStats(len(ranges))
+    temp_path = f'{path}.tmp'
+    writer = _WRITERS[format_](temp_path, fields, service.__model__)
+    try:
+        try:
+            with _executor(workers, processes) as executor:
+                _stream(executor, writer, service, ranges, kws, format_, fields, workers * 2, stats,
+                        on_progress, report_every, path)
+        finally:
+            writer.close()
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+    stats.finished = time.monotonic()
+    logger.info('匯出%s完成: %d筆 %s筆/秒', path, stats.rows, stats.rows_per_second)
+    return stats
@@ -0,0 +1,400 @@
+"""
+Service檔案批次匯入
+service.load_file('/data/backfill.csv', format='csv', batch_size=5000, on_duplicate='ignore')
+解析執行緒讀檔並依mapper欄位型別檢查、轉換(不建立ORMObject)，經有界佇列交給主執行緒寫入，解析與寫入同時進行
+mysql且db.local_infile=True時以LOAD DATA LOCAL INFILE寫入，否則為每批一次多列INSERT
+"""
+import csv
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import groupby
+from typing import Callable, Iterator, Optional, Sequence
+from .database import db
+from .database.statements import dialect_of, insert_ignore_many, load_data_stmt, upsert_many
+from .sharding import shard_key
+
+try:
+    import orjson
+except ImportError:  # 選用套件，未安裝時以json解析
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+ON_DUPLICATE = ('ignore', 'update')
+
+Rejected = namedtuple('Rejected', 'line row reason')
+
+
+class LoadStats:
+    """匯入進度與拒絕的資料(最多保留keep_rejected筆，rejected_count為總數)"""
+
+    def __init__(self, keep_rejected=1000):
+        self.rows = 0  # 通過檢查送出寫入的筆數
+        self.affected = 0  # 資料庫回報的影響筆數(略過的重複資料不計；mysql更新一筆計為2)
+        self.batches = 0
+        self.rejected: list[Rejected] = []
+        self.rejected_count = 0
+        self.keep_rejected = keep_rejected
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def reject(self, line: int, row, reason: str):
+        with self._lock:
+            self.rejected_count += 1
+            if len(self.rejected) < self.keep_rejected:
+                self.rejected.append(Rejected(line, row, reason))
+
+    def record(self, rows: int, affected: int):
+        self.rows += rows
+        self.affected += affected
+        self.batches += 1
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rows_per_second(self) -> Optional[float]:
+        elapsed = self.elapsed
+        return round(self.rows / elapsed, 1) if elapsed else None
+
+    def snapshot(self) -> dict:
+        return {
+            'rows': self.rows,
+            'affected': self.affected,
+            'batches': self.batches,
+            'rejected': self.rejected_count,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': self.rows_per_second,
+        }
+
+
+# ---------- 欄位檢查與轉換 ----------
+_TRUE = frozenset(('1', 'true', 't', 'yes', 'y'))
+_FALSE = frozenset(('0', 'false', 'f', 'no', 'n'))
+_BOOLEANS = _TRUE | _FALSE
+
+
+def _to_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and (text := value.strip().lower()) in _BOOLEANS:
+        return text in _TRUE
+    raise ValueError(f'無法轉換為布林值: {value!r}')
+
+
+def _to_int(value) -> int:
+    if isinstance(value, bool):
+        raise ValueError(f'無法轉換為整數: {value!r}')
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f'無法轉換為整數: {value!r}')
+        return int(value)
+    return int(value)
+
+
+def _to_decimal(value) -> Decimal:
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f'無法轉換為Decimal: {value!r}')
+
+
+def _to_datetime(value) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def _to_date(value) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def _to_str(length: Optional[int]) -> Callable:
+    def convert(value) -> str:
+        if isinstance(value, (dict, list)):
+            raise ValueError(f'無法轉換為字串: {value!r}')
+        value = str(value)
+        if length is not None and len(value) > length:
+            raise ValueError(f'長度超過{length}')
+        return value
+    return convert
+
+
+def _converter(column) -> Optional[Callable]:
+    """依欄位型別建立轉換函式，無法判斷型別(JSON等)時不轉換"""
+    try:
+        python_type = column.type.python_type
+    except (AttributeError, NotImplementedError):
+        return None
+    if python_type is bool:
+        return _to_bool
+    if python_type is int:
+        return _to_int
+    if python_type is float:
+        return float
+    if python_type is Decimal:
+        return _to_decimal
+    if python_type is datetime:
+        return _to_datetime
+    if python_type is date:
+        return _to_date
+    if python_type is str:
+        return _to_str(getattr(column.type, 'length', None))
+    return None
+
+
+class _Column:
+    __slots__ = ('convert', 'nullable', 'blank_is_null')
+
+    def __init__(self, column):
+        self.convert = _converter(column)
+        self.nullable = column.nullable
+        # csv無法表示NULL，字串以外欄位的空字串視為NULL
+        self.blank_is_null = self.convert is not None and column.type.python_type is not str
+
+
+class RowValidator:
+    """依model的mapper欄位檢查與轉換dict(未知欄位、必填欄位、型別、字串長度)"""
+
+    def __init__(self, model):
+        columns = {attr.key: attr.columns[0] for attr in model.__mapper__.column_attrs}
+        self.columns = {key: _Column(column) for key, column in columns.items()}
+        # 不可為NULL且沒有預設值的欄位(主鍵由資料庫產生)
+        self.required = tuple(
+            key for key, column in columns.items()
+            if not column.nullable and column.default is None and column.server_default is None
+            and not column.primary_key
+        )
+        self.shard_key = shard_key(model)  # 分片模型依此欄位分組寫入，缺少時拒絕
+
+    def __call__(self, row: dict) -> dict:
+        if unknown := [key for key in row if key not in self.columns]:
+            raise ValueError(f'未知欄位: {", ".join(map(str, unknown))}')
+        values = {}
+        for key, value in row.items():
+            column = self.columns[key]
+            if value is None or (value == '' and column.blank_is_null):
+                if not column.nullable:
+                    raise ValueError(f'{key}不可為空')
+                values[key] = None
+            else:
+                try:
+                    values[key] = value if column.convert is None else column.convert(value)
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f'{key}: {e}')
+        if missing := [key for key in self.required if key not in values]:
+            raise ValueError(f'缺少必填欄位: {", ".join(missing)}')
+        if self.shard_key is not None and values.get(self.shard_key) is None:
+            raise ValueError(f'缺少分片鍵{self.shard_key}')
+        return values
+
+
+# ---------- 讀檔 ----------
+def _read_csv(path: str) -> Iterator[tuple]:
+    """(行號, dict, 錯誤)，第一行為欄位名稱"""
+    with open(path, newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return
+        for values in reader:
+            if not values:
+                continue
+            if len(values) != len(header):
+                yield reader.line_num, values, f'欄位數{len(values)}與標題{len(header)}不符'
+                continue
+            yield reader.line_num, dict(zip(header, values)), None
+
+
+def _read_jsonl(path: str) -> Iterator[tuple]:
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(path, 'rb') as file:
+        for line, text in enumerate(file, 1):
+            if not text.strip():
+                continue
+            try:
+                row = loads(text)
+            except ValueError as e:
+                yield line, text.decode('utf-8', 'replace').rstrip('\n'), f'JSON格式錯誤: {e}'
+                continue
+            if not isinstance(row, dict):
+                yield line, row, '每行必須為JSON物件'
+                continue
+            yield line, row, None
+
+
+_READERS = {'csv': _read_csv, 'jsonl': _read_jsonl}
+
+
+# ---------- 解析執行緒 ----------
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _put(pipe: queue.Queue, item, stop: threading.Event) -> bool:
+    """佇列已滿時等待，寫入端停止後放棄"""
+    while not stop.is_set():
+        try:
+            pipe.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _parse(records: Iterator[tuple], prepare: Callable, validate: RowValidator, batch_size: int,
+           pipe: queue.Queue, stop: threading.Event, stats: LoadStats):
+    """讀檔、檢查與轉換，每batch_size筆放入佇列"""
+    try:
+        batch = []
+        for line, row, error in records:
+            if stop.is_set():
+                return
+            if error is None:
+                try:
+                    batch.append(validate(prepare(row)))
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                stats.reject(line, row, error)
+            if len(batch) >= batch_size:
+                if not _put(pipe, batch, stop):
+                    return
+                batch = []
+        if batch and not _put(pipe, batch, stop):
+            return
+        _put(pipe, _DONE, stop)
+    except BaseException as e:
+        _put(pipe, _Failure(e), stop)
+
+
+# ---------- 寫入 ----------
+def _same_keys(rows: list) -> Iterator[list]:
+    """多列INSERT需要欄位一致，依欄位組合分組(csv整批相同)"""
+    if all(row.keys() == rows[0].keys() for row in rows):
+        yield rows
+        return
+    for _, group in groupby(sorted(rows, key=lambda row: tuple(row)), key=lambda row: tuple(row)):
+        yield list(group)
+
+
+def _python_defaults(model, fields) -> dict:
+    """LOAD DATA不套用sqlalchemy的default，補上缺少欄位的Python端預設值"""
+    defaults = {}
+    for column in model.__table__.columns:
+        default = column.default
+        if column.key in fields or default is None or column.primary_key:
+            continue
+        if default.is_scalar:
+            defaults[column.key] = default.arg
+        elif default.is_callable:
+            defaults[column.key] = default.arg(None)
+    return defaults
+
+
+def _escape(value) -> str:
+    """LOAD DATA欄位值(\\N為NULL)"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r') \
+        .replace('\0', '\\0')
+
+
+def _load_data(session, model, rows: list) -> int:
+    """寫入暫存tab分隔檔後以LOAD DATA LOCAL INFILE匯入"""
+    affected = 0
+    for group in _same_keys(rows):
+        defaults = _python_defaults(model, group[0].keys())
+        fields = list(group[0]) + list(defaults)
+        fd, path = tempfile.mkstemp(suffix='.tsv')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as file:
+                for row in group:
+                    values = [row[field] for field in group[0]] + list(defaults.values())
+                    file.write('\t'.join(map(_escape, values)) + '\n')
+            affected += session.execute(load_data_stmt(model, path, fields)).rowcount
+        finally:
+            os.remove(path)
+    return affected
+
+
+def write_rows(service, rows: list, on_duplicate: str, conflict_keys: Optional[Sequence[str]],
+               update_fields: Optional[Sequence[str]]) -> int:
+    """單批寫入(各批各自提交)，回傳影響筆數"""
+    model = service.__model__
+    rows = service._stamp(rows)
+    with db.session_scope(commit=True) as session:
+        dialect = dialect_of(session)
+        if dialect == 'mysql' and db.local_infile and on_duplicate == 'ignore':
+            return _load_data(session, model, rows)
+        affected = 0
+        for group in _same_keys(rows):
+            if on_duplicate == 'ignore':
+                stmt = insert_ignore_many(dialect, model, group)
+            else:
+                stmt = upsert_many(dialect, model, group, conflict_keys or (), update_fields)
+            affected += session.execute(stmt).rowcount
+        return affected
+
+
+def load_service(service, path: str, format_='csv', batch_size=1000, on_duplicate='ignore',
+                 conflict_keys: Optional[Sequence[str]] = None, update_fields: Optional[Sequence[str]] = None,
+                 queue_size=4, on_progress: Optional[Callable] = None, report_every: float = 5,
+                 keep_rejected=1000) -> LoadStats:
+    """匯入檔案至Service的資料表，參數見Service.load_file"""
+    if format_ not in FORMATS:
+        raise ValueError(f'format必須為{"/".join(FORMATS)}其中之一')
+    if on_duplicate not in ON_DUPLICATE:
+        raise ValueError(f'on_duplicate必須為{"/".join(ON_DUPLICATE)}其中之一')
+    if on_duplicate == 'update' and not conflict_keys:
+        raise ValueError("on_duplicate='update'需要conflict_keys")
+    if batch_size <= 0 or queue_size <= 0:
+        raise ValueError('batch_size與queue_size必須大於0')
+    records = _READERS[format_](path)
+    stats = LoadStats(keep_rejected)
+    pipe: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    parser = threading.Thread(
+        target=_parse, name='load-file-parser', daemon=True,
+        args=(records, service._preprocess_params, RowValidator(service.__model__), batch_size, pipe, stop, stats),
+    )
+    parser.start()
+    last_report = time.monotonic()
+    try:
+        while (item := pipe.get()) is not _DONE:
+            if isinstance(item, _Failure):
+                raise item.error
+            stats.record(len(item), service._load_rows(item, on_duplicate, conflict_keys, update_fields))
+            if on_progress is not None:
+                on_progress(stats)
+            if time.monotonic() - last_report >= report_every:
+                last_report = time.monotonic()
+                logger.info('匯入%s: %d筆 %s筆/秒 拒絕%d筆', path, stats.rows, stats.rows_per_second,
+                            stats.rejected_count)
+    finally:
+        stop.set()
+        parser.join()
+    stats.finished = time.monotonic()
+    logger.info('匯入%s完成: %d筆 %s筆/秒 拒絕%d筆', path, stats.rows, stats.rows_per_second, stats.rejected_count)
+    return stats
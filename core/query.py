@@ -0,0 +1,275 @@
+"""
+Service鏈式查詢
+service.query().where(created_at__gte=...).order_by('-id').limit(100).all()
+分片模型沒有分片鍵條件時並行查詢各分片，依order_by合併後套用offset/limit
+"""
+from collections import namedtuple
+from functools import lru_cache, partial
+from typing import Optional
+from sqlalchemy import Integer, bindparam, exists, func, select
+from .database import db
+from .sharding import ordered_merge, shard_key
+
+_SEPARATOR = '__'
+
+# lookup -> (column, 參數) -> 條件
+_LOOKUPS = {
+    'exact': lambda c, p: c == p,
+    'ne': lambda c, p: c != p,
+    'gt': lambda c, p: c > p,
+    'gte': lambda c, p: c >= p,
+    'lt': lambda c, p: c < p,
+    'lte': lambda c, p: c <= p,
+    'in': lambda c, p: c.in_(p),
+    'contains': lambda c, p: c.contains(p),
+    'icontains': lambda c, p: c.icontains(p),
+    'startswith': lambda c, p: c.startswith(p),
+    'istartswith': lambda c, p: c.istartswith(p),
+    'endswith': lambda c, p: c.endswith(p),
+    'iendswith': lambda c, p: c.iendswith(p),
+}
+
+
+@lru_cache(maxsize=256)
+def named_row(fields: tuple):
+    """投影結果的具名tuple類別(依欄位組合快取)"""
+    return namedtuple('Row', fields)
+
+
+def parse_lookup(key: str, value) -> tuple:
+    """
+    'created_at__gte' -> ('created_at', 'gte')
+    語句形狀與值有關的lookup(isnull、exact None)會把值放進形狀
+    """
+    field, _, op = key.partition(_SEPARATOR)
+    op = op or 'exact'
+    if op == 'exact' and value is None:
+        return field, 'isnull', True
+    if op == 'isnull':
+        return field, 'isnull', bool(value)
+    if op != 'range' and op not in _LOOKUPS:
+        raise ValueError(f'不支援的查詢條件: {key}')
+    return field, op
+
+
+def _column(model, field: str):
+    if field not in model.get_converter().column_fields:
+        raise ValueError(f'{model.__name__}沒有欄位: {field}')
+    return getattr(model, field)
+
+
+def _with_modifiers(model, fields: tuple) -> bool:
+    """投影欄位是否包含擴充欄位(__json_modifiers__)，是則需SELECT完整欄位"""
+    return not {name for name, _ in model.get_converter().modifiers}.isdisjoint(fields)
+
+
+def _criteria(model, shape: tuple) -> list:
+    """依條件形狀建立帶bindparam的WHERE條件，參數名稱為p0、p1..."""
+    criteria = []
+    for index, lookup in enumerate(shape):
+        column = _column(model, lookup[0])
+        op = lookup[1]
+        name = f'p{index}'
+        if op == 'isnull':
+            criteria.append(column.is_(None) if lookup[2] else column.is_not(None))
+        elif op == 'range':
+            criteria.append(column.between(bindparam(f'{name}_0'), bindparam(f'{name}_1')))
+        elif op == 'in':
+            criteria.append(column.in_(bindparam(name, expanding=True)))
+        else:
+            criteria.append(_LOOKUPS[op](column, bindparam(name)))
+    return criteria
+
+
+@lru_cache(maxsize=512)
+def _compile(model, kind: str, shape: tuple, order: tuple, has_limit: bool, has_offset: bool, fields: tuple,
+             deleted: Optional[tuple] = None):
+    """
+    依查詢形狀建立(並快取)語句
+    相同形狀重複查詢時沿用同一個語句物件，sqlalchemy的cache key也只計算一次
+    :param deleted: (軟刪除欄位, 刪除值)，排除已軟刪除的資料
+    """
+    criteria = _criteria(model, shape)
+    if deleted is not None:
+        criteria.append(_column(model, deleted[0]).is_distinct_from(deleted[1]))
+    if kind == 'exists':
+        return select(exists().where(*criteria))
+    if kind == 'count':
+        if not (has_limit or has_offset):
+            return select(func.count()).select_from(model).where(*criteria)
+        inner = select(model.id).where(*criteria)
+    else:
+        converter = model.get_converter()
+        if not fields or _with_modifiers(model, fields):
+            inner = select(*converter.columns).where(*criteria)
+        else:
+            inner = select(*[_column(model, f) for f in fields]).where(*criteria)
+    for field in order:
+        column = _column(model, field.lstrip('-'))
+        inner = inner.order_by(column.desc() if field.startswith('-') else column.asc())
+    if has_limit:
+        inner = inner.limit(bindparam('_limit', type_=Integer))
+    if has_offset:
+        inner = inner.offset(bindparam('_offset', type_=Integer))
+    if kind == 'count':
+        return select(func.count()).select_from(inner.subquery())
+    return inner
+
+
+class Query:
+    """
+    鏈式查詢(不可變，每次呼叫回傳新的Query)
+    支援lookup: exact、ne、gt、gte、lt、lte、in、contains、icontains、startswith、istartswith、
+    endswith、iendswith、isnull、range
+    綁定Service時同步執行，綁定AsyncService時終端方法回傳coroutine
+    """
+
+    def __init__(self, service):
+        self._service = service
+        self._model = service.__model__
+        field = service.__deleted_field__
+        self._deleted: Optional[tuple] = (field, service.__deleted_value__) if field is not None else None
+        self._lookups: tuple = ()  # ((形狀), 值)
+        self._order: tuple = ()
+        self._limit: Optional[int] = None
+        self._offset: Optional[int] = None
+
+    def _clone(self, **changes) -> 'Query':
+        query = object.__new__(Query)
+        query.__dict__.update(self.__dict__)
+        query.__dict__.update(changes)
+        return query
+
+    def where(self, **lookups) -> 'Query':
+        """條件(AND)"""
+        added = tuple((parse_lookup(key, value), value) for key, value in lookups.items())
+        return self._clone(_lookups=self._lookups + added)
+
+    def order_by(self, *fields: str) -> 'Query':
+        """排序，'-id'為降冪"""
+        return self._clone(_order=self._order + fields)
+
+    def limit(self, limit: int) -> 'Query':
+        return self._clone(_limit=limit)
+
+    def offset(self, offset: int) -> 'Query':
+        return self._clone(_offset=offset)
+
+    def statement(self, kind='all', fields: tuple = ()):
+        """(語句, 參數)"""
+        shape = tuple(lookup for lookup, _ in self._lookups)
+        stmt = _compile(
+            self._model, kind, shape, self._order if kind != 'exists' else (),
+            self._limit is not None and kind != 'exists', self._offset is not None and kind != 'exists', fields,
+            self._deleted,
+        )
+        params = {}
+        for index, (lookup, value) in enumerate(self._lookups):
+            op = lookup[1]
+            if op == 'isnull':
+                continue
+            if op == 'range':
+                params[f'p{index}_0'], params[f'p{index}_1'] = value
+            elif op == 'in':
+                params[f'p{index}'] = list(value)
+            else:
+                params[f'p{index}'] = value
+        if self._limit is not None and kind != 'exists':
+            params['_limit'] = self._limit
+        if self._offset is not None and kind != 'exists':
+            params['_offset'] = self._offset
+        return stmt, params
+
+    # ---------- 分片 ----------
+    def _shards(self) -> Optional[list]:
+        """分片模型查詢的分片(分片鍵exact/in條件，否則為所有分片)；非分片模型或已在分片內時為None"""
+        if (key := shard_key(self._model)) is None or db.current_shard is not None:
+            return None
+        for (field, op, *_), value in self._lookups:
+            if field == key and op == 'exact':
+                return [db.shard_for(self._model, value)]
+            if field == key and op == 'in':
+                return db.shards_for(self._model, value)
+        return list(db.shards)
+
+    def _window(self) -> 'Query':
+        """各分片取前offset+limit筆(不跳過)，合併後再套用offset/limit"""
+        if self._offset is None:
+            return self
+        return self._clone(_limit=None if self._limit is None else self._offset + self._limit, _offset=None)
+
+    def _scatter(self, shards: list, kind: str, fields: tuple, handle, merge):
+        service = self._service
+        stmt, params = self._window().statement(kind, fields)
+        return service._scatter([(shard, partial(service._run_query, stmt, params, handle)) for shard in shards], merge)
+
+    def _merge_rows(self, results: list) -> list:
+        return ordered_merge(results, self._order, self._offset, self._limit)
+
+    def _merge_count(self, results: list) -> int:
+        total = max(0, sum(results) - (self._offset or 0))
+        return total if self._limit is None else min(total, self._limit)
+
+    # ---------- 終端方法 ----------
+    def all(self):
+        """所有符合的ORMObject"""
+        from_rows = self._model.get_converter().from_rows
+        if (shards := self._shards()) is not None:
+            return self._scatter(shards, 'all', (), from_rows, self._merge_rows)
+        return self._service._run_query(*self.statement(), from_rows)
+
+    def first(self):
+        """第一筆ORMObject"""
+        query = self._clone(_limit=1)
+        if (shards := query._shards()) is not None:
+            rows = query._merge_rows
+            return query._scatter(
+                shards, 'all', (), self._model.get_converter().from_rows, lambda results: next(iter(rows(results)), None),
+            )
+        from_row = self._model.get_converter().from_row
+        stmt, params = query.statement()
+        return self._service._run_query(stmt, params, lambda result: from_row(row) if (row := result.first()) else None)
+
+    def values_list(self, *fields: str, flat=False):
+        """欄位投影，回傳Row list，單一欄位且flat=True時回傳值list(同Service.values_list)"""
+        service = self._service
+        service._projection(fields, {})  # 檢查欄位
+        flat = flat and len(fields) == 1
+        if (shards := self._shards()) is None:
+            with_modifiers = _with_modifiers(self._model, fields)
+            stmt, params = self.statement('all', tuple(fields))
+            return service._run_query(
+                stmt, params, lambda result: service._flatten(service._project(result, fields, with_modifiers), flat),
+            )
+        # 分片合併需要排序欄位，未投影的排序欄位一併查詢，合併後去除
+        extra = tuple(dict.fromkeys(f.lstrip('-') for f in self._order if f.lstrip('-') not in fields))
+        selected = tuple(fields) + extra
+        with_modifiers = _with_modifiers(self._model, selected)
+
+        def merge(results):
+            rows = self._merge_rows(results)
+            if extra:
+                row_class = named_row(tuple(fields))
+                rows = [row_class(*(getattr(row, f) for f in fields)) for row in rows]
+            return service._flatten(rows, flat)
+        return self._scatter(
+            shards, 'all', selected, lambda result: service._project(result, selected, with_modifiers), merge,
+        )
+
+    def count(self) -> int:
+        if (shards := self._shards()) is not None:
+            return self._scatter(shards, 'count', (), _scalar, self._merge_count)
+        return self._service._run_query(*self.statement('count'), _scalar)
+
+    def exists(self) -> bool:
+        if (shards := self._shards()) is not None:
+            return self._scatter(shards, 'exists', (), _exists, any)
+        return self._service._run_query(*self.statement('exists'), _exists)
+
+
+def _scalar(result):
+    return result.scalar()
+
+
+def _exists(result) -> bool:
+    return bool(result.scalar())
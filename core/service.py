@@ -1,14 +1,85 @@
 """
 資料庫查詢封裝
 """
-from typing import Optional
-from .database import db, ORMObject
+from functools import partial
+from typing import AsyncIterator, Iterable, Iterator, Optional, Sequence, Union
+from sqlalchemy import case, func, inspect
+from sqlalchemy.exc import IntegrityError
+from .database import db, redis, ORMObject
+from .database.cache import CachePolicy, ServiceCache
+from .database.dedup import DedupPolicy, Deduplicator
+from .database.metrics import instrument_class
+from .query import Query, named_row
+from .sharding import route_class, shard_key
+from .writer import BufferedWriter
+from .export import ExportStats, export_service
+from .loader import LoadStats, load_service, write_rows
+from .database.statements import (
+    chunked, dialect_of, insert_many, insert_ignore_many, upsert_many, inserted_ids, key_filter,
+    autoinc_settings_stmt, check_inferred_ids,
+    get_or_create_stmt, is_duplicate_key, upsert_stmt, upserted_id, approximate_count_stmt,
+)
 from exceptions import DBOptionError
+from utils import stamp_rows
 
 
-class Service:
+def _metrics():
+    return db.metrics
+
+
+class _BaseService:
+    """Service/AsyncService共用邏輯"""
 
     __model__ = None
+    __cache__: Optional[CachePolicy] = None  # 讀穿快取設定
+    # 軟刪除欄位，delete(mark_deleted=True)時寫入；設定後讀取(get/first/all/count/exists/get_many/iter_all/
+    # values_list/query/export)排除已軟刪除的資料，寫入後的回讀(update/upsert/get_or_create)不排除
+    __deleted_field__: Optional[str] = None
+    __deleted_value__ = True  # 軟刪除時寫入的值
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        分片模型(__shard_key__)的方法加上分片路由
+        公開方法加上計時包裝，db.instrument()啟用後才記錄
+        """
+        super().__init_subclass__(**kwargs)
+        if shard_key(cls.__model__) is not None:
+            route_class(cls)
+        instrument_class(cls, _metrics)
+
+    @property
+    def _cache(self) -> Optional[ServiceCache]:
+        """依__cache__建立(並快取於Service類別)的快取層"""
+        cls = type(self)
+        if cls.__cache__ is None:
+            return None
+        cache = cls.__dict__.get('_service_cache')
+        if cache is None:
+            cache = cls._service_cache = ServiceCache(cls.__cache__, cls.__model__, redis)
+        return cache
+
+    @staticmethod
+    def _uncommitted() -> bool:
+        """是否在尚未提交的寫入範圍內(Service: db.transaction() / AsyncService: db.unit_of_work())"""
+        return db.in_transaction
+
+    @property
+    def _read_cache(self) -> Optional[ServiceCache]:
+        """讀取使用的快取；範圍內可能讀到未提交的資料，不讀取也不回填快取"""
+        return None if self._uncommitted() else self._cache
+
+    def _not_deleted(self) -> tuple:
+        """讀取條件：設定__deleted_field__時排除已軟刪除的資料(欄位為NULL視為未刪除)"""
+        if self.__deleted_field__ is None:
+            return ()
+        return (getattr(self.__model__, self.__deleted_field__).is_distinct_from(self.__deleted_value__),)
+
+    def _deleted(self, model) -> bool:
+        """已載入的Sqlalchemy物件是否已軟刪除"""
+        return self.__deleted_field__ is not None and getattr(model, self.__deleted_field__) == self.__deleted_value__
+
+    def _first_query(self, kws: dict):
+        return db.query(self.__model__).filter_by(**kws).filter(*self._not_deleted()).limit(1)
 
     def _isinstance(self, model, raise_error=True):
         """檢查model是否伺服器配置的相同"""
@@ -21,21 +92,258 @@ class Service:
     def _preprocess_params(kws):
         return kws
 
+    @staticmethod
+    def _check_returning(returning):
+        """批次寫入回傳類型: None(筆數) / 'ids' / 'objects'"""
+        if returning not in (None, 'ids', 'objects'):
+            raise ValueError("returning必須是None、'ids'或'objects'")
+
+    def _select_by_ids(self, ids: Sequence[int]):
+        return db.query(self.__model__).filter(self.__model__.id.in_(ids))
+
+    def _page_query(self, last_id: Optional[int], batch_size: int, kws: dict):
+        """以id做keyset分頁，並開啟server-side cursor逐批讀取"""
+        columns = self.__model__.get_converter().columns
+        query = (db.query(*columns).filter_by(**kws).filter(*self._not_deleted())
+                 .order_by(self.__model__.id).limit(batch_size))
+        if last_id is not None:
+            query = query.filter(self.__model__.id > last_id)
+        return query.execution_options(yield_per=batch_size)
+
+    def _range_query(self, low: int, high: int, kws: dict):
+        """low <= id < high(依id排序)"""
+        model = self.__model__
+        columns = model.get_converter().columns
+        return (db.query(*columns).filter_by(**kws).filter(model.id >= low, model.id < high, *self._not_deleted())
+                .order_by(model.id))
+
+    def _bounds_query(self, kws: dict):
+        return (db.query(func.min(self.__model__.id), func.max(self.__model__.id)).filter_by(**kws)
+                .filter(*self._not_deleted()))
+
+    def _rows_by_ids(self, ids: Sequence[int]):
+        columns = self.__model__.get_converter().columns
+        return db.query(*columns).filter(self.__model__.id.in_(ids))
+
+    @staticmethod
+    def _pick(found: dict, ids: list, as_dict: bool):
+        """get_many回傳格式：依輸入順序的list(略過不存在的id)或{id: ORMObject}"""
+        if as_dict:
+            return found
+        return [found[id_] for id_ in ids if id_ in found]
+
+    def query(self) -> Query:
+        """
+        鏈式查詢
+        service.query().where(created_at__gte=start).order_by('-id').limit(100).all()
+        """
+        return Query(self)
+
+    def _exists_stmt(self, kws: dict):
+        return db.query(db.query(self.__model__.id).filter_by(**kws).filter(*self._not_deleted()).limit(1).exists())
+
+    def _count_stmt(self, kws: dict):
+        return db.query(func.count()).select_from(self.__model__).filter_by(**kws).filter(*self._not_deleted())
+
+    def _projection(self, fields: Sequence[str], kws: dict):
+        """
+        欄位投影查詢，只SELECT需要的欄位
+        要求擴充欄位(__json_modifiers__)時才SELECT完整欄位並計算擴充欄位
+        :return: (查詢, 是否需要計算擴充欄位)
+        """
+        converter = self.__model__.get_converter()
+        modifiers = {name for name, _ in converter.modifiers}
+        if unknown := [f for f in fields if f not in converter.column_fields and f not in modifiers]:
+            raise ValueError(f'{self.__model__.__name__}沒有欄位: {unknown}')
+        columns = converter.columns if modifiers.intersection(fields) else [getattr(self.__model__, f) for f in fields]
+        return db.query(*columns).filter_by(**kws).filter(*self._not_deleted()), columns is converter.columns
+
+    def _project(self, rows, fields: Sequence[str], with_modifiers: bool) -> list:
+        """投影結果：無擴充欄位時直接回傳Row，否則只計算要求的擴充欄位後取出要求的欄位"""
+        if not with_modifiers:
+            return list(rows)
+        row_class = named_row(tuple(fields))
+        converter = self.__model__.get_converter()
+        from_row, modifiers = converter.from_row, converter.row_modifiers(fields)
+        instances = (from_row(row, modifiers) for row in rows)
+        return [row_class(*(getattr(instance, f) for f in fields)) for instance in instances]
+
+    @staticmethod
+    def _flatten(rows: list, flat: bool) -> list:
+        return [row[0] for row in rows] if flat else rows
+
+    def _rows_by(self, kws: dict):
+        columns = self.__model__.get_converter().columns
+        return db.query(*columns).filter_by(**kws).limit(1)
+
+    def _rows_by_keys(self, keys: Sequence[str], rows: Sequence[dict]):
+        columns = self.__model__.get_converter().columns
+        return db.query(*columns).filter(key_filter(self.__model__, keys, rows))
+
+    def _keyed(self, rows, keys: Sequence[str]) -> dict:
+        """Row -> {自然鍵tuple: ORMObject}"""
+        from_row = self.__model__.get_converter().from_row
+        return {tuple(getattr(instance, k) for k in keys): instance for instance in map(from_row, rows)}
+
+    def _created_lookup(self, result, kws: dict) -> tuple[bool, object]:
+        """
+        get_or_create_stmt執行後判斷是否新增，並回傳讀取該列的查詢
+        result為None(mysql重複鍵)或rowcount為0時表示已存在，以查詢條件讀取
+        """
+        if result is not None and result.rowcount:
+            return True, self._rows_by_ids([result.lastrowid])
+        return False, self._rows_by(kws)
+
+    @staticmethod
+    def _created_row(row, kws: dict, values: dict):
+        """新增因其他唯一鍵重複而略過，查詢條件卻找不到資料時(defaults與既有資料衝突)拋錯"""
+        if row is None:
+            raise DBOptionError('新增的資料與既有資料的唯一鍵衝突，且查無符合條件的資料。', payload={
+                'kws': kws, 'values': values,
+            })
+        return row
+
+    def _select_by_keys(self, keys: Sequence[str], rows: Sequence[dict]):
+        return db.query(self.__model__).filter(key_filter(self.__model__, keys, rows))
+
+    def _stamp(self, rows: list) -> list:
+        """批次新增時整批共用一次取得的時間欄位，不必逐列呼叫default"""
+        if fields := getattr(self.__model__, '__timestamp_columns__', ()):
+            return stamp_rows(rows, *fields)
+        return rows
+
+    def _unloaded_columns(self, model) -> set:
+        """尚未載入的欄位(例如資料庫產生的server_default)"""
+        return inspect(model).unloaded & set(self.__model__.get_converter().column_fields)
+
+    def _column_values(self, values: dict) -> dict:
+        """只保留資料表欄位(不含id)"""
+        columns = self.__model__.get_converter().column_fields
+        return {k: v for k, v in values.items() if k in columns and k != 'id'}
+
+    def _onupdate_values(self, values: dict) -> dict:
+        """核心UPDATE語句不套用Python端的onupdate，先算好一併寫入(SQL運算式的onupdate由資料庫產生)"""
+        rv = {}
+        for column in self.__model__.__table__.columns:
+            onupdate = column.onupdate
+            if onupdate is None or column.key in values:
+                continue
+            if onupdate.is_scalar:
+                rv[column.key] = onupdate.arg
+            elif onupdate.is_callable:
+                rv[column.key] = onupdate.arg(None)
+        return rv
+
+    def _update_values(self, model, kws: dict) -> dict:
+        """
+        update()寫入的欄位值
+        未傳入更新值時以原物件的欄位值更新，時間欄位與onupdate欄位不沿用舊值，由onupdate重新產生
+        """
+        if not (updated := self._preprocess_params(kws)):
+            skipped = set(getattr(self.__model__, '__timestamp_columns__', ())) | {
+                column.key for column in self.__model__.__table__.columns if column.onupdate is not None
+            }
+            updated = {k: v for k, v in vars(model).items() if k in model.columns and k not in skipped}
+        values = self._column_values(updated)
+        values.update(self._onupdate_values(values))
+        return values
+
+    def _update_row_stmt(self, dialect: str, id_: int, values: dict):
+        """單筆UPDATE，支援RETURNING的方言一併回傳更新後的整列(mysql於同一交易內以id回讀)"""
+        stmt = self._update_stmt({'id': id_}, values)
+        if dialect != 'mysql':
+            stmt = stmt.returning(*self.__model__.get_converter().columns)
+        return stmt
+
+    def _update_stmt(self, filters: dict, values: dict):
+        if not values:
+            raise DBOptionError('沒有可更新的欄位。', payload={'values': values})
+        return (db.update(self.__model__).filter_by(**filters).values(**values)
+                .execution_options(synchronize_session=False))
+
+    def _delete_stmt(self, filters: dict, mark_deleted=False):
+        if mark_deleted:
+            if self.__deleted_field__ is None:
+                raise DBOptionError('未設定軟刪除欄位__deleted_field__。')
+            return self._update_stmt(filters, {self.__deleted_field__: self.__deleted_value__})
+        return db.delete(self.__model__).filter_by(**filters).execution_options(synchronize_session=False)
+
+    def _case_update_stmts(self, items: Iterable[tuple], batch_size: int):
+        """
+        update_many: 每批組成一個
+        UPDATE ... SET f = CASE id WHEN :id THEN :v ... ELSE f END WHERE id IN (...)
+        """
+        model = self.__model__
+        for chunk in chunked(items, batch_size):
+            fields: dict = {}
+            for id_, values in chunk:
+                for k, v in self._column_values(values).items():
+                    fields.setdefault(k, {})[id_] = v
+            if not fields:
+                continue
+            values = {k: case(whens, value=model.id, else_=getattr(model, k)) for k, whens in fields.items()}
+            ids = [id_ for id_, _ in chunk]
+            yield (db.update(model).where(model.id.in_(ids)).values(**values)
+                   .execution_options(synchronize_session=False))
+
+    def _key_rows(self, filters: Optional[dict] = None, ids: Optional[list] = None):
+        """快取失效前先取出受影響資料列的快取鍵欄位"""
+        names = {f for fields in self.__cache__.key_fields for f in fields}
+        query = db.query(*[getattr(self.__model__, f) for f in names])
+        if ids is not None:
+            return query.filter(self.__model__.id.in_(ids))
+        return query.filter_by(**filters)
+
+    @staticmethod
+    def _order_by_ids(models, ids: Sequence[int]) -> list[ORMObject]:
+        """依輸入id順序排列"""
+        mapping = {model.id: model.get_instance() for model in models}
+        return [mapping[id_] for id_ in ids if id_ in mapping]
+
+    def _ids_by_keys(self, models, keys: Sequence[str], rows: Sequence[dict]) -> list[int]:
+        return [instance.id for instance in self._order_by_keys(models, keys, rows)]
+
+    @staticmethod
+    def _order_by_keys(models, keys: Sequence[str], rows: Sequence[dict]) -> list[ORMObject]:
+        """依輸入自然鍵順序排列"""
+        mapping = {tuple(getattr(model, k) for k in keys): model.get_instance() for model in models}
+        return [mapping[key] for row in rows if (key := tuple(row[k] for k in keys)) in mapping]
+
+
+class Service(_BaseService):
+
+    def _after_write(self, *instances, old=None):
+        """寫入後同步快取；交易尚未提交時只清除不回填"""
+        if (cache := self._cache) is None or not instances:
+            return
+        for instance in instances:
+            if self._uncommitted():
+                cache.invalidate(instance)
+                if old is not None:
+                    cache.invalidate(old)
+            else:
+                cache.refresh(instance, old=old)
+        cache.invalidate_counts()
+
+    def _counts_changed(self):
+        """無個別資料可回填的寫入(批次新增/條件更新刪除)後清除count快取"""
+        if (cache := self._cache) is not None:
+            cache.invalidate_counts()
+
     def save(self, model) -> Optional[ORMObject]:
         """儲存資料"""
         self._isinstance(model)
-        session = db.session
-        try:
-            session.add(model)
-            session.flush()
-            session.commit()
-            instance: ORMObject = model.get_instance()
-        except Exception as e:
-            session.rollback()
-            instance = None
-            raise DBOptionError('資料庫新增時發生錯誤。', payload={'error': e, 'instance': instance})
-        finally:
-            session.close()
+        try:
+            with db.session_scope(commit=True) as session:
+                session.add(model)
+                session.flush()
+                if self._unloaded_columns(model):
+                    # server_default等由資料庫產生的欄位，以主鍵刷新一次
+                    session.refresh(model)
+                instance: ORMObject = model.get_instance()
+        except Exception as e:
+            raise DBOptionError('資料庫新增時發生錯誤。', payload={'error': e, 'instance': None})
+        self._after_write(instance)
         return instance
 
     def create(self, **kws) -> ORMObject:
@@ -44,186 +352,924 @@ class Service:
         instance: ORMObject = self.save(model)
         return instance
 
+    def bulk_create(self, rows: Iterable[dict], batch_size=500, returning=None,
+                    key_fields: Optional[Sequence[str]] = None) -> Union[int, list]:
+        """
+        批次新增(多列INSERT)
+        :param rows: 資料列
+        :param batch_size: 每批筆數
+        :param returning: None回傳新增筆數 / 'ids'回傳新增id / 'objects'回傳ORMObject
+        :param key_fields: 唯一鍵欄位，mysql(不支援RETURNING)以此回讀新增的id；
+            未指定時以lastrowid推算連續id，自增設定或資料(含id)無法保證連續時拋錯
+        """
+        self._check_returning(returning)
+        total, ids, objects = 0, [], []
+        try:
+            with db.session_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                by_keys = returning is not None and dialect == 'mysql' and bool(key_fields)
+                settings = None
+                if returning is not None and not by_keys and (stmt := autoinc_settings_stmt(dialect)) is not None:
+                    settings = session.execute(stmt).one()
+                for chunk in chunked(map(self._preprocess_params, rows), batch_size):
+                    chunk = self._stamp(chunk)
+                    if settings is not None:
+                        check_inferred_ids(settings, chunk)
+                    stmt = insert_many(dialect, self.__model__, chunk, returning_ids=returning is not None)
+                    result = session.execute(stmt)
+                    total += len(chunk)
+                    if by_keys:
+                        models = session.scalars(self._select_by_keys(key_fields, chunk))
+                        ids.extend(self._ids_by_keys(models, key_fields, chunk))
+                    elif returning is not None:
+                        ids.extend(inserted_ids(dialect, result, len(chunk)))
+                if returning == 'objects':
+                    for chunk in chunked(ids, batch_size):
+                        objects.extend(self._order_by_ids(session.scalars(self._select_by_ids(chunk)), chunk))
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('資料庫批次新增時發生錯誤。', payload={'error': e})
+        self._counts_changed()
+        if returning == 'objects':
+            return objects
+        return ids if returning == 'ids' else total
+
+    def bulk_upsert(self, rows: Iterable[dict], conflict_keys: Sequence[str], update_fields=None,
+                    batch_size=500, returning=None) -> Union[int, list]:
+        """
+        批次新增或更新(mysql: ON DUPLICATE KEY UPDATE)
+        :param rows: 資料列
+        :param conflict_keys: 唯一鍵欄位，用於判斷重複與回讀
+        :param update_fields: 重複時更新的欄位，預設為conflict_keys以外的欄位
+        :param batch_size: 每批筆數
+        :param returning: None回傳處理筆數 / 'ids' / 'objects'(每批以唯一鍵回讀一次)
+        """
+        self._check_returning(returning)
+        cache = self._cache
+        total, objects = 0, []
+        try:
+            with db.session_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                for chunk in chunked(map(self._preprocess_params, rows), batch_size):
+                    session.execute(upsert_many(dialect, self.__model__, chunk, conflict_keys, update_fields))
+                    total += len(chunk)
+                    if returning is not None or cache is not None:
+                        models = session.scalars(self._select_by_keys(conflict_keys, chunk))
+                        objects.extend(self._order_by_keys(models, conflict_keys, chunk))
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('資料庫批次更新時發生錯誤。', payload={'error': e})
+        self._after_write(*objects)
+        if returning == 'ids':
+            return [instance.id for instance in objects]
+        return objects if returning == 'objects' else total
+
     def update(self, model: ORMObject, **kws) -> ORMObject:
-        """更新"""
+        """
+        更新(單一UPDATE語句)
+        回傳的ORMObject為更新後的整列(RETURNING，mysql於同一交易內回讀)，包含其他寫入者更新的欄位
+        """
         self._isinstance(model)
-        session = db.session
-        if not (updated := self._preprocess_params(kws)):
-            updated = {k: v for k, v in vars(model).items() if k in model.columns}
-        try:
-            target = session.query(self.__model__).get(model.id)
-            for k, v in updated.items():
-                if k in model.columns:
-                    setattr(target, k, v)
-            session.flush()
-            session.commit()
-            instance: ORMObject = target.get_instance()
-            return instance
-        except Exception as e:
-            session.rollback()
-            raise DBOptionError('資料庫更新時發生錯誤。')
-        finally:
-            session.close()
-
-    def delete(self, model_or_id: ORMObject, mark_deleted=False):
-        """刪除"""
-        if model_or_id is None:
-            return
-        model = model_or_id if self._isinstance(model_or_id, self.__model__) else self.get(model_or_id)
-        session = db.session
-        try:
-            target = session.query(self.__model__).get(model.id)
-            session.delete(target)
-            session.flush()
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise DBOptionError('資料庫刪除時發生錯誤。')
-        finally:
-            session.close()
-
-    def first(self, **kws) -> Optional[ORMObject]:
-        session = db.session
-        model = session.query(self.__model__).filter_by(**kws).first()
-        if not model:
-            return None
-        instance: ORMObject = model.get_instance()
-        session.close()
+        values = self._update_values(model, kws)
+        try:
+            with db.session_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                result = session.execute(self._update_row_stmt(dialect, model.id, values))
+                if dialect == 'mysql':
+                    result = session.execute(self._rows_by_ids([model.id])) if result.rowcount else None
+                if result is None or (row := result.first()) is None:
+                    raise DBOptionError('更新的資料不存在。', payload={'id': model.id})
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('資料庫更新時發生錯誤。', payload={'error': e})
+        instance = self.__model__.get_converter().from_row(row)
+        self._after_write(instance, old=model)
         return instance
 
+    def update_where(self, filters: dict, values: dict) -> int:
+        """
+        條件更新(單一 UPDATE ... WHERE)
+        :return: 影響筆數
+        """
+        values = self._column_values(self._preprocess_params(values))
+        values.update(self._onupdate_values(values))
+        return self._execute_write(self._update_stmt(filters, values), filters)
+
+    def update_many(self, items: Iterable[tuple], batch_size=500) -> int:
+        """
+        批次更新不同資料列的不同值，每批以一個CASE語句完成
+        :param items: [(id, {欄位: 值}), ...]
+        :return: 影響筆數
+        """
+        items = list(items)
+        stmts = self._case_update_stmts(items, batch_size)
+        return self._execute_write(stmts, ids=[id_ for id_, _ in items])
+
+    def delete(self, model_or_id: Union[ORMObject, int], mark_deleted=False) -> int:
+        """
+        刪除(單一DELETE語句)
+        :param mark_deleted: 軟刪除，將__deleted_field__設為__deleted_value__
+        :return: 影響筆數
+        """
+        if model_or_id is None:
+            return 0
+        id_ = model_or_id.id if self._isinstance(model_or_id, raise_error=False) else model_or_id
+        return self.delete_where({'id': id_}, mark_deleted=mark_deleted)
+
+    def delete_where(self, filters: dict, mark_deleted=False) -> int:
+        """
+        條件刪除(單一 DELETE ... WHERE，軟刪除時為 UPDATE ... WHERE)
+        :return: 影響筆數
+        """
+        return self._execute_write(self._delete_stmt(filters, mark_deleted), filters)
+
+    def _execute_write(self, stmts, filters: Optional[dict] = None, ids: Optional[list] = None) -> int:
+        """執行UPDATE/DELETE語句，有快取時先取出受影響的快取鍵，提交後失效"""
+        stmts = [stmts] if not isinstance(stmts, Iterator) else stmts
+        cache = self._cache
+        affected = []
+        try:
+            with db.session_scope(commit=True) as session:
+                if cache is not None:
+                    affected = session.execute(self._key_rows(filters, ids)).all()
+                rowcount = sum(session.execute(stmt).rowcount for stmt in stmts)
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('資料庫批次寫入時發生錯誤。', payload={'error': e})
+        for row in affected:
+            cache.invalidate(row)
+        if rowcount:
+            self._counts_changed()
+        return rowcount
+
+    def first(self, fields: Optional[Sequence[str]] = None, **kws) -> Optional[ORMObject]:
+        """
+        條件查詢第一筆
+        :param fields: 只查詢指定欄位，回傳具名Row(不經過快取)
+        """
+        if fields is not None:
+            return self._first_fields(fields, kws)
+        if (cache := self._read_cache) is not None:
+            return cache.fetch(kws, lambda: self._first(**kws))
+        return self._first(**kws)
+
+    def _first_fields(self, fields: Sequence[str], kws: dict):
+        query, with_modifiers = self._projection(fields, kws)
+        with db.session_scope() as session:
+            rows = self._project(session.execute(query.limit(1)), fields, with_modifiers)
+        return rows[0] if rows else None
+
+    def values_list(self, *fields: str, flat=False, **kws) -> list:
+        """
+        欄位投影查詢
+        service.values_list('id', 'name', is_active=True) -> [Row(id, name), ...]
+        :param flat: 單一欄位時回傳值list
+        """
+        query, with_modifiers = self._projection(fields, kws)
+        with db.session_scope() as session:
+            rows = self._project(session.execute(query), fields, with_modifiers)
+        return self._flatten(rows, flat and len(fields) == 1)
+
+    def scalar_column(self, field: str, **kws) -> list:
+        """單一欄位值list"""
+        return self.values_list(field, flat=True, **kws)
+
+    def _run_query(self, stmt, params: dict, handle):
+        """執行Query組成的語句"""
+        with db.session_scope() as session:
+            return handle(session.execute(stmt, params))
+
+    @staticmethod
+    def gather(*calls, **options) -> list:
+        """
+        以執行緒池並行執行多個查詢(db.thread_gather)
+        service.gather(*(partial(service.count, day=d) for d in days))
+        """
+        return db.thread_gather(*calls, **options)
+
+    @staticmethod
+    def _scatter(calls: list, merge):
+        """在各分片執行[(分片, 呼叫)]並合併結果，多個分片時以執行緒池並行"""
+        def run(shard, call):
+            with db.using_shard(shard):
+                return call()
+        if len(calls) == 1:
+            return merge([run(*calls[0])])
+        return merge(db.thread_gather(*(partial(run, shard, call) for shard, call in calls)))
+
+    def export(self, path: str, format='csv', workers=4, chunk_size=10000, processes=False, on_progress=None,
+               report_every: float = 5, **kws) -> ExportStats:
+        """
+        平行分段匯出(取代all()後逐筆序列化)
+        service.export('/data/report.jsonl', format='jsonl', workers=8, is_active=True)
+        欄位依__json_public__/__json_hidden__/__json_modifiers__規則輸出(同to_json)
+        :param format: csv / jsonl / parquet(需安裝pyarrow)
+        :param workers: 並行讀取數(各自使用連線池的連線)
+        :param chunk_size: 每個區間的id數
+        :param processes: 以程序池讀取與序列化(CPU密集時使用，需支援fork)
+        :param on_progress: 每寫入一個區間呼叫on_progress(ExportStats)
+        :param report_every: 每隔幾秒以logging輸出每秒筆數
+        """
+        return export_service(self, path, format, workers, chunk_size, processes, on_progress, report_every, kws)
+
+    def load_file(self, path: str, format='csv', batch_size=1000, on_duplicate='ignore', conflict_keys=None,
+                  update_fields=None, queue_size=4, on_progress=None, report_every: float = 5,
+                  keep_rejected=1000) -> LoadStats:
+        """
+        從檔案批次匯入(取代逐筆create)
+        stats = service.load_file('/data/backfill.jsonl', format='jsonl', batch_size=5000)
+        stats.rejected  # [Rejected(line, row, reason)]，格式或型別不符的資料不寫入
+        每批各自提交，中途失敗時已寫入的批次不會回滾
+        :param format: csv(第一行為欄位名稱) / jsonl
+        :param on_duplicate: ignore(略過重複鍵) / update(更新，需conflict_keys；mysql不使用LOAD DATA)
+        :param conflict_keys: 唯一鍵欄位(同bulk_upsert)
+        :param update_fields: 重複時更新的欄位，預設為conflict_keys以外的欄位
+        :param queue_size: 解析完成等待寫入的批次上限
+        :param on_progress: 每寫入一批呼叫on_progress(LoadStats)
+        :param report_every: 每隔幾秒以logging輸出每秒筆數
+        :param keep_rejected: 保留的拒絕資料筆數(rejected_count為總數)
+        """
+        stats = load_service(self, path, format, batch_size, on_duplicate, conflict_keys, update_fields, queue_size,
+                             on_progress, report_every, keep_rejected)
+        if stats.rows:
+            self._counts_changed()
+        return stats
+
+    def _load_rows(self, rows: list, on_duplicate: str, conflict_keys, update_fields) -> int:
+        """load_file單批寫入，更新模式且有快取時以唯一鍵回讀後同步快取"""
+        try:
+            affected = write_rows(self, rows, on_duplicate, conflict_keys, update_fields)
+            if on_duplicate == 'update' and self._cache is not None:
+                with db.use_primary(), db.session_scope() as session:
+                    models = session.scalars(self._select_by_keys(conflict_keys, rows))
+                    objects = self._order_by_keys(models, conflict_keys, rows)
+                self._after_write(*objects)
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('資料庫檔案匯入時發生錯誤。', payload={'error': e})
+        return affected
+
+    def _id_bounds(self, kws: dict) -> tuple:
+        """(最小id, 最大id)，沒有資料時為(None, None)"""
+        with db.session_scope() as session:
+            return tuple(session.execute(self._bounds_query(kws)).one())
+
+    def _export_rows(self, low: int, high: int, kws: dict) -> list[dict]:
+        """區間資料序列化為dict(匯出worker使用)"""
+        converter = self.__model__.get_converter()
+        with db.session_scope() as session:
+            instances = converter.from_rows(session.execute(self._range_query(low, high, kws)))
+        return converter.serializer.dump_many(instances)
+
+    def _first(self, **kws) -> Optional[ORMObject]:
+        with db.session_scope() as session:
+            model = session.scalars(self._first_query(kws)).first()
+            return model.get_instance() if model else None
+
     def all(self) -> list[ORMObject]:
         """所有model"""
-        session = db.session
-        session.commit()
-        result: list[ORMObject] = [model.get_instance() for model in session.query(self.__model__)]
-        session.close()
-        return result
+        converter = self.__model__.get_converter()
+        with db.session_scope() as session:
+            return converter.from_rows(session.execute(db.query(*converter.columns).filter(*self._not_deleted())))
+
+    def iter_all(self, batch_size=1000, **kws) -> Iterator[ORMObject]:
+        """
+        串流查詢(取代all)
+        以id分頁，每頁以server-side cursor讀取Row並直接轉為ORMObject，記憶體用量與資料表大小無關
+        """
+        from_row = self.__model__.get_converter().from_row
+        last_id = None
+        with db.session_scope(isolated=True) as session:
+            while True:
+                fetched = 0
+                for row in session.execute(self._page_query(last_id, batch_size, kws)):
+                    fetched += 1
+                    instance = from_row(row)
+                    last_id = instance.id
+                    yield instance
+                if fetched < batch_size:
+                    break
 
     def get(self, id_) -> Optional[ORMObject]:
         """id精準查詢"""
-        session = db.session
-        model = session.query(self.__model__).get(id_)
-        if not model:
-            return None
-        instance = model.get_instance()
-        session.close()
-        return instance
+        if (cache := self._read_cache) is not None:
+            return cache.fetch({'id': id_}, lambda: self._get(id_))
+        return self._get(id_)
+
+    def _get(self, id_) -> Optional[ORMObject]:
+        with db.session_scope() as session:
+            model = session.get(self.__model__, id_)
+            return model.get_instance() if model and not self._deleted(model) else None
+
+    def get_many(self, ids: Iterable[int], chunk_size=500, as_dict=False) -> Union[list[ORMObject], dict]:
+        """
+        id批次查詢，以 WHERE id IN (...) 分批查詢取代逐筆get
+        有設定快取時只查詢未命中的id
+        :param ids: id
+        :param chunk_size: 每次IN查詢的id數
+        :param as_dict: True回傳{id: ORMObject}，否則依輸入順序回傳list
+        """
+        ids = list(ids)
+        unique_ids = list(dict.fromkeys(ids))
+        if (cache := self._read_cache) is not None and cache.caches_id:
+            found = cache.fetch_many(unique_ids, lambda missing: self._get_many(missing, chunk_size))
+        else:
+            found = self._get_many(unique_ids, chunk_size)
+        return self._pick(found, ids, as_dict)
+
+    def _get_many(self, ids: list, chunk_size: int) -> dict:
+        from_row = self.__model__.get_converter().from_row
+        found = {}
+        with db.session_scope() as session:
+            for chunk in chunked(ids, chunk_size):
+                for row in session.execute(self._rows_by_ids(chunk).filter(*self._not_deleted())):
+                    instance = from_row(row)
+                    found[instance.id] = instance
+        return found
 
     def exists(self, **kws) -> bool:
-        return db.session.query(self.__model__).filter_by(**kws).count() > 0
+        """SELECT EXISTS(... LIMIT 1)，找到第一筆即停止"""
+        with db.session_scope() as session:
+            return bool(session.execute(self._exists_stmt(kws)).scalar())
+
+    def count(self, approximate=False, **kws) -> int:
+        """
+        筆數
+        :param approximate: 無條件時讀取資料表統計的估計值(mysql)，其他情況為精確計算
+        """
+        if approximate and not kws and (estimate := self._approximate_count()) is not None:
+            return estimate
+        if (cache := self._read_cache) is not None:
+            return cache.fetch_count(kws, lambda: self._count(kws))
+        return self._count(kws)
+
+    def _approximate_count(self) -> Optional[int]:
+        """資料表統計的估計筆數，不支援時為None"""
+        with db.session_scope() as session:
+            if (stmt := approximate_count_stmt(dialect_of(session), self.__model__)) is not None:
+                return session.execute(stmt).scalar()
+        return None
+
+    def _count(self, kws: dict) -> int:
+        with db.session_scope() as session:
+            return session.execute(self._count_stmt(kws)).scalar()
+
+    @staticmethod
+    def _insert_savepoint(session, stmt):
+        """SAVEPOINT內INSERT，重複鍵時只回滾SAVEPOINT並回傳None"""
+        try:
+            with session.begin_nested():
+                return session.execute(stmt)
+        except IntegrityError as e:
+            if not is_duplicate_key(e):
+                raise
+            return None
 
-    def count(self, **kws) -> int:
-        return db.session.query(self.__model__).filter_by(**kws).count()
+    def _insert_missing(self, session, dialect: str, rows: list, keys: Sequence[str]) -> set:
+        """
+        get_or_create_many新增查詢時不存在的資料(重複鍵略過)，回傳本次新增的自然鍵
+        新增筆數不符(查詢後有其他寫入者新增)時回滾SAVEPOINT改為逐筆新增，以各筆rowcount判斷
+        """
+        with session.begin_nested() as savepoint:
+            if session.execute(insert_ignore_many(dialect, self.__model__, rows)).rowcount == len(rows):
+                return {tuple(row[k] for k in keys) for row in rows}
+            savepoint.rollback()
+        return {
+            tuple(row[k] for k in keys) for row in rows
+            if session.execute(insert_ignore_many(dialect, self.__model__, [row])).rowcount
+        }
 
     def get_or_create(self, defaults=None, **kws) -> tuple[ORMObject, bool]:
-        """取得或創建"""
-        instance = self.first(**kws)
-        if not instance:
-            return self.create(**dict(defaults or (), **kws)), True
-        return instance, False
+        """
+        取得或創建
+        已存在時一次查詢返回；不存在時以單一INSERT新增(重複鍵不報錯)，新增時以id讀回，否則以條件讀回
+        defaults與其他既有資料的唯一鍵衝突時拋出DBOptionError
+        """
+        if instance := self.first(**kws):
+            return instance, False
+        values = self._preprocess_params(dict(defaults or (), **kws))
+        try:
+            with db.session_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                stmt = get_or_create_stmt(dialect, self.__model__, values)
+                result = self._insert_savepoint(session, stmt) if dialect == 'mysql' else session.execute(stmt)
+                created, query = self._created_lookup(result, kws)
+                instance = self.__model__.from_row(self._created_row(session.execute(query).first(), kws, values))
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('資料庫取得或創建時發生錯誤。', payload={'error': e})
+        if created:
+            self._after_write(instance)
+        return instance, created
+
+    def upsert(self, values: dict, conflict_keys: Sequence[str], update_fields=None) -> ORMObject:
+        """
+        單列新增或更新(單一語句)
+        :param values: 資料
+        :param conflict_keys: 唯一鍵欄位
+        :param update_fields: 重複時更新的欄位，預設為conflict_keys以外的欄位
+        """
+        values = self._preprocess_params(values)
+        try:
+            with db.session_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                result = session.execute(upsert_stmt(dialect, self.__model__, values, conflict_keys, update_fields))
+                id_ = upserted_id(dialect, result)
+                instance = self.__model__.from_row(session.execute(self._rows_by_ids([id_])).one())
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('資料庫新增或更新時發生錯誤。', payload={'error': e})
+        self._after_write(instance)
+        return instance
+
+    def get_or_create_many(self, rows: Iterable[dict], key_fields: Sequence[str],
+                           batch_size=500) -> list[tuple[ORMObject, bool]]:
+        """
+        批次取得或創建，每批固定三次往返：查詢既有、多列原子INSERT不存在者、讀回新增者
+        :param rows: 資料列(需包含key_fields，其餘欄位為新增時的值)
+        :param key_fields: 自然鍵欄位(需有唯一索引)
+        :return: 依輸入順序的[(ORMObject, 是否新增)]，是否新增只在本次語句寫入該列時為True
+        """
+        rows = [self._preprocess_params(row) for row in rows]
+        unique = list({tuple(row[k] for k in key_fields): row for row in rows}.values())
+        found: dict = {}
+        try:
+            with db.session_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                for chunk in chunked(unique, batch_size):
+                    existing = self._keyed(session.execute(self._rows_by_keys(key_fields, chunk)), key_fields)
+                    found.update((key, (instance, False)) for key, instance in existing.items())
+                    if missing := [row for row in chunk if tuple(row[k] for k in key_fields) not in existing]:
+                        inserted = self._insert_missing(session, dialect, missing, key_fields)
+                        rows_ = self._keyed(session.execute(self._rows_by_keys(key_fields, missing)), key_fields)
+                        found.update((key, (instance, key in inserted)) for key, instance in rows_.items())
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('資料庫批次取得或創建時發生錯誤。', payload={'error': e})
+        self._after_write(*(instance for instance, created in found.values() if created))
+        return [found[key] for row in rows if (key := tuple(row[k] for k in key_fields)) in found]
 
 
-class AsyncService:
+class AsyncService(_BaseService):
     """for爬蟲"""
 
-    __model__ = None
+    __dedup__: Optional[DedupPolicy] = None  # 寫入前去重設定，create_unseen/filter_unseen使用
 
-    def _isinstance(self, model, raise_error=True):
-        """檢查model是否伺服器配置的相同"""
-        rv = isinstance(model, (ORMObject, self.__model__))
-        if not rv and raise_error:
-            raise ValueError('%s is not of type %s' % (model, self.__model__))
-        return rv
+    @property
+    def _dedup(self) -> Deduplicator:
+        """依__dedup__建立(並快取於Service類別)的去重過濾"""
+        cls = type(self)
+        if cls.__dedup__ is None:
+            raise DBOptionError('未設定去重__dedup__。')
+        dedup = cls.__dict__.get('_service_dedup')
+        if dedup is None:
+            dedup = cls._service_dedup = Deduplicator(cls.__dedup__, cls.__model__, redis)
+        return dedup
 
     @staticmethod
-    def _preprocess_params(kws):
-        return kws
+    def _uncommitted() -> bool:
+        return db.in_unit_of_work
+
+    async def _after_write(self, *instances, old=None):
+        """寫入後同步快取；工作單元尚未提交時只清除不回填"""
+        if (cache := self._cache) is None or not instances:
+            return
+        for instance in instances:
+            if self._uncommitted():
+                await cache.ainvalidate(instance)
+                if old is not None:
+                    await cache.ainvalidate(old)
+            else:
+                await cache.arefresh(instance, old=old)
+        await cache.ainvalidate_counts()
+
+    async def _counts_changed(self):
+        """無個別資料可回填的寫入後清除count快取"""
+        if (cache := self._cache) is not None:
+            await cache.ainvalidate_counts()
 
-    async def save(self, model) -> None:
+    def buffered_writer(self, max_rows=500, max_latency_ms=200, max_pending: Optional[int] = None,
+                        on_flush=None, on_error=None) -> BufferedWriter:
+        """
+        緩衝寫入(大量新增時取代逐筆create)
+        async with service.buffered_writer(max_rows=500, max_latency_ms=200) as writer:
+            await writer.add(**row)
+        參數見BufferedWriter
+        """
+        return BufferedWriter(self, max_rows, max_latency_ms, max_pending, on_flush, on_error)
+
+    async def save(self, model) -> ORMObject:
         """儲存資料"""
         self._isinstance(model)
-        session = await db.async_session()
-        async with session.begin():
-            try:
+        try:
+            async with db.async_scope(commit=True) as session:
                 session.add(model)
                 await session.flush()
-                await session.commit()
-            except Exception as e:
-                await session.rollback()
-                raise DBOptionError('異步插入資料時發生錯誤。', payload={'error': e})
+                if self._unloaded_columns(model):
+                    # server_default等由資料庫產生的欄位，以主鍵刷新一次
+                    await session.refresh(model)
+                instance: ORMObject = model.get_instance()
+        except Exception as e:
+            raise DBOptionError('異步插入資料時發生錯誤。', payload={'error': e})
+        await self._after_write(instance)
+        return instance
 
     async def create(self, **kws) -> Optional[ORMObject]:
         """異步新增"""
-        payload = self._preprocess_params(kws)
-        model = self.__model__(**payload)
-        await self.save(model)
-        instance: ORMObject = await self.first(**payload)
+        model = self.__model__(**self._preprocess_params(kws))
+        instance: ORMObject = await self.save(model)
         return instance
 
+    async def bulk_create(self, rows: Iterable[dict], batch_size=500, returning=None,
+                          key_fields: Optional[Sequence[str]] = None) -> Union[int, list]:
+        """異步批次新增(多列INSERT)，參數同Service.bulk_create"""
+        self._check_returning(returning)
+        total, ids, objects = 0, [], []
+        try:
+            async with db.async_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                by_keys = returning is not None and dialect == 'mysql' and bool(key_fields)
+                settings = None
+                if returning is not None and not by_keys and (stmt := autoinc_settings_stmt(dialect)) is not None:
+                    settings = (await session.execute(stmt)).one()
+                for chunk in chunked(map(self._preprocess_params, rows), batch_size):
+                    chunk = self._stamp(chunk)
+                    if settings is not None:
+                        check_inferred_ids(settings, chunk)
+                    stmt = insert_many(dialect, self.__model__, chunk, returning_ids=returning is not None)
+                    result = await session.execute(stmt)
+                    total += len(chunk)
+                    if by_keys:
+                        models = await session.scalars(self._select_by_keys(key_fields, chunk))
+                        ids.extend(self._ids_by_keys(models, key_fields, chunk))
+                    elif returning is not None:
+                        ids.extend(inserted_ids(dialect, result, len(chunk)))
+                if returning == 'objects':
+                    for chunk in chunked(ids, batch_size):
+                        models = await session.scalars(self._select_by_ids(chunk))
+                        objects.extend(self._order_by_ids(models, chunk))
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('異步批次新增時發生錯誤。', payload={'error': e})
+        await self._counts_changed()
+        if returning == 'objects':
+            return objects
+        return ids if returning == 'ids' else total
+
+    async def bulk_upsert(self, rows: Iterable[dict], conflict_keys: Sequence[str], update_fields=None,
+                          batch_size=500, returning=None) -> Union[int, list]:
+        """異步批次新增或更新，參數同Service.bulk_upsert"""
+        self._check_returning(returning)
+        cache = self._cache
+        total, objects = 0, []
+        try:
+            async with db.async_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                for chunk in chunked(map(self._preprocess_params, rows), batch_size):
+                    await session.execute(upsert_many(dialect, self.__model__, chunk, conflict_keys, update_fields))
+                    total += len(chunk)
+                    if returning is not None or cache is not None:
+                        models = await session.scalars(self._select_by_keys(conflict_keys, chunk))
+                        objects.extend(self._order_by_keys(models, conflict_keys, chunk))
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('異步批次更新時發生錯誤。', payload={'error': e})
+        await self._after_write(*objects)
+        if returning == 'ids':
+            return [instance.id for instance in objects]
+        return objects if returning == 'objects' else total
+
+    @staticmethod
+    async def _insert_savepoint(session, stmt):
+        """異步_insert_savepoint"""
+        try:
+            async with session.begin_nested():
+                return await session.execute(stmt)
+        except IntegrityError as e:
+            if not is_duplicate_key(e):
+                raise
+            return None
+
+    async def _insert_missing(self, session, dialect: str, rows: list, keys: Sequence[str]) -> set:
+        """異步_insert_missing"""
+        async with session.begin_nested() as savepoint:
+            if (await session.execute(insert_ignore_many(dialect, self.__model__, rows))).rowcount == len(rows):
+                return {tuple(row[k] for k in keys) for row in rows}
+            await savepoint.rollback()
+        inserted = set()
+        for row in rows:
+            if (await session.execute(insert_ignore_many(dialect, self.__model__, [row]))).rowcount:
+                inserted.add(tuple(row[k] for k in keys))
+        return inserted
+
     async def get_or_create(self, default=None, **kws) -> tuple[ORMObject, bool]:
-        """異步取得或創建"""
-        instance = await self.first(**kws)
-        if not instance:
-            return await self.create(**dict(default or kws)), True
-        return instance, False
-
-    async def delete(self, model: ORMObject) -> None:
-        """異步刪除"""
-        self._isinstance(model)
-        session = await db.async_session()
-        async with session.begin():
-            await session.execute(db.delete(self.__model__).filter(self.__model__.id == model.id))
+        """異步取得或創建，流程同Service.get_or_create"""
+        if instance := await self.first(**kws):
+            return instance, False
+        values = self._preprocess_params(dict(default or (), **kws))
+        try:
+            async with db.async_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                stmt = get_or_create_stmt(dialect, self.__model__, values)
+                if dialect == 'mysql':
+                    result = await self._insert_savepoint(session, stmt)
+                else:
+                    result = await session.execute(stmt)
+                created, query = self._created_lookup(result, kws)
+                row = (await session.execute(query)).first()
+                instance = self.__model__.from_row(self._created_row(row, kws, values))
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('異步取得或創建時發生錯誤。', payload={'error': e})
+        if created:
+            await self._after_write(instance)
+        return instance, created
+
+    async def upsert(self, values: dict, conflict_keys: Sequence[str], update_fields=None) -> ORMObject:
+        """異步單列新增或更新，參數同Service.upsert"""
+        values = self._preprocess_params(values)
+        try:
+            async with db.async_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                result = await session.execute(
+                    upsert_stmt(dialect, self.__model__, values, conflict_keys, update_fields)
+                )
+                id_ = upserted_id(dialect, result)
+                instance = self.__model__.from_row((await session.execute(self._rows_by_ids([id_]))).one())
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('異步新增或更新時發生錯誤。', payload={'error': e})
+        await self._after_write(instance)
+        return instance
+
+    async def get_or_create_many(self, rows: Iterable[dict], key_fields: Sequence[str],
+                                 batch_size=500) -> list[tuple[ORMObject, bool]]:
+        """異步批次取得或創建，參數同Service.get_or_create_many"""
+        rows = [self._preprocess_params(row) for row in rows]
+        unique = list({tuple(row[k] for k in key_fields): row for row in rows}.values())
+        found: dict = {}
+        try:
+            async with db.async_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                for chunk in chunked(unique, batch_size):
+                    result = await session.execute(self._rows_by_keys(key_fields, chunk))
+                    existing = self._keyed(result, key_fields)
+                    found.update((key, (instance, False)) for key, instance in existing.items())
+                    if missing := [row for row in chunk if tuple(row[k] for k in key_fields) not in existing]:
+                        inserted = await self._insert_missing(session, dialect, missing, key_fields)
+                        result = await session.execute(self._rows_by_keys(key_fields, missing))
+                        rows_ = self._keyed(result, key_fields)
+                        found.update((key, (instance, key in inserted)) for key, instance in rows_.items())
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('異步批次取得或創建時發生錯誤。', payload={'error': e})
+        await self._after_write(*(instance for instance, created in found.values() if created))
+        return [found[key] for row in rows if (key := tuple(row[k] for k in key_fields)) in found]
+
+    async def filter_unseen(self, rows: Iterable[dict]) -> list[dict]:
+        """
+        依__dedup__的自然鍵略過已看過的資料(批次pipeline查詢Redis，不查詢資料庫)
+        同一批內重複的資料只保留第一筆
+        """
+        dedup = self._dedup
+        unique: dict = {}
+        for row in rows:
+            unique.setdefault(dedup.key_of(row), row)
+        seen = await dedup.aseen_many(unique)
+        return [row for row, hit in zip(unique.values(), seen) if not hit]
+
+    async def create_unseen(self, rows: Iterable[dict], batch_size=500) -> list[tuple[ORMObject, bool]]:
+        """
+        只將未看過的資料送進資料庫(取代逐筆get_or_create)
+        以get_or_create_many寫入(已存在不報錯)，成功後標記為看過
+        :return: 未看過資料的[(ORMObject, 是否新增)]
+        """
+        if not (unseen := await self.filter_unseen(rows)):
+            return []
+        dedup = self._dedup
+        result = await self.get_or_create_many(unseen, dedup.policy.key_fields, batch_size)
+        await dedup.aadd_many(dedup.key_of(row) for row in unseen)
+        return result
+
+    async def warm_dedup(self, batch_size=1000) -> int:
+        """
+        以資料表既有資料建立去重紀錄(第一次啟用或清除後)
+        :return: 標記筆數
+        """
+        dedup = self._dedup
+        total, keys = 0, []
+        async for instance in self.astream(batch_size=batch_size):
+            keys.append(dedup.key_of(instance))
+            if len(keys) >= batch_size:
+                await dedup.aadd_many(keys)
+                total, keys = total + len(keys), []
+        await dedup.aadd_many(keys)
+        return total + len(keys)
 
     async def update(self, model: ORMObject, **kws) -> ORMObject:
-        session = await db.async_session()
-        async with session.begin():
-            if not (updated := self._preprocess_params(kws)):
-                updated = {k: v for k, v in vars(model).items() if k in model.columns}
-            try:
-                query = await session.execute(db.query(self.__model__).filter(self.__model__.id == model.id))
-                target = query.scalar()
-                for k, v in updated.items():
-                    if k in model.columns:
-                        setattr(target, k, v)
-                instance: ORMObject = target.get_instance()
-                return instance
-            except Exception as e:
-                session.rollback()
-                raise DBOptionError('資料庫更新時發生錯誤。', payload={'error': e})
+        """異步更新，參數同Service.update"""
+        self._isinstance(model)
+        values = self._update_values(model, kws)
+        try:
+            async with db.async_scope(commit=True) as session:
+                dialect = dialect_of(session)
+                result = await session.execute(self._update_row_stmt(dialect, model.id, values))
+                if dialect == 'mysql':
+                    result = await session.execute(self._rows_by_ids([model.id])) if result.rowcount else None
+                if result is None or (row := result.first()) is None:
+                    raise DBOptionError('更新的資料不存在。', payload={'id': model.id})
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('資料庫更新時發生錯誤。', payload={'error': e})
+        instance = self.__model__.get_converter().from_row(row)
+        await self._after_write(instance, old=model)
+        return instance
+
+    async def update_where(self, filters: dict, values: dict) -> int:
+        """異步條件更新，參數同Service.update_where"""
+        values = self._column_values(self._preprocess_params(values))
+        values.update(self._onupdate_values(values))
+        return await self._execute_write(self._update_stmt(filters, values), filters)
+
+    async def update_many(self, items: Iterable[tuple], batch_size=500) -> int:
+        """異步CASE批次更新，參數同Service.update_many"""
+        items = list(items)
+        stmts = self._case_update_stmts(items, batch_size)
+        return await self._execute_write(stmts, ids=[id_ for id_, _ in items])
+
+    async def delete(self, model_or_id: Union[ORMObject, int], mark_deleted=False) -> int:
+        """異步刪除，參數同Service.delete"""
+        if model_or_id is None:
+            return 0
+        id_ = model_or_id.id if self._isinstance(model_or_id, raise_error=False) else model_or_id
+        return await self.delete_where({'id': id_}, mark_deleted=mark_deleted)
+
+    async def delete_where(self, filters: dict, mark_deleted=False) -> int:
+        """異步條件刪除，參數同Service.delete_where"""
+        return await self._execute_write(self._delete_stmt(filters, mark_deleted), filters)
+
+    async def _execute_write(self, stmts, filters: Optional[dict] = None, ids: Optional[list] = None) -> int:
+        stmts = [stmts] if not isinstance(stmts, Iterator) else stmts
+        cache = self._cache
+        affected = []
+        try:
+            async with db.async_scope(commit=True) as session:
+                if cache is not None:
+                    affected = (await session.execute(self._key_rows(filters, ids))).all()
+                rowcount = 0
+                for stmt in stmts:
+                    rowcount += (await session.execute(stmt)).rowcount
+        except DBOptionError:
+            raise
+        except Exception as e:
+            raise DBOptionError('資料庫批次寫入時發生錯誤。', payload={'error': e})
+        for row in affected:
+            await cache.ainvalidate(row)
+        if rowcount:
+            await self._counts_changed()
+        return rowcount
 
     async def get(self, id_: int) -> Optional[ORMObject]:
         """get"""
-        session = await db.async_session()
-        async with session.begin():
+        if (cache := self._read_cache) is not None:
+            return await cache.afetch({'id': id_}, lambda: self._get(id_))
+        return await self._get(id_)
+
+    async def _get(self, id_: int) -> Optional[ORMObject]:
+        async with db.async_scope() as session:
             model = await session.get(self.__model__, id_)
-            if not model:
-                return None
-            return model.get_instance()
-
-    async def first(self, **kws) -> Optional[ORMObject]:
-        """first"""
-        session = await db.async_session()
-        async with session.begin():
-            query = await session.execute(db.query(self.__model__).filter_by(**kws))
+            return model.get_instance() if model and not self._deleted(model) else None
+
+    async def first(self, fields: Optional[Sequence[str]] = None, **kws) -> Optional[ORMObject]:
+        """first，fields參數同Service.first"""
+        if fields is not None:
+            return await self._first_fields(fields, kws)
+        if (cache := self._read_cache) is not None:
+            return await cache.afetch(kws, lambda: self._first(**kws))
+        return await self._first(**kws)
+
+    async def _first_fields(self, fields: Sequence[str], kws: dict):
+        query, with_modifiers = self._projection(fields, kws)
+        async with db.async_scope() as session:
+            rows = self._project(await session.execute(query.limit(1)), fields, with_modifiers)
+        return rows[0] if rows else None
+
+    async def values_list(self, *fields: str, flat=False, **kws) -> list:
+        """異步欄位投影查詢，參數同Service.values_list"""
+        query, with_modifiers = self._projection(fields, kws)
+        async with db.async_scope() as session:
+            rows = self._project(await session.execute(query), fields, with_modifiers)
+        return self._flatten(rows, flat and len(fields) == 1)
+
+    async def scalar_column(self, field: str, **kws) -> list:
+        """異步單一欄位值list"""
+        return await self.values_list(field, flat=True, **kws)
+
+    async def _run_query(self, stmt, params: dict, handle):
+        """異步執行Query組成的語句"""
+        async with db.async_scope() as session:
+            return handle(await session.execute(stmt, params))
+
+    @staticmethod
+    async def gather(*aws, **options) -> list:
+        """
+        並行執行多個查詢，同時執行數受連線池上限限制(db.gather)
+        counts = await service.gather(*(service.count(day=d) for d in days))
+        """
+        return await db.gather(*aws, **options)
+
+    @staticmethod
+    async def _scatter(calls: list, merge):
+        """異步_scatter，各分片以db.gather並行"""
+        async def run(shard, call):
+            with db.using_shard(shard):
+                return await call()
+        if len(calls) == 1:
+            return merge([await run(*calls[0])])
+        return merge(await db.gather(*(run(shard, call) for shard, call in calls)))
+
+    async def _first(self, **kws) -> Optional[ORMObject]:
+        async with db.async_scope() as session:
+            query = await session.execute(self._first_query(kws))
             model = query.scalar()
-            if not model:
-                return None
-            instance = model.get_instance()
-        return instance
+            return model.get_instance() if model else None
 
     async def all(self) -> list[ORMObject]:
         """all"""
-        session = await db.async_session()
-        async with session.begin():
-            query = await session.execute(db.query(self.__model__))
-            models = query.scalars()
-            return [model.get_instance() for model in models]
+        converter = self.__model__.get_converter()
+        async with db.async_scope() as session:
+            query = await session.execute(db.query(*converter.columns).filter(*self._not_deleted()))
+            return converter.from_rows(query)
+
+    async def astream(self, batch_size=1000, **kws) -> AsyncIterator[ORMObject]:
+        """異步串流查詢(取代all)，參數同Service.iter_all"""
+        from_row = self.__model__.get_converter().from_row
+        last_id = None
+        async with db.async_scope() as session:
+            while True:
+                fetched = 0
+                result = await session.stream(self._page_query(last_id, batch_size, kws))
+                async for row in result:
+                    fetched += 1
+                    instance = from_row(row)
+                    last_id = instance.id
+                    yield instance
+                if fetched < batch_size:
+                    break
+
+    async def get_many(self, ids: Iterable[int], chunk_size=500, as_dict=False) -> Union[list[ORMObject], dict]:
+        """異步id批次查詢，參數同Service.get_many"""
+        ids = list(ids)
+        unique_ids = list(dict.fromkeys(ids))
+        if (cache := self._read_cache) is not None and cache.caches_id:
+            found = await cache.afetch_many(unique_ids, lambda missing: self._get_many(missing, chunk_size))
+        else:
+            found = await self._get_many(unique_ids, chunk_size)
+        return self._pick(found, ids, as_dict)
+
+    async def _get_many(self, ids: list, chunk_size: int) -> dict:
+        from_row = self.__model__.get_converter().from_row
+        found = {}
+        async with db.async_scope() as session:
+            for chunk in chunked(ids, chunk_size):
+                for row in await session.execute(self._rows_by_ids(chunk).filter(*self._not_deleted())):
+                    instance = from_row(row)
+                    found[instance.id] = instance
+        return found
 
     async def exists(self, **kws) -> bool:
-        return await self.count(**kws) > 0
+        """異步exists，同Service.exists"""
+        async with db.async_scope() as session:
+            return bool((await session.execute(self._exists_stmt(kws))).scalar())
+
+    async def count(self, approximate=False, **kws) -> int:
+        """異步筆數，參數同Service.count"""
+        if approximate and not kws and (estimate := await self._approximate_count()) is not None:
+            return estimate
+        if (cache := self._read_cache) is not None:
+            return await cache.afetch_count(kws, lambda: self._count(kws))
+        return await self._count(kws)
+
+    async def _approximate_count(self) -> Optional[int]:
+        async with db.async_scope() as session:
+            if (stmt := approximate_count_stmt(dialect_of(session), self.__model__)) is not None:
+                return (await session.execute(stmt)).scalar()
+        return None
 
-    async def count(self, **kws) -> int:
-        session = await db.async_session()
-        async with session.begin():
-            query = await session.execute(db.func.count(db.query(self.__model__.id).filter_by(**kws)))
-            return query.scalar()
+    async def _count(self, kws: dict) -> int:
+        async with db.async_scope() as session:
+            return (await session.execute(self._count_stmt(kws))).scalar()
@@ -0,0 +1,321 @@
+"""
+分片路由
+model設定__shard_key__時，Service/AsyncService存取資料庫的方法依分片鍵路由至單一分片；
+條件中沒有分片鍵時並行送往所有分片(scatter-gather)再合併結果
+    class Report(Mixin, db.Model):
+        __shard_key__ = 'account_id'
+        __shard_map__ = HashShardMap(['s0', 's1'])  # 可省略，預設為db.shard_map
+各分片的id各自遞增，需要以id跨分片查詢(get/get_many/delete(id))時請使用全域唯一的id
+分片內的寫入各自提交，不加入db.transaction()/db.unit_of_work()
+"""
+import functools
+import heapq
+import inspect
+import itertools
+from collections import namedtuple
+from operator import attrgetter
+from typing import AsyncIterator, Callable, Iterator, Optional, Sequence
+from .database import db
+from exceptions import DBOptionError
+
+
+# ---------- 合併 ----------
+def merge_sum(results: list) -> int:
+    return sum(results)
+
+
+def merge_optional_sum(results: list) -> Optional[int]:
+    """任一分片為None(無法估計)時回傳None"""
+    return None if any(result is None for result in results) else sum(results)
+
+
+def merge_any(results: list) -> bool:
+    return any(results)
+
+
+def merge_first(results: list):
+    return next((result for result in results if result is not None), None)
+
+
+def merge_concat(results: list) -> list:
+    return [item for result in results for item in result]
+
+
+def merge_bounds(results: list) -> tuple:
+    """各分片(最小, 最大)合併"""
+    lows = [low for low, _ in results if low is not None]
+    highs = [high for _, high in results if high is not None]
+    return (min(lows), max(highs)) if lows else (None, None)
+
+
+def merge_dict(results: list) -> dict:
+    merged = {}
+    for result in results:
+        merged.update(result)
+    return merged
+
+
+class _Descending:
+    """降冪排序鍵"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def sort_key(order: Sequence[str]) -> Callable:
+    """依order_by欄位('-'為降冪)建立排序鍵，NULL視為最小值(同MySQL/SQLite)"""
+    fields = [(field.lstrip('-'), field.startswith('-')) for field in order]
+
+    def key(item):
+        parts = []
+        for field, descending in fields:
+            value = getattr(item, field)
+            part = (value is not None, value)
+            parts.append(_Descending(part) if descending else part)
+        return tuple(parts)
+    return key
+
+
+def ordered_merge(results: list, order: Sequence[str], offset: Optional[int] = None,
+                  limit: Optional[int] = None) -> list:
+    """各分片已依order排序的結果以heapq.merge合併，再套用offset/limit"""
+    merged = heapq.merge(*results, key=sort_key(order)) if order else itertools.chain.from_iterable(results)
+    start = offset or 0
+    return list(itertools.islice(merged, start, None if limit is None else start + limit))
+
+
+async def amerge(iterators: list, key: Callable) -> AsyncIterator:
+    """heapq.merge的異步版本(各iterator已依key排序)"""
+    heap = []
+
+    async def push(index, iterator):
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        heapq.heappush(heap, (key(item), index, item, iterator))
+
+    for index, iterator in enumerate(iterators):
+        await push(index, iterator)
+    while heap:
+        _, index, item, iterator = heapq.heappop(heap)
+        yield item
+        await push(index, iterator)
+
+
+def _shard_iter(shard: str, iterator: Iterator) -> Iterator:
+    """每次取值時才切換分片(generator之間交錯執行時不影響呼叫端的context)"""
+    while True:
+        with db.using_shard(shard):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+async def _ashard_iter(shard: str, iterator: AsyncIterator) -> AsyncIterator:
+    while True:
+        with db.using_shard(shard):
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item
+
+
+# ---------- 定位 ----------
+def shard_key(model) -> Optional[str]:
+    return getattr(model, '__shard_key__', None)
+
+
+def _missing_key(model):
+    return DBOptionError(f'分片模型缺少分片鍵{shard_key(model)}。', payload={'model': model.__name__})
+
+
+def _by_mapping(param: str):
+    """條件/資料dict中有分片鍵時為單一分片"""
+    def locate(service, arguments: dict) -> Optional[list]:
+        model = service.__model__
+        values = arguments.get(param) or {}
+        if (key := shard_key(model)) not in values:
+            return None
+        return [db.shard_for(model, values[key])]
+    return locate
+
+
+def _by_model(param: str):
+    """ORMObject的分片鍵；傳入id時為所有分片"""
+    def locate(service, arguments: dict) -> Optional[list]:
+        model, target = service.__model__, arguments[param]
+        if not service._isinstance(target, raise_error=False):
+            return None
+        if (value := getattr(target, shard_key(model), None)) is None:
+            raise _missing_key(model)
+        return [db.shard_for(model, value)]
+    return locate
+
+
+def _unchanged(located: Optional[list], service, values: dict):
+    """更新值包含分片鍵且對應到其他分片時拒絕(不支援跨分片搬移資料)"""
+    model = service.__model__
+    if (key := shard_key(model)) in values and located != [db.shard_for(model, values[key])]:
+        raise DBOptionError('分片鍵不可更新至其他分片。', payload={key: values[key]})
+
+
+def _locate_update(service, arguments: dict) -> Optional[list]:
+    located = _by_model('model')(service, arguments)
+    _unchanged(located, service, arguments.get('kws') or {})
+    return located
+
+
+def _locate_update_where(service, arguments: dict) -> Optional[list]:
+    located = _by_mapping('filters')(service, arguments)
+    _unchanged(located, service, arguments.get('values') or {})
+    return located
+
+
+def _all_shards(service, arguments: dict) -> None:
+    return None
+
+
+# locate: 回傳分片list，None為所有分片；required: 無法定位時拋錯；rows: 依各列分片鍵分組的參數
+Route = namedtuple('Route', 'locate merge required rows', defaults=(False, None))
+
+ROUTES = {
+    # 寫入
+    'save': Route(_by_model('model'), merge_first, required=True),
+    'update': Route(_locate_update, merge_first, required=True),
+    'get_or_create': Route(_by_mapping('kws'), merge_first, required=True),
+    'upsert': Route(_by_mapping('values'), merge_first, required=True),
+    'bulk_create': Route(None, None, rows='rows'),
+    'bulk_upsert': Route(None, None, rows='rows'),
+    'get_or_create_many': Route(None, None, rows='rows'),
+    '_load_rows': Route(None, None, rows='rows'),
+    'update_where': Route(_locate_update_where, merge_sum),
+    'update_many': Route(_all_shards, merge_sum),
+    'delete': Route(_by_model('model_or_id'), merge_sum),
+    'delete_where': Route(_by_mapping('filters'), merge_sum),
+    # 讀取(快取在路由之外，同一條件只查詢/回填一次)
+    '_first': Route(_by_mapping('kws'), merge_first),
+    '_first_fields': Route(_by_mapping('kws'), merge_first),
+    '_get': Route(_all_shards, merge_first),
+    '_get_many': Route(_all_shards, merge_dict),
+    '_count': Route(_by_mapping('kws'), merge_sum),
+    '_approximate_count': Route(_all_shards, merge_optional_sum),
+    'exists': Route(_by_mapping('kws'), merge_any),
+    'values_list': Route(_by_mapping('kws'), merge_concat),
+    'all': Route(_all_shards, merge_concat),
+    '_id_bounds': Route(_by_mapping('kws'), merge_bounds),
+    '_export_rows': Route(_by_mapping('kws'), merge_concat),
+    'iter_all': Route(_by_mapping('kws'), None),
+    'astream': Route(_by_mapping('kws'), None),
+}
+
+
+def _partition(service, rows: list) -> dict:
+    """{分片: [列索引]}"""
+    model = service.__model__
+    key = shard_key(model)
+    groups: dict = {}
+    for index, row in enumerate(rows):
+        if row.get(key) is None:
+            raise _missing_key(model)
+        groups.setdefault(db.shard_for(model, row[key]), []).append(index)
+    return groups
+
+
+def _merge_rows(groups: list, total: int) -> Callable:
+    """分組寫入的結果：筆數相加；每列一個結果時依輸入順序放回，否則依分片順序串接"""
+    def merge(results: list):
+        if all(isinstance(result, int) for result in results):
+            return sum(results)
+        if any(len(result) != len(indices) for result, indices in zip(results, groups)):
+            return merge_concat(results)
+        merged = [None] * total
+        for result, indices in zip(results, groups):
+            for index, item in zip(indices, result):
+                merged[index] = item
+        return merged
+    return merge
+
+
+def _plan(fn, signature: inspect.Signature, route: Route, service, args: tuple, kwargs: dict):
+    """[(分片, 呼叫)]與合併函式"""
+    bound = signature.bind(service, *args, **kwargs)
+    if route.rows is not None:
+        rows = list(bound.arguments[route.rows])
+        if not rows:
+            bound.arguments[route.rows] = rows
+            return [(next(iter(db.shards)), functools.partial(fn, *bound.args, **bound.kwargs))], merge_first
+        calls, groups = [], []
+        for shard, indices in _partition(service, rows).items():
+            bound.arguments[route.rows] = [rows[index] for index in indices]
+            calls.append((shard, functools.partial(fn, *bound.args, **bound.kwargs)))
+            groups.append(indices)
+        return calls, _merge_rows(groups, len(rows))
+    # 一次性的iterator(generator等)先轉為list，各分片共用同一份參數
+    for name, value in bound.arguments.items():
+        if isinstance(value, Iterator):
+            bound.arguments[name] = list(value)
+    shards = route.locate(service, bound.arguments)
+    if shards is None:
+        if route.required:
+            raise _missing_key(service.__model__)
+        shards = list(db.shards)
+    return [(shard, functools.partial(fn, *bound.args, **bound.kwargs)) for shard in shards], route.merge
+
+
+def _route_method(fn, route: Route):
+    """包裝單一方法：已在分片內(巢狀呼叫或db.using_shard)時直接執行"""
+    if getattr(fn, '__instrumented__', False):
+        fn = fn.__wrapped__  # 計時包裝留給instrument_class重新套在路由外層，避免各分片重複記錄
+    signature = inspect.signature(fn)
+
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            if db.current_shard is not None:
+                async for item in fn(self, *args, **kwargs):
+                    yield item
+                return
+            calls, _ = _plan(fn, signature, route, self, args, kwargs)
+            async for item in amerge([_ashard_iter(shard, call()) for shard, call in calls], attrgetter('id')):
+                yield item
+    elif inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            if db.current_shard is not None:
+                return fn(self, *args, **kwargs)
+            calls, _ = _plan(fn, signature, route, self, args, kwargs)
+            return heapq.merge(*(_shard_iter(shard, call()) for shard, call in calls), key=attrgetter('id'))
+    elif inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            if db.current_shard is not None:
+                return await fn(self, *args, **kwargs)
+            return await self._scatter(*_plan(fn, signature, route, self, args, kwargs))
+    else:
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            if db.current_shard is not None:
+                return fn(self, *args, **kwargs)
+            return self._scatter(*_plan(fn, signature, route, self, args, kwargs))
+    wrapper.__sharded__ = True
+    return wrapper
+
+
+def route_class(cls):
+    """分片模型的Service：存取資料庫的方法加上分片路由(已包裝的繼承方法略過)"""
+    for name, route in ROUTES.items():
+        fn = getattr(cls, name, None)
+        if fn is None or getattr(fn, '__sharded__', False):
+            continue
+        setattr(cls, name, _route_method(fn, route))
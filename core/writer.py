@@ -0,0 +1,182 @@
+"""
+AsyncService緩衝寫入
+async with service.buffered_writer(max_rows=500, max_latency_ms=200) as writer:
+    await writer.add(**row)
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Iterable, Optional
+from .database import db
+from .database.pool import percentile, _ms
+from .loader import _same_keys
+from exceptions import DBOptionError
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()  # 結束訊號
+
+
+class WriterStats:
+    """緩衝寫入統計"""
+
+    def __init__(self, samples=1000):
+        self.flushes = 0
+        self.rows = 0
+        self.failed_rows = 0
+        self.last_rows = 0
+        self.last_seconds: Optional[float] = None
+        self._durations: deque = deque(maxlen=samples)
+
+    def record(self, rows: int, seconds: float, failed=False):
+        self.flushes += 1
+        self.last_rows = rows
+        self.last_seconds = seconds
+        if failed:
+            self.failed_rows += rows
+        else:
+            self.rows += rows
+        self._durations.append(seconds)
+
+    def snapshot(self) -> dict:
+        durations = sorted(self._durations)
+        total = sum(durations)
+        return {
+            'flushes': self.flushes,
+            'rows': self.rows,
+            'failed_rows': self.failed_rows,
+            'rows_per_second': round(self.rows / total, 1) if total else None,
+            'last_flush': {'rows': self.last_rows, 'ms': _ms(self.last_seconds)},
+            'flush_ms': {
+                'p50': _ms(percentile(durations, 50)),
+                'p99': _ms(percentile(durations, 99)),
+                'max': _ms(durations[-1] if durations else None),
+            },
+        }
+
+
+class BufferedWriter:
+    """
+    寫回緩衝：add()只放入佇列，背景task累積到max_rows筆或等待max_latency_ms後以多列INSERT寫入
+    佇列滿時add()會等待(背壓)，離開context時保證寫入剩餘資料
+    寫入失敗時：有on_error則交由其處理並繼續，否則停止寫入，之後的add()與離開context時拋出錯誤
+    """
+
+    def __init__(self, service, max_rows=500, max_latency_ms=200, max_pending: Optional[int] = None,
+                 on_flush: Optional[Callable] = None, on_error: Optional[Callable] = None):
+        """
+        :param service: AsyncService
+        :param max_rows: 每次寫入的最大筆數
+        :param max_latency_ms: 資料在緩衝中等待的最長時間
+        :param max_pending: 佇列上限，預設為max_rows的4倍
+        :param on_flush: 每次寫入後呼叫 on_flush(筆數, 秒數)
+        :param on_error: 寫入失敗時呼叫 on_error(資料列, 錯誤)
+        """
+        if max_rows <= 0:
+            raise ValueError('max_rows必須大於0')
+        self.service = service
+        self.max_rows = max_rows
+        self.max_latency = max_latency_ms / 1000
+        self.on_flush = on_flush
+        self.on_error = on_error
+        self.stats = WriterStats()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending or max_rows * 4)
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[Exception] = None
+
+    @property
+    def pending(self) -> int:
+        """尚未寫入的筆數"""
+        return self._queue.qsize()
+
+    async def __aenter__(self) -> 'BufferedWriter':
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if not self._task.done():
+            await self._queue.put(_STOP)
+        await self._task
+        if self._error is not None:
+            raise self._error
+
+    def _check(self):
+        if self._task is None:
+            raise RuntimeError('BufferedWriter需在async with區塊內使用')
+        if self._error is not None:
+            raise self._error
+        if self._task.done():
+            raise RuntimeError('BufferedWriter已關閉')
+
+    async def add(self, **row):
+        """加入一筆資料，佇列滿時等待"""
+        self._check()
+        await self._queue.put(row)
+
+    async def add_many(self, rows: Iterable[dict]):
+        """加入多筆資料"""
+        for row in rows:
+            await self.add(**row)
+
+    async def _run(self):
+        db.detach_unit_of_work()
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            if row is _STOP:
+                break
+            batch = [row]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_rows:
+                try:
+                    row = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    if (remaining := deadline - loop.time()) <= 0:
+                        break
+                    try:
+                        row = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            if not await self._flush(batch):
+                self._drain()
+                return
+
+    async def _flush(self, batch: list) -> bool:
+        """寫入一批(多列INSERT需要欄位一致，依欄位組合分組)，回傳是否可繼續"""
+        for group in _same_keys(batch):
+            if not await self._write(group):
+                return False
+        return True
+
+    async def _write(self, batch: list) -> bool:
+        """以一個bulk_create寫入欄位一致的資料列"""
+        start = time.perf_counter()
+        try:
+            await self.service.bulk_create(batch, batch_size=self.max_rows)
+        except DBOptionError as e:
+            self.stats.record(len(batch), time.perf_counter() - start, failed=True)
+            logger.warning('緩衝寫入失敗 %s筆(欄位: %s): %s', len(batch), list(batch[0]), e)
+            if self.on_error is None:
+                self._error = e
+                return False
+            self.on_error(batch, e)
+            return True
+        seconds = time.perf_counter() - start
+        self.stats.record(len(batch), seconds)
+        if self.on_flush is not None:
+            self.on_flush(len(batch), seconds)
+        return True
+
+    def _drain(self):
+        """停止寫入後清空佇列，避免add()卡在背壓等待"""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
@@ -0,0 +1,39 @@
+"""
+測試環境：SQLite(暫存檔)取代MySQL，fakeredis取代Redis
+python -m pytest -q
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.database import db, redis  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    """每個測試使用新的SQLite資料庫"""
+    asyncio.run(db.close_engine())
+    path = tmp_path / 'test.db'
+    db.sync_url = f'sqlite:///{path}'
+    db.async_url = f'sqlite+aiosqlite:///{path}'
+    db.Model.metadata.create_all(db.engine)
+    yield db
+    asyncio.run(db.close_engine())
+    db.shards.clear()
+    db.shard_map = db._default_shard_map = None
+
+
+@pytest.fixture
+def fake_redis():
+    """同步與異步client共用同一個fakeredis server"""
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    redis._sync_redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+    redis._async_redis = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    yield server
+    redis._sync_redis = redis._async_redis = None
@@ -0,0 +1,14 @@
+from core.models import test as models
+from core.service import Service
+
+
+class ModelService(Service):
+    __model__ = models.Test
+
+
+def test_bulk_create_returning_ids_with_explicit_ids(database):
+    service = ModelService()
+    ids = service.bulk_create([{'id': 10, 'name': 'a'}, {'id': 5, 'name': 'b'}], returning='ids')
+    assert ids == [10, 5]
+    objects = service.bulk_create([{'name': 'c'}, {'name': 'd'}], returning='objects', key_fields=['name'])
+    assert [instance.name for instance in objects] == ['c', 'd']
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+
+import pytest
+
+from core.database import CachePolicy, db
+from core.models import test as models
+from core.service import AsyncService, Service
+
+
+class CachedService(Service):
+    __model__ = models.Test
+    __cache__ = CachePolicy(ttl=60, key_fields=['id', 'name'])
+
+
+class AsyncCachedService(AsyncService):
+    __model__ = models.Test
+    __cache__ = CachePolicy(ttl=60, key_fields=['id', 'name'])
+
+
+@pytest.fixture
+def service(database, fake_redis):
+    return CachedService()
+
+
+@pytest.fixture
+def async_service(database, fake_redis):
+    return AsyncCachedService()
+
+
+def test_transaction_reads_do_not_fill_cache(service):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            instance = service.create(name='ghost')
+            assert service.first(name='ghost') is not None
+            assert service.get(instance.id) is not None
+            raise RuntimeError
+    assert service.first(name='ghost') is None
+    assert service.get(instance.id) is None
+    assert service.count(name='ghost') == 0
+
+
+def test_unit_of_work_reads_do_not_fill_cache(async_service):
+    async def run():
+        with pytest.raises(RuntimeError):
+            async with db.unit_of_work():
+                instance = await async_service.create(name='ghost')
+                assert await async_service.first(name='ghost') is not None
+                assert await async_service.get(instance.id) is not None
+                raise RuntimeError
+        assert await async_service.first(name='ghost') is None
+        assert await async_service.get(instance.id) is None
+    asyncio.run(run())
+
+
+def test_afetch_waiters_survive_leader_cancellation(service):
+    instance = service.create(name='a')
+    cache = service._cache
+    service._cache.invalidate(instance)
+    release = asyncio.Event()
+    calls = []
+
+    async def slow_loader():
+        calls.append('leader')
+        await release.wait()
+        return instance
+
+    async def loader():
+        calls.append('waiter')
+        return instance
+
+    async def run():
+        leader = asyncio.create_task(cache.afetch({'name': 'a'}, slow_loader))
+        while not calls:
+            await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.afetch({'name': 'a'}, loader))
+        await asyncio.sleep(0.1)  # waiter讀取快取未命中後等待leader
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(run()).id == instance.id
+    assert calls == ['leader', 'waiter']
+
+
+def test_afetch_flights_are_per_event_loop(service):
+    instance = service.create(name='a')
+    cache = service._cache
+    cache.invalidate(instance)
+    started, release = threading.Event(), threading.Event()
+
+    async def blocked_loader():
+        started.set()
+        await asyncio.get_running_loop().run_in_executor(None, release.wait)
+        return instance
+
+    async def loader():
+        return instance
+
+    other = threading.Thread(target=lambda: asyncio.run(cache.afetch({'name': 'a'}, blocked_loader)))
+    other.start()
+    try:
+        assert started.wait(5)
+        # 另一個loop上的查詢進行中，本loop自行查詢而不等待其他loop的future
+        assert asyncio.run(asyncio.wait_for(cache.afetch({'name': 'a'}, loader), 5)).id == instance.id
+    finally:
+        release.set()
+        other.join()
+
+
+
+class AsyncCountedService(AsyncService):
+    __model__ = models.Test
+    __cache__ = CachePolicy(ttl=60, key_fields=['id', 'name'], count_ttl=60)
+
+
+def test_async_save_refreshes_cache(database, fake_redis):
+    service = AsyncCountedService()
+
+    async def run():
+        await service.create(name='a')
+        assert await service.count() == 1
+        instance = await service.save(models.Test(name='b'))
+        assert await service.count() == 2
+        with db.session_scope(commit=True) as session:
+            session.execute(db.delete(models.Test).filter_by(id=instance.id))
+        assert (await service.first(name='b')).id == instance.id  # save已回填快取
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from sqlalchemy import insert
+
+from core.database import CachePolicy, db
+from core.database.statements import approximate_count_stmt
+from core.models import test as models
+from core.service import AsyncService, Service
+
+
+class CountService(Service):
+    __model__ = models.Test
+    __cache__ = CachePolicy(ttl=60, key_fields=['id'], count_ttl=60)
+
+
+class PlainService(Service):
+    __model__ = models.Test
+
+
+class AsyncCountService(AsyncService):
+    __model__ = models.Test
+    __cache__ = CachePolicy(ttl=60, key_fields=['id'], count_ttl=60)
+
+
+@pytest.fixture
+def service(database, fake_redis):
+    service = CountService()
+    service.bulk_create([{'name': 'a', 'is_active': True}, {'name': 'b', 'is_active': False}])
+    return service
+
+
+def insert_behind_cache(name):
+    """略過Service直接寫入，快取的count不會被清除"""
+    with db.session_scope(commit=True) as session:
+        session.execute(insert(models.Test).values(name=name))
+
+
+def test_exists(service):
+    assert service.exists(name='a')
+    assert not service.exists(name='nope')
+    assert asyncio.run(AsyncCountService().exists(is_active=True))
+
+
+def test_approximate_count_falls_back_on_sqlite(service):
+    assert approximate_count_stmt('sqlite', models.Test) is None
+    assert approximate_count_stmt('mysql', models.Test).compile().params == {'table': 'test_table'}
+    assert service.count(approximate=True) == 2
+    assert service.count(approximate=True, is_active=True) == 1
+    assert asyncio.run(AsyncCountService().count(approximate=True)) == 2
+
+
+def test_count_is_cached(service):
+    assert service.count() == 2
+    assert service.count(is_active=True) == 1
+    insert_behind_cache('c')
+    assert service.count() == 2
+    assert service.count(is_active=True) == 1
+
+
+@pytest.mark.parametrize('write', [
+    lambda service: service.create(name='z'),
+    lambda service: service.bulk_create([{'name': 'z'}]),
+    lambda service: service.update_where({'name': 'b'}, {'is_active': True}),
+    lambda service: service.delete_where({'name': 'a'}),
+    lambda service: service.get_or_create(name='z'),
+])
+def test_writes_invalidate_cached_count(service, write):
+    service.count()
+    service.count(is_active=True)
+    insert_behind_cache('c')
+    write(service)
+    assert service.count() == PlainService().count()
+    assert service.count(is_active=True) == PlainService().count(is_active=True)
+
+
+def test_async_writes_invalidate_cached_count(service):
+    async_service = AsyncCountService()
+
+    async def run():
+        assert await async_service.count() == 2
+        insert_behind_cache('c')
+        assert await async_service.count() == 2
+        await async_service.delete_where({'name': 'a'})
+        assert await async_service.count() == 2
+    asyncio.run(run())
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+
+from core.database import DedupPolicy, redis
+from core.database.dedup import Deduplicator
+from core.models import test as models
+from core.service import AsyncService
+
+
+def deduplicator(**options) -> Deduplicator:
+    return Deduplicator(DedupPolicy('name', **options), models.Test, redis)
+
+
+@pytest.mark.parametrize('backend', ['bloom', 'set'])
+def test_seen_after_add(fake_redis, backend):
+    dedup = deduplicator(backend=backend, capacity=1000, local=False)
+    assert dedup.seen_many(['a', 'b']) == [False, False]
+    dedup.add_many(['a'])
+    assert dedup.seen_many(['a', 'b']) == [True, False]
+    dedup.clear()
+    assert dedup.seen_many(['a']) == [False]
+
+
+@pytest.mark.parametrize('backend', ['bloom', 'set'])
+def test_async_seen_after_add(fake_redis, backend):
+    dedup = deduplicator(backend=backend, capacity=1000, local=False)
+
+    async def run():
+        await dedup.aadd_many(['a'])
+        return await dedup.aseen_many(['a', 'b'])
+    assert asyncio.run(run()) == [True, False]
+
+
+def test_bloom_shared_through_redis(fake_redis):
+    """本機位元陣列未命中時查詢Redis(其他程序寫入的紀錄)"""
+    writer, reader = deduplicator(capacity=1000), deduplicator(capacity=1000)
+    writer.add_many(['a'])
+    assert reader.seen_many(['a', 'b']) == [True, False]
+
+
+def test_bloom_false_positive_rate(fake_redis):
+    dedup = deduplicator(capacity=2000, error_rate=0.01, local=False)
+    dedup.add_many(str(i) for i in range(2000))
+    assert all(dedup.seen_many(str(i) for i in range(2000)))
+    rate = sum(dedup.seen_many(f'x{i}' for i in range(5000))) / 5000
+    assert rate < 0.03
+
+
+@pytest.mark.parametrize('backend', ['bloom', 'set'])
+def test_ttl_expiry(fake_redis, backend):
+    dedup = deduplicator(backend=backend, capacity=1000, ttl=1)
+    assert dedup.local is None  # 會過期的紀錄不保留本機陣列
+    dedup.add_many(['a'])
+    assert 0 < redis.sync_.ttl(dedup.redis_key) <= 1
+    assert dedup.seen_many(['a']) == [True]
+    time.sleep(1.1)
+    assert dedup.seen_many(['a']) == [False]
+
+
+@pytest.mark.parametrize('backend', ['bloom', 'set'])
+def test_create_unseen_skips_duplicates(database, fake_redis, backend):
+    class Ingest(AsyncService):
+        __model__ = models.Test
+        __dedup__ = DedupPolicy('name', backend=backend, capacity=1000, prefix=f'dedup-{backend}')
+
+    service = Ingest()
+    rows = [{'name': f'n{i}'} for i in range(20)] + [{'name': 'n1'}]
+
+    async def run():
+        first = await service.create_unseen(rows)
+        again = await service.create_unseen(rows + [{'name': 'new'}])
+        return first, again, await service.count()
+    first, again, count = asyncio.run(run())
+    assert len(first) == 20 and all(created for _, created in first)
+    assert [(instance.name, created) for instance, created in again] == [('new', True)]
+    assert count == 21
+
+
+def test_warm_dedup_marks_existing_rows(database, fake_redis):
+    class Ingest(AsyncService):
+        __model__ = models.Test
+        __dedup__ = DedupPolicy('name', backend='set', prefix='dedup-warm')
+
+    service = Ingest()
+
+    async def run():
+        await service.bulk_create([{'name': f'n{i}'} for i in range(5)])
+        marked = await service.warm_dedup(batch_size=2)
+        return marked, await service.filter_unseen([{'name': 'n0'}, {'name': 'n9'}])
+    marked, unseen = asyncio.run(run())
+    assert marked == 5
+    assert unseen == [{'name': 'n9'}]
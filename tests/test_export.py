@@ -0,0 +1,115 @@
+import csv
+import json
+from datetime import datetime
+
+import pytest
+
+from core import export
+from core.models import test as models
+from core.service import Service
+
+UPDATED = datetime(2024, 1, 2, 3, 4, 5)
+FIELDS = ['id', 'name', 'is_active', 'is_online', 'updated_at', 'test_column']  # created_at隱藏
+
+
+class ExportService(Service):
+    __model__ = models.Test
+
+
+@pytest.fixture
+def service(database):
+    service = ExportService()
+    service.bulk_create([{'name': str(i), 'is_active': i % 2 == 0, 'updated_at': UPDATED} for i in range(25)])
+    for id_ in (3, 4, 17):
+        service.delete(id_)
+    return service
+
+
+def expected(ids=None):
+    ids = [i for i in range(1, 26) if i not in (3, 4, 17)] if ids is None else ids
+    return [{'id': i, 'updated_at': UPDATED.isoformat(), 'name': str(i - 1), 'is_active': (i - 1) % 2 == 0,
+             'is_online': False, 'test_column': f'{i - 1}測試後綴'} for i in ids]
+
+
+@pytest.mark.parametrize('chunk_size, workers', [(1, 4), (4, 2), (100, 1)])
+def test_jsonl(service, tmp_path, chunk_size, workers):
+    path = tmp_path / 'out.jsonl'
+    stats = service.export(str(path), format='jsonl', chunk_size=chunk_size, workers=workers)
+    assert [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()] == expected()
+    assert stats.rows == 22 and stats.chunks == stats.total_chunks
+    assert not (tmp_path / 'out.jsonl.tmp').exists()
+
+
+def test_csv(service, tmp_path):
+    path = tmp_path / 'out.csv'
+    service.export(str(path), format='csv', chunk_size=5, is_active=True)
+    with open(path, newline='', encoding='utf-8') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == FIELDS
+    assert rows[1:] == [
+        [str(row['id']), row['name'], 'True', 'False', str(UPDATED), row['test_column']]
+        for row in expected() if row['is_active']
+    ]
+
+
+def test_empty_export(database, tmp_path):
+    path = tmp_path / 'out.csv'
+    stats = ExportService().export(str(path))
+    assert path.read_text(encoding='utf-8').splitlines() == [','.join(FIELDS)]
+    assert stats.rows == 0
+
+
+def test_progress_and_validation(service, tmp_path):
+    progress = []
+    service.export(str(tmp_path / 'out.jsonl'), format='jsonl', chunk_size=10,
+                   on_progress=lambda stats: progress.append(stats.rows))
+    assert progress == [8, 17, 22]  # 1~10、11~20、21~25(3、4、17已刪除)
+    with pytest.raises(ValueError):
+        service.export(str(tmp_path / 'out.xml'), format='xml')
+    with pytest.raises(ValueError):
+        service.export(str(tmp_path / 'out.csv'), workers=0)
+
+
+def test_failed_export_removes_temp_file(service, tmp_path, monkeypatch):
+    def fail(*args):
+        raise RuntimeError
+    monkeypatch.setattr(service, '_export_rows', fail)
+    with pytest.raises(RuntimeError):
+        service.export(str(tmp_path / 'out.csv'))
+    assert list(tmp_path.glob('out.csv*')) == []
+
+
+def test_parquet(service, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'out.parquet'
+    service.export(str(path), format='parquet', chunk_size=4)
+    table = pq.read_table(path)
+    assert table.column_names == FIELDS
+    assert table.to_pylist() == [{**row, 'updated_at': UPDATED} for row in expected()]
+
+
+def test_parquet_schema_comes_from_model(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+    path = tmp_path / 'out.parquet'
+    writer = export._ParquetWriter(str(path), FIELDS, models.Test)
+    assert writer.schema.field('id').type == pa.int64()
+    assert writer.schema.field('updated_at').type == pa.timestamp('us')
+    assert writer.schema.field('is_active').type == pa.bool_()
+    assert writer.schema.field('test_column').type == pa.string()
+    # 第一批全為NULL的欄位，之後的批次有值
+    writer.write([{'id': 1, 'updated_at': None, 'name': None, 'is_active': None, 'is_online': None,
+                   'test_column': None}])
+    writer.write([{'id': 2, 'updated_at': UPDATED, 'name': 'b', 'is_active': True, 'is_online': False,
+                   'test_column': 'b'}])
+    writer.close()
+    assert pq.read_table(path).to_pylist()[1] == {'id': 2, 'updated_at': UPDATED, 'name': 'b', 'is_active': True,
+                                                  'is_online': False, 'test_column': 'b'}
+
+
+def test_empty_parquet(database, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'out.parquet'
+    ExportService().export(str(path), format='parquet')
+    table = pq.read_table(path)
+    assert table.column_names == FIELDS and table.num_rows == 0
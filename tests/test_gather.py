@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+from functools import partial
+
+import pytest
+
+from core.database import db
+from core.models import test as models
+from core.service import AsyncService, Service
+
+
+class GatherService(Service):
+    __model__ = models.Test
+
+
+class AsyncGatherService(AsyncService):
+    __model__ = models.Test
+
+
+class Tracker:
+    """記錄同時執行數的最大值"""
+
+    def __init__(self):
+        self.running = self.peak = 0
+        self.lock = threading.Lock()
+
+    def enter(self):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    def exit(self):
+        with self.lock:
+            self.running -= 1
+
+
+def test_gather_bounds_concurrency_and_keeps_order():
+    tracker = Tracker()
+
+    async def job(i):
+        tracker.enter()
+        await asyncio.sleep(0.01)
+        tracker.exit()
+        return i
+    assert asyncio.run(db.gather(*(job(i) for i in range(10)), limit=3)) == list(range(10))
+    assert tracker.peak == 3
+
+
+def test_gather_raises_first_error_after_all_finish():
+    finished = []
+
+    async def job(i):
+        await asyncio.sleep(0.01 * i)
+        if i in (1, 3):
+            raise ValueError(i)
+        finished.append(i)
+        return i
+    with pytest.raises(ValueError, match='1'):
+        asyncio.run(db.gather(*(job(i) for i in range(5)), limit=5))
+    assert sorted(finished) == [0, 2, 4]
+
+
+def test_gather_return_exceptions():
+    async def fail():
+        raise ValueError
+
+    async def ok():
+        return 1
+    results = asyncio.run(db.gather(ok(), fail(), ok(), return_exceptions=True))
+    assert results[0] == results[2] == 1 and isinstance(results[1], ValueError)
+
+
+def test_gather_cancel_on_error():
+    finished = []
+
+    async def fail():
+        raise ValueError
+
+    async def slow():
+        await asyncio.sleep(1)
+        finished.append(True)
+    start = time.perf_counter()
+    with pytest.raises(ValueError):
+        asyncio.run(db.gather(fail(), slow(), slow(), limit=1, cancel_on_error=True))
+    assert not finished and time.perf_counter() - start < 1
+
+
+def test_gather_empty():
+    assert asyncio.run(db.gather()) == []
+    assert db.thread_gather() == []
+
+
+def test_thread_gather_bounds_concurrency_and_keeps_order():
+    tracker = Tracker()
+
+    def job(i):
+        tracker.enter()
+        time.sleep(0.01)
+        tracker.exit()
+        return i
+    assert db.thread_gather(*(partial(job, i) for i in range(10)), limit=3) == list(range(10))
+    assert tracker.peak == 3
+
+
+def test_thread_gather_errors():
+    def fail():
+        raise ValueError
+
+    def ok():
+        return 1
+    with pytest.raises(ValueError):
+        db.thread_gather(ok, fail, ok)
+    results = db.thread_gather(ok, fail, ok, return_exceptions=True)
+    assert results[0] == results[2] == 1 and isinstance(results[1], ValueError)
+
+
+def test_service_gather_runs_queries(database):
+    GatherService().bulk_create([{'name': str(i), 'is_active': i % 2 == 0} for i in range(5)])
+    service, async_service = GatherService(), AsyncGatherService()
+    assert service.gather(partial(service.count, is_active=True), partial(service.count, is_active=False)) == [3, 2]
+
+    async def run():
+        return await async_service.gather(*(async_service.count(is_active=flag) for flag in (True, False)), limit=2)
+    assert asyncio.run(run()) == [3, 2]
+
+
+def test_gather_detaches_unit_of_work(database):
+    async def run():
+        async with db.unit_of_work() as uow:
+            async def session_of():
+                async with db.async_scope() as session:
+                    return session
+            sessions = await db.gather(session_of(), session_of())
+            assert uow.session not in sessions
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from core.database import CachePolicy, db
+from core.models import test as models
+from core.service import AsyncService, Service
+
+
+class ManyService(Service):
+    __model__ = models.Test
+
+
+class AsyncManyService(AsyncService):
+    __model__ = models.Test
+
+
+class CachedManyService(Service):
+    __model__ = models.Test
+    __cache__ = CachePolicy(ttl=60, key_fields=['id'])
+
+
+class AsyncCachedManyService(AsyncService):
+    __model__ = models.Test
+    __cache__ = CachePolicy(ttl=60, key_fields=['id'])
+
+
+@pytest.fixture
+def ids(database):
+    return ManyService().bulk_create([{'name': str(i)} for i in range(5)], returning='ids')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 500])
+def test_input_order_duplicates_and_missing(ids, chunk_size):
+    wanted = [ids[3], 999, ids[0], ids[3], ids[1]]
+    result = ManyService().get_many(wanted, chunk_size=chunk_size)
+    assert [i.id for i in result] == [ids[3], ids[0], ids[3], ids[1]]
+    assert result[0].name == '3' and result[0].test_column == '3測試後綴'
+
+
+def test_as_dict(ids):
+    result = ManyService().get_many(iter([ids[2], 999, ids[2]]), as_dict=True)
+    assert list(result) == [ids[2]]
+    assert result[ids[2]].name == '2'
+
+
+def test_empty(ids):
+    assert ManyService().get_many([]) == []
+    assert ManyService().get_many([], as_dict=True) == {}
+
+
+def test_async(ids):
+    result = asyncio.run(AsyncManyService().get_many([ids[4], 999, ids[0], ids[4]], chunk_size=1))
+    assert [i.id for i in result] == [ids[4], ids[0], ids[4]]
+
+
+def delete_rows(*ids):
+    """略過Service直接刪除，快取仍保留舊資料"""
+    with db.session_scope(commit=True) as session:
+        session.execute(db.delete(models.Test).where(models.Test.id.in_(ids)))
+
+
+def test_mixed_cached_and_uncached(ids, fake_redis):
+    service = CachedManyService()
+    service.get(ids[0])
+    service.get(ids[1])
+    delete_rows(ids[0], ids[1])
+    result = service.get_many([ids[2], ids[1], 999, ids[0]], chunk_size=1)
+    assert [i.id for i in result] == [ids[2], ids[1], ids[0]]  # ids[0]、ids[1]來自快取
+    delete_rows(ids[2])
+    assert [i.id for i in service.get_many([ids[2]])] == [ids[2]]  # 未命中的資料已回填
+
+
+def test_async_mixed_cached_and_uncached(ids, fake_redis):
+    service = AsyncCachedManyService()
+
+    async def run():
+        await service.get(ids[0])
+        delete_rows(ids[0])
+        result = await service.get_many([ids[3], ids[0], 999, ids[3]])
+        assert [i.id for i in result] == [ids[3], ids[0], ids[3]]
+        delete_rows(ids[3])
+        assert [i.id for i in await service.get_many([ids[3]])] == [ids[3]]
+    asyncio.run(run())
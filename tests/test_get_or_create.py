@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from sqlalchemy import false
+
+from core.models import test as models
+from core.service import AsyncService, Service
+from exceptions import DBOptionError
+
+
+class ModelService(Service):
+    __model__ = models.Test
+
+
+class AsyncModelService(AsyncService):
+    __model__ = models.Test
+
+
+def test_get_or_create(database):
+    service = ModelService()
+    instance, created = service.get_or_create(name='a')
+    assert created
+    again, created = service.get_or_create(name='a')
+    assert (again.id, created) == (instance.id, False)
+
+
+def test_defaults_conflicting_with_other_unique_column(database):
+    service = ModelService()
+    service.create(name='taken')
+    with pytest.raises(DBOptionError, match='唯一鍵衝突') as error:
+        service.get_or_create(defaults={'name': 'taken'}, is_online=True)
+    assert error.value.payload['kws'] == {'is_online': True}
+
+
+def test_async_defaults_conflicting_with_other_unique_column(database):
+    ModelService().create(name='taken')
+    with pytest.raises(DBOptionError, match='唯一鍵衝突'):
+        asyncio.run(AsyncModelService().get_or_create(default={'name': 'taken'}, is_online=True))
+
+
+class Racing:
+    """第一次查詢既有資料時看不到資料表內容，模擬查詢後才被其他寫入者新增"""
+
+    raced = False
+
+    def _rows_by_keys(self, keys, rows):
+        query = super()._rows_by_keys(keys, rows)
+        if not self.raced:
+            self.raced = True
+            return query.filter(false())
+        return query
+
+
+class RacingService(Racing, ModelService):
+    pass
+
+
+class AsyncRacingService(Racing, AsyncModelService):
+    pass
+
+
+def test_get_or_create_many(database):
+    service = ModelService()
+    service.create(name='a')
+    result = service.get_or_create_many([{'name': 'a'}, {'name': 'b'}, {'name': 'a'}], key_fields=['name'])
+    assert [(instance.name, created) for instance, created in result] == [('a', False), ('b', True), ('a', False)]
+
+
+def test_get_or_create_many_concurrent_insert_is_not_created(database):
+    ModelService().create(name='a')
+    result = RacingService().get_or_create_many([{'name': 'a'}, {'name': 'b'}], key_fields=['name'])
+    assert [(instance.name, created) for instance, created in result] == [('a', False), ('b', True)]
+    assert ModelService().count() == 2
+
+
+def test_async_get_or_create_many_concurrent_insert_is_not_created(database):
+    ModelService().create(name='a')
+    result = asyncio.run(AsyncRacingService().get_or_create_many([{'name': 'a'}, {'name': 'b'}], key_fields=['name']))
+    assert [(instance.name, created) for instance, created in result] == [('a', False), ('b', True)]
+    assert ModelService().count() == 2
@@ -0,0 +1,7 @@
+from benchmarks.import_time import BUDGET_MS, DEFERRED_MODULES, measure
+
+
+def test_import_core_within_budget():
+    seconds, loaded = measure()
+    assert seconds * 1000 <= BUDGET_MS, f'import core: {seconds * 1000:.1f}ms'
+    assert loaded == [], f'匯入時載入了應延遲載入的模組: {loaded} (檢查: {DEFERRED_MODULES})'
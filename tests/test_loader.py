@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from core.loader import RowValidator, _same_keys
+from core.models import test as models
+from core.service import Service
+
+
+class LoadService(Service):
+    __model__ = models.Test
+
+
+def rows_by_name(service) -> dict:
+    return {row.name: (row.is_active, row.is_online) for row in service.values_list('name', 'is_active', 'is_online')}
+
+
+def write_jsonl(path, *lines):
+    path.write_text('\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines) + '\n',
+                    encoding='utf-8')
+    return str(path)
+
+
+def test_csv(database, tmp_path):
+    path = tmp_path / 'rows.csv'
+    path.write_text('name,is_active\na,true\nb,0\nc,\n\nd,1,extra\ne,maybe\n', encoding='utf-8')
+    service = LoadService()
+    stats = service.load_file(str(path), batch_size=2)
+    assert rows_by_name(service) == {'a': (True, False), 'b': (False, False), 'c': (None, False)}
+    assert (stats.rows, stats.affected, stats.batches) == (3, 3, 2)
+    assert [(r.line, r.reason) for r in stats.rejected] == [
+        (6, '欄位數3與標題2不符'), (7, "is_active: 無法轉換為布林值: 'maybe'"),
+    ]
+    assert service.first(name='a').created_at is not None  # 批次時間欄位
+
+
+def test_jsonl_mixed_keys_are_grouped(database, tmp_path):
+    path = write_jsonl(tmp_path / 'rows.jsonl', {'name': 'a'}, {'name': 'b', 'is_active': True},
+                       {'name': 'c', 'is_online': 'yes'}, {'name': 'd'})
+    service = LoadService()
+    stats = service.load_file(path, format='jsonl', batch_size=10)
+    assert rows_by_name(service) == {'a': (False, False), 'b': (True, False), 'c': (False, True),
+                                     'd': (False, False)}
+    assert (stats.rows, stats.batches, stats.rejected_count) == (4, 1, 0)
+
+
+def test_jsonl_rejected_rows(database, tmp_path):
+    path = write_jsonl(tmp_path / 'rows.jsonl', {'name': 'a'}, '{bad json', '[1, 2]', {'name': 'x' * 51},
+                       {'name': 'b', 'nope': 1}, {'name': 'c', 'id': 'one'}, {'name': 'd'})
+    service = LoadService()
+    stats = service.load_file(path, format='jsonl', keep_rejected=3)
+    assert sorted(rows_by_name(service)) == ['a', 'd']
+    assert stats.rejected_count == 5
+    assert [r.line for r in stats.rejected] == [2, 3, 4]
+    assert stats.rejected[1].reason == '每行必須為JSON物件'
+    assert stats.rejected[2].reason == 'name: 長度超過50'
+
+
+def test_duplicates_ignored_or_updated(database, tmp_path):
+    service = LoadService()
+    service.create(name='a')
+    path = write_jsonl(tmp_path / 'rows.jsonl', {'name': 'a', 'is_active': True}, {'name': 'b', 'is_active': True})
+    stats = service.load_file(path, format='jsonl')
+    assert (stats.rows, stats.affected) == (2, 1)
+    assert rows_by_name(service) == {'a': (False, False), 'b': (True, False)}
+
+    stats = service.load_file(path, format='jsonl', on_duplicate='update', conflict_keys=['name'])
+    assert stats.rows == 2
+    assert rows_by_name(service) == {'a': (True, False), 'b': (True, False)}
+
+
+def test_progress(database, tmp_path):
+    progress = []
+    path = write_jsonl(tmp_path / 'rows.jsonl', *({'name': str(i)} for i in range(5)))
+    LoadService().load_file(path, format='jsonl', batch_size=2, on_progress=lambda stats: progress.append(stats.rows))
+    assert progress == [2, 4, 5]
+
+
+def test_argument_validation(database, tmp_path):
+    service = LoadService()
+    path = write_jsonl(tmp_path / 'rows.jsonl', {'name': 'a'})
+    with pytest.raises(ValueError):
+        service.load_file(path, format='xml')
+    with pytest.raises(ValueError):
+        service.load_file(path, on_duplicate='replace')
+    with pytest.raises(ValueError):
+        service.load_file(path, on_duplicate='update')
+    with pytest.raises(ValueError):
+        service.load_file(path, batch_size=0)
+
+
+def test_row_validator():
+    validate = RowValidator(models.Test)
+    assert validate({'name': 'a', 'is_active': '1', 'id': '3'}) == {'name': 'a', 'is_active': True, 'id': 3}
+    assert validate({'name': '', 'is_active': ''}) == {'name': '', 'is_active': None}  # 字串欄位保留空字串
+    with pytest.raises(ValueError, match='id'):
+        validate({'id': 1.5})
+    with pytest.raises(ValueError, match='未知欄位'):
+        validate({'test_column': 'x'})
+
+
+def test_same_keys():
+    rows = [{'a': 1}, {'a': 2, 'b': 1}, {'a': 3}]
+    assert list(_same_keys(rows[:1] * 2)) == [rows[:1] * 2]
+    assert sorted(map(len, _same_keys(rows))) == [1, 2]
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+
+import pytest
+
+from core.database import db
+from core.models import test as models
+from core.service import AsyncService, Service
+
+
+class MetricsService(Service):
+    __model__ = models.Test
+
+
+class AsyncMetricsService(AsyncService):
+    __model__ = models.Test
+
+
+@pytest.fixture
+def instrument(database):
+    yield db.instrument
+    db.uninstrument()
+
+
+def slow_logs(caplog) -> list:
+    return [r.getMessage() for r in caplog.records if r.name == 'core.database.metrics']
+
+
+def test_records_operations_and_statements(instrument):
+    metrics = instrument(slow_ms=None)
+    service = MetricsService()
+    service.create(name='a')
+    service.get_many([1, 2])
+    service.count()
+    snapshot = metrics.snapshot()
+    assert snapshot['operations']['Test.create']['count'] == 1
+    assert snapshot['operations']['Test.get_many']['rows'] == 1
+    assert snapshot['operations']['Test.count']['count'] == 1
+    assert snapshot['statements']['INSERT']['count'] == 1
+    assert snapshot['statements']['SELECT']['count'] >= 2
+    assert snapshot['slow_queries'] == 0
+
+
+class OverridingService(MetricsService):
+    def count(self, **kws):
+        return super().count(**kws)
+
+
+def test_super_calls_record_outermost_only(instrument):
+    metrics = instrument(slow_ms=None)
+    OverridingService().count()
+    assert metrics.operations['Test.count'].count == 1
+
+
+def test_errors_are_counted(instrument):
+    metrics = instrument(slow_ms=None)
+    service = MetricsService()
+    service.create(name='a')
+    with pytest.raises(Exception):
+        service.create(name='a')
+    assert metrics.operations['Test.create'].errors == 1
+
+
+def test_slow_query_threshold(instrument, caplog):
+    caplog.set_level(logging.WARNING, logger='core.database.metrics')
+    metrics = instrument(slow_ms=60_000)
+    MetricsService().count(name='a')
+    assert metrics.slow_queries == 0 and slow_logs(caplog) == []
+
+    metrics = instrument(slow_ms=0, explain=True)
+    MetricsService().count(name='a')
+    assert metrics.slow_queries == 1
+    [message] = slow_logs(caplog)
+    assert '[Test.count]' in message and 'SELECT count(*)' in message and "params=('a',)" in message
+    assert 'explain=' in message
+
+
+def test_async_statements_are_recorded(instrument):
+    service = AsyncMetricsService()
+
+    async def run():
+        await service.create(name='a')
+        metrics = instrument(slow_ms=None)
+        assert await service.count() == 1
+        return metrics
+    metrics = asyncio.run(run())
+    assert metrics.operations['Test.count'].count == 1
+    assert metrics.statements['SELECT'].count == 1
+
+
+def test_uninstrument(instrument):
+    metrics = instrument(slow_ms=0)
+    db.uninstrument()
+    MetricsService().count()
+    assert db.metrics is None and metrics.statements == {} and metrics.operations == {}
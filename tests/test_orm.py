@@ -0,0 +1,96 @@
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from core.database import db, orm
+from core.database.orm import ORMSerializer, to_json_bytes, to_json_many
+from core.models import test as models
+from core.service import Service
+from exceptions import DBOrmError
+
+CREATED = datetime(2024, 1, 2, 3, 4, 5)
+UPDATED = datetime(2024, 1, 2, 3, 4, 6)
+VALUES = {'id': 1, 'created_at': CREATED, 'updated_at': UPDATED, 'name': 'a', 'is_active': True, 'is_online': False}
+# __json_hidden__ = ['created_at']，擴充欄位test_column
+EXPECTED = {'id': 1, 'updated_at': UPDATED, 'name': 'a', 'is_active': True, 'is_online': False,
+            'test_column': 'a測試後綴'}
+
+
+class ORMService(Service):
+    __model__ = models.Test
+
+
+@pytest.fixture
+def converter(database):
+    ORMService().bulk_create([VALUES])
+    return models.Test.get_converter()
+
+
+def legacy_to_json(instance, monkeypatch):
+    """未編譯序列化器時ORMObject.to_json的逐鍵規則"""
+    with monkeypatch.context() as m:
+        m.setattr(type(instance), '_serializer', None)
+        return instance.to_json()
+
+
+def test_from_model_row_dict_agree(converter, monkeypatch):
+    with db.session_scope() as session:
+        from_model = session.get(models.Test, 1).get_instance()
+        from_row = converter.from_row(session.execute(db.query(*converter.columns)).one())
+    from_dict = converter.from_dict(VALUES)
+    for instance in (from_model, from_row, from_dict):
+        assert instance.to_json() == EXPECTED
+        assert legacy_to_json(instance, monkeypatch) == EXPECTED
+        assert list(instance.columns) == list(converter.fields)
+
+
+def test_from_rows_applies_modifiers(converter):
+    ORMService().create(name='b')
+    with db.session_scope() as session:
+        instances = converter.from_rows(session.execute(db.query(*converter.columns).order_by(models.Test.id)))
+    assert [i.test_column for i in instances] == ['a測試後綴', 'b測試後綴']
+
+
+def test_missing_required_column(converter):
+    with pytest.raises(DBOrmError):
+        converter.from_dict({**VALUES, 'created_at': None})
+
+
+def test_dump_slow_when_instance_keys_change(converter, monkeypatch):
+    instance = converter.from_dict(VALUES)
+    instance.extra = 1
+    instance._private = 2
+    expected = {**EXPECTED, 'extra': 1}
+    assert instance.to_json() == expected == legacy_to_json(instance, monkeypatch)
+    del instance.__dict__['name']
+    del expected['name']
+    assert to_json_many([instance]) == [expected]
+
+
+def test_serializer_public_hidden_rules():
+    """__json_public__內的欄位即使以_開頭或在__json_hidden__內也輸出"""
+    serializer = ORMSerializer(['a', '_b', 'c', '_d'], public=['_b', 'c'], hidden=['c', 'a'])
+    obj = SimpleNamespace(a=1, _b=2, c=3, _d=4)
+    assert serializer.dump(obj) == {'_b': 2, 'c': 3}
+    assert serializer.dump_many([obj, SimpleNamespace(a=1, _b=2)]) == [{'_b': 2, 'c': 3}, {'_b': 2}]
+
+
+def test_to_json_many_mixed_objects(converter):
+    instance = converter.from_dict(VALUES)
+    plain = orm.ORMObject('Plain', [], hidden=['secret'])
+    plain.secret = 1
+    assert to_json_many([instance, plain, instance]) == [
+        EXPECTED, {'id': None, 'created_at': None, 'updated_at': None}, EXPECTED,
+    ]
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_to_json_bytes(converter, monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(orm, 'orjson', None)
+    data = json.loads(to_json_bytes([converter.from_dict(VALUES)]))
+    assert data == [{**EXPECTED, 'updated_at': UPDATED.isoformat()}]
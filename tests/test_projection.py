@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from core.models import test as models
+from core.service import AsyncService, Service
+
+
+class ProjectionService(Service):
+    __model__ = models.Test
+
+
+class AsyncProjectionService(AsyncService):
+    __model__ = models.Test
+
+
+@pytest.fixture
+def service(database):
+    service = ProjectionService()
+    service.create(name='a', is_active=True)
+    service.create(name='b')
+    return service
+
+
+def test_first_fields(service):
+    row = service.first(fields=['id', 'name'], name='b')
+    assert row._fields == ('id', 'name')
+    assert row.name == 'b'
+    assert service.first(fields=['name'], name='missing') is None
+
+
+def test_first_fields_with_modifier(service):
+    row = service.first(fields=['name', 'test_column'], name='a')
+    assert (row.name, row.test_column) == ('a', 'a測試後綴')
+
+
+def test_values_list(service):
+    assert sorted(service.values_list('name', 'is_active')) == [('a', True), ('b', False)]
+    assert sorted(service.values_list('name', flat=True)) == ['a', 'b']
+    assert service.values_list('name', flat=True, is_active=True) == ['a']
+    # 多個欄位時flat無作用
+    assert service.values_list('id', 'name', flat=True, name='a')[0].name == 'a'
+
+
+def test_scalar_column(service):
+    assert sorted(service.scalar_column('name')) == ['a', 'b']
+    assert sorted(service.scalar_column('test_column')) == ['a測試後綴', 'b測試後綴']
+
+
+def test_unknown_field(service):
+    with pytest.raises(ValueError):
+        service.values_list('nope')
+
+
+def test_only_requested_modifiers_run(service, monkeypatch):
+    converter = models.Test.get_converter()
+
+    def boom(self, value):
+        raise AssertionError('不應計算未要求的擴充欄位')
+    monkeypatch.setattr(converter, '_row_modifiers', converter._row_modifiers + (('boom', lambda _: None, boom),))
+    monkeypatch.setattr(converter, 'modifiers', converter.modifiers + (('boom', boom),))
+    assert sorted(service.scalar_column('test_column')) == ['a測試後綴', 'b測試後綴']
+
+
+def test_async_projection(service):
+    async_service = AsyncProjectionService()
+
+    async def run():
+        assert (await async_service.first(fields=['name'], name='a')).name == 'a'
+        assert sorted(await async_service.values_list('name', flat=True)) == ['a', 'b']
+        assert sorted(await async_service.scalar_column('test_column')) == ['a測試後綴', 'b測試後綴']
+    asyncio.run(run())
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from core.models import test as models
+from core.query import _compile
+from core.service import AsyncService, Service
+
+
+class QueryService(Service):
+    __model__ = models.Test
+
+
+class AsyncQueryService(AsyncService):
+    __model__ = models.Test
+
+
+@pytest.fixture
+def service(database):
+    service = QueryService()
+    service.bulk_create([{'name': name, 'is_active': active} for name, active in
+                         [('apple', True), ('banana', False), ('cherry', True), ('date', False), ('elder', True)]])
+    return service
+
+
+def names(instances):
+    return [instance.name for instance in instances]
+
+
+def test_lookups(service):
+    query = service.query()
+    assert names(query.where(name='banana').all()) == ['banana']
+    assert names(query.where(name__ne='banana', is_active=False).all()) == ['date']
+    assert names(query.where(id__gt=3).order_by('id').all()) == ['date', 'elder']
+    assert names(query.where(id__range=(2, 3)).order_by('id').all()) == ['banana', 'cherry']
+    assert names(query.where(name__in=['date', 'apple']).order_by('name').all()) == ['apple', 'date']
+    assert names(query.where(name__startswith='ch').all()) == ['cherry']
+    assert names(query.where(name__icontains='ANA').all()) == ['banana']
+    assert query.where(name=None).all() == []
+    assert len(query.where(name__isnull=False).all()) == 5
+    with pytest.raises(ValueError):
+        query.where(name__regex='a')
+    with pytest.raises(ValueError):
+        query.where(nope=1).all()
+
+
+def test_order_limit_offset(service):
+    query = service.query().where(is_active=True).order_by('-id')
+    assert names(query.all()) == ['elder', 'cherry', 'apple']
+    assert names(query.limit(2).all()) == ['elder', 'cherry']
+    assert names(query.offset(1).limit(1).all()) == ['cherry']
+    assert query.first().name == 'elder'
+    assert query.where(name='nope').first() is None
+    assert query.count() == 3
+    assert query.offset(1).limit(5).count() == 2
+    assert query.exists() and not query.where(name='nope').exists()
+
+
+def test_values_list(service):
+    query = service.query().where(is_active=True).order_by('id')
+    assert query.values_list('name', flat=True) == ['apple', 'cherry', 'elder']
+    assert [tuple(row) for row in query.limit(1).values_list('id', 'name')] == [(1, 'apple')]
+    assert query.limit(1).values_list('test_column', flat=True) == ['apple測試後綴']
+
+
+def test_chaining_is_immutable(service):
+    base = service.query().where(is_active=True)
+    limited = base.order_by('id').limit(1)
+    assert base.count() == 3 and limited.count() == 1
+
+
+def test_same_shape_shares_statement_not_parameters(service):
+    a = service.query().where(name='apple').order_by('id').limit(1)
+    b = service.query().where(name='banana').order_by('id').limit(2)
+    (stmt_a, params_a), (stmt_b, params_b) = a.statement(), b.statement()
+    assert stmt_a is stmt_b
+    assert params_a == {'p0': 'apple', '_limit': 1} and params_b == {'p0': 'banana', '_limit': 2}
+    assert names(a.all()) == ['apple'] and names(b.all()) == ['banana']
+    hits = _compile.cache_info().hits
+    assert names(service.query().where(name='cherry').order_by('id').limit(1).all()) == ['cherry']
+    assert _compile.cache_info().hits == hits + 1
+
+
+def test_value_dependent_shapes_do_not_share_statement(service):
+    stmt_none, _ = service.query().where(name=None).statement()
+    stmt_value, _ = service.query().where(name='apple').statement()
+    assert stmt_none is not stmt_value
+
+
+def test_in_lookup_expands_per_call(service):
+    query = service.query().order_by('id')
+    assert names(query.where(id__in=[1]).all()) == ['apple']
+    assert names(query.where(id__in=[2, 4, 5]).all()) == ['banana', 'date', 'elder']
+
+
+def test_async_query(service):
+    query = AsyncQueryService().query().where(is_active=True).order_by('id')
+
+    async def run():
+        assert names(await query.all()) == ['apple', 'cherry', 'elder']
+        assert (await query.first()).name == 'apple'
+        assert await query.count() == 3
+        assert await query.exists()
+        assert await query.values_list('name', flat=True) == ['apple', 'cherry', 'elder']
+    asyncio.run(run())
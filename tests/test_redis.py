@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from core.database import redis, redisdb
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def client(fake_redis, request, monkeypatch):
+    if request.param == 'json':
+        monkeypatch.setattr(redisdb, 'orjson', None)
+    else:
+        pytest.importorskip('orjson')
+    return redis
+
+
+VALUES = {'a': {'id': 1, 'name': '中文'}, 'b': [1, 2], 'c': None}
+
+
+def test_mget_mset_json(client):
+    client.mset_json(VALUES)
+    assert client.mget_json(['a', 'missing', 'b', 'c']) == [VALUES['a'], None, VALUES['b'], None]
+    assert client.sync_.ttl('a') == -1
+    assert client.mget_json([]) == []
+    client.mset_json({})
+
+
+def test_mset_json_ttl(client):
+    client.mset_json(VALUES, ttl=30)
+    assert 0 < client.sync_.ttl('a') <= 30
+    assert 0 < client.sync_.ttl('b') <= 30
+    assert client.mget_json(['a', 'b']) == [VALUES['a'], VALUES['b']]
+
+
+def test_async_mget_mset_json(client):
+    async def run():
+        await client.amset_json(VALUES)
+        assert await client.amget_json(['a', 'missing', 'b']) == [VALUES['a'], None, VALUES['b']]
+        await client.amset_json({'d': 1}, ttl=30)
+        assert 0 < await client.async_.ttl('d') <= 30
+        assert await client.amget_json([]) == []
+    asyncio.run(run())
+    assert client.mget_json(['d']) == [1]  # 同步與異步共用同一份資料
+
+
+def count_pipelines(monkeypatch) -> list:
+    """記錄AutoPipeline送出的pipeline批次大小"""
+    batches = []
+    pipeline = type(redis.async_).pipeline
+
+    def wrapped(self, *args, **kwargs):
+        pipe = pipeline(self, *args, **kwargs)
+        execute = pipe.execute
+
+        async def execute_and_count(*a, **kw):
+            batches.append(len(pipe.command_stack))
+            return await execute(*a, **kw)
+        pipe.execute = execute_and_count
+        return pipe
+    monkeypatch.setattr(type(redis.async_), 'pipeline', wrapped)
+    return batches
+
+
+def test_auto_pipeline_merges_one_tick(fake_redis, monkeypatch):
+    batches = count_pipelines(monkeypatch)
+
+    async def run():
+        pipe = redis.auto_pipeline()
+        assert await asyncio.gather(*(pipe.incr('counter') for _ in range(5))) == [1, 2, 3, 4, 5]
+        assert await pipe.get('counter') == '5'
+    asyncio.run(run())
+    assert batches == [5, 1]
+
+
+def test_auto_pipeline_max_batch(fake_redis, monkeypatch):
+    batches = count_pipelines(monkeypatch)
+
+    async def run():
+        pipe = redis.auto_pipeline(max_batch=2)
+        await asyncio.gather(*(pipe.set(f'k{i}', i) for i in range(5)))
+    asyncio.run(run())
+    assert batches == [2, 2, 1]
+
+
+def test_auto_pipeline_context_flushes(fake_redis):
+    async def run():
+        async with redis.auto_pipeline() as pipe:
+            pipe.set('a', 1)
+            pipe.expire('a', 30)
+        assert await redis.async_.get('a') == '1'
+        assert 0 < await redis.async_.ttl('a') <= 30
+    asyncio.run(run())
+
+
+def test_auto_pipeline_error_only_fails_its_command(fake_redis):
+    async def run():
+        await redis.async_.set('text', 'x')
+        pipe = redis.auto_pipeline()
+        results = await asyncio.gather(pipe.incr('n'), pipe.incr('text'), pipe.incr('n'), return_exceptions=True)
+        assert results[0] == 1 and results[2] == 2
+        assert isinstance(results[1], Exception)
+    asyncio.run(run())
+
+
+def test_auto_pipeline_rejects_unknown_commands(fake_redis):
+    with pytest.raises(AttributeError):
+        redis.auto_pipeline().not_a_command
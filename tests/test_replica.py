@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import create_engine, insert
+
+from core.database import db, mysqldb
+from core.database.replica import ReplicaSet
+from core.models import test as models
+from core.service import AsyncService, Service
+
+
+class ReadService(Service):
+    __model__ = models.Test
+
+
+class AsyncReadService(AsyncService):
+    __model__ = models.Test
+
+
+def make_database(path, rows: int) -> str:
+    """建立含rows筆資料的SQLite，筆數用來分辨讀取的是哪個資料庫"""
+    engine = create_engine(f'sqlite:///{path}')
+    db.Model.metadata.create_all(engine)
+    with engine.begin() as conn:
+        if rows:
+            conn.execute(insert(models.Test), [{'name': f'{path.stem}{i}'} for i in range(rows)])
+    engine.dispose()
+    return str(path)
+
+
+async def dispose_async_engines():
+    """在建立連線的event loop內關閉從庫的異步engine"""
+    for replica in db.replicas:
+        if replica.async_engine is not None:
+            await replica.async_engine.dispose()
+            replica.async_engine = replica.async_session_factory = None
+
+
+def arun(aw):
+    """執行後在同一個event loop內關閉從庫的異步engine"""
+    async def run():
+        try:
+            return await aw
+        finally:
+            await dispose_async_engines()
+            await asyncio.sleep(0.05)  # 連線失敗的aiosqlite執行緒結束前不關閉event loop
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def replicas(database, tmp_path, monkeypatch):
+    """主庫0筆，replica0為10筆、replica1為20筆"""
+    monkeypatch.setattr(db, 'replicas', ReplicaSet(retry_after=60))
+    monkeypatch.setattr(db, 'read_your_writes', 0.3)
+    token = mysqldb._last_write.set(None)
+
+    def add(path, name):
+        db.add_replica(f'sqlite:///{path}', f'sqlite+aiosqlite:///{path}', name=name)
+    yield add, tmp_path
+    mysqldb._last_write.reset(token)
+    for replica in db.replicas:
+        if replica.engine is not None:
+            replica.engine.dispose()
+
+
+@pytest.fixture
+def two_replicas(replicas):
+    add, tmp_path = replicas
+    add(make_database(tmp_path / 'r0.db', 10), 'replica0')
+    add(make_database(tmp_path / 'r1.db', 20), 'replica1')
+    return db.replicas
+
+
+def test_reads_rotate_across_replicas(two_replicas):
+    service = ReadService()
+    assert sorted(service.count() for _ in range(4)) == [10, 10, 20, 20]
+    assert arun(AsyncReadService().count()) in (10, 20)
+
+
+def test_use_primary(two_replicas):
+    with db.use_primary():
+        assert ReadService().count() == 0
+
+
+def test_read_your_writes_window(two_replicas):
+    service = ReadService()
+    service.create(name='new')
+    assert [service.count() for _ in range(3)] == [1, 1, 1]  # 寫入後的讀取留在主庫
+    time.sleep(db.read_your_writes)
+    assert service.count() in (10, 20)
+
+
+def test_async_read_your_writes_window(two_replicas):
+    service = AsyncReadService()
+
+    async def run():
+        await service.create(name='new')
+        assert await service.count() == 1
+        await asyncio.sleep(db.read_your_writes)
+        assert await service.count() in (10, 20)
+    arun(run())
+
+
+def test_failed_replica_is_ejected(replicas):
+    add, tmp_path = replicas
+    add(tmp_path / 'missing' / 'down.db', 'down')
+    add(make_database(tmp_path / 'r1.db', 20), 'replica1')
+    service = ReadService()
+    assert [service.count() for _ in range(3)] == [20, 20, 20]
+    down = next(replica for replica in db.replicas if replica.name == 'down')
+    assert not down.healthy and down.failures == 1 and down.last_error
+    assert [replica.name for replica in db.replicas.candidates()] == ['replica1']
+
+
+def test_all_replicas_down_falls_back_to_primary(replicas):
+    add, tmp_path = replicas
+    add(tmp_path / 'missing' / 'a.db', 'a')
+    add(tmp_path / 'missing' / 'b.db', 'b')
+    assert ReadService().count() == 0
+    assert arun(AsyncReadService().count()) == 0
+    assert db.replicas.candidates() == []
+
+
+def test_replica_is_retried_after_retry_after(replicas):
+    add, tmp_path = replicas
+    path = tmp_path / 'later' / 'r.db'
+    add(path, 'later')
+    db.replicas.retry_after = 0.1
+    assert ReadService().count() == 0
+    path.parent.mkdir()
+    make_database(path, 5)
+    time.sleep(0.1)
+    assert ReadService().count() == 5
+    assert next(iter(db.replicas)).healthy
+
+
+def test_check_replicas(replicas):
+    add, tmp_path = replicas
+    add(make_database(tmp_path / 'r0.db', 10), 'replica0')
+    add(tmp_path / 'missing' / 'down.db', 'down')
+    status = {replica['name']: replica['healthy'] for replica in db.check_replicas()}
+    assert status == {'replica0': True, 'down': False}
+
+    status = {replica['name']: replica['healthy'] for replica in arun(db.acheck_replicas())}
+    assert status == {'replica0': True, 'down': False}
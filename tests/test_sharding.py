@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+
+from core.database import HashShardMap, Mixin, db
+from core.database.orm import ORM
+from core.service import AsyncService, Service
+
+SHARDS = ('s0', 's1')
+
+
+class Report(Mixin, ORM, db.Model):
+    __tablename__ = 'sharded_report'
+    __shard_key__ = 'account_id'
+    __shard_map__ = HashShardMap(SHARDS)
+    account_id = db.Column(db.Integer, index=True)
+    name = db.Column(db.String(50))
+    score = db.Column(db.Integer)
+
+
+class ReportService(Service):
+    __model__ = Report
+
+
+class AsyncReportService(AsyncService):
+    __model__ = Report
+
+
+@pytest.fixture
+def service(database, tmp_path):
+    for name in SHARDS:
+        path = tmp_path / f'{name}.db'
+        engine = create_engine(f'sqlite:///{path}')
+        Report.__table__.create(engine)
+        engine.dispose()
+        db.add_shard(name, f'sqlite:///{path}', f'sqlite+aiosqlite:///{path}')
+    service = ReportService()
+    # 全域唯一id，各分片各5筆
+    service.bulk_create([{'id': i + 1, 'account_id': i, 'name': f'n{i}', 'score': 0} for i in range(10)])
+    return service
+
+
+def test_rows_are_split_by_shard_key(service):
+    for name in SHARDS:
+        with db.using_shard(name):
+            assert service.count() == 5
+    assert service.count() == 10
+
+
+def test_update_many_with_generator(service):
+    changed = service.update_many((id_, {'score': id_}) for id_ in range(1, 11))
+    assert changed == 10
+    assert sorted(service.values_list('score', flat=True)) == list(range(1, 11))
+
+
+def test_async_update_many_with_generator(service):
+    async_service = AsyncReportService()
+    changed = asyncio.run(async_service.update_many((id_, {'score': 1}) for id_ in range(1, 11)))
+    assert changed == 10
+    assert service.count(score=1) == 10
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from core.database import CachePolicy
+from core.models import test as models
+from core.service import AsyncService, Service
+
+
+class SoftService(Service):
+    __model__ = models.Test
+    __deleted_field__ = 'is_online'
+
+
+class CachedSoftService(SoftService):
+    __cache__ = CachePolicy(ttl=60, key_fields=['id'], count_ttl=60)
+
+
+class AsyncSoftService(AsyncService):
+    __model__ = models.Test
+    __deleted_field__ = 'is_online'
+
+
+@pytest.fixture
+def ids(database):
+    ids = SoftService().bulk_create([{'name': str(i), 'is_online': False} for i in range(3)], returning='ids')
+    assert SoftService().delete(ids[1], mark_deleted=True) == 1
+    return ids
+
+
+def test_reads_exclude_soft_deleted(ids):
+    service = SoftService()
+    assert service.get(ids[1]) is None
+    assert service.get(ids[0]).name == '0'
+    assert service.first(name='1') is None
+    assert service.exists(name='1') is False
+    assert service.count() == 2
+    assert [i.id for i in service.all()] == [ids[0], ids[2]]
+    assert [i.id for i in service.get_many(ids)] == [ids[0], ids[2]]
+    assert [i.id for i in service.iter_all(batch_size=1)] == [ids[0], ids[2]]
+    assert service.values_list('name', flat=True) == ['0', '2']
+
+
+def test_query_excludes_soft_deleted(ids):
+    query = SoftService().query()
+    assert [i.id for i in query.order_by('id').all()] == [ids[0], ids[2]]
+    assert query.where(name='1').exists() is False
+    assert query.count() == 2
+
+
+def test_null_flag_is_not_deleted(database):
+    service = SoftService()
+    id_ = service.bulk_create([{'name': 'n', 'is_online': None}], returning='ids')[0]
+    assert service.get(id_).name == 'n'
+    assert service.count() == 1
+
+
+def test_without_deleted_field_flag_is_ignored(ids):
+    class PlainService(Service):
+        __model__ = models.Test
+
+    assert PlainService().count() == 3
+    assert PlainService().get(ids[1]).is_online is True
+
+
+def test_soft_delete_invalidates_cache(database, fake_redis):
+    service = CachedSoftService()
+    ids = service.bulk_create([{'name': str(i), 'is_online': False} for i in range(2)], returning='ids')
+    assert service.get(ids[0]) is not None
+    assert service.count() == 2
+    service.delete(ids[0], mark_deleted=True)
+    assert service.get(ids[0]) is None
+    assert [i.id for i in service.get_many(ids)] == [ids[1]]
+    assert service.count() == 1
+
+
+def test_async_reads_exclude_soft_deleted(ids):
+    service = AsyncSoftService()
+
+    async def run():
+        return (
+            await service.get(ids[1]), await service.first(name='1'), await service.count(),
+            [i.id for i in await service.get_many(ids)], [i.id async for i in service.astream(batch_size=1)],
+        )
+
+    got, first, count, many, streamed = asyncio.run(run())
+    assert got is None and first is None and count == 2
+    assert many == streamed == [ids[0], ids[2]]
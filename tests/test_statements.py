@@ -0,0 +1,19 @@
+import pytest
+
+from core.database.statements import check_inferred_ids
+from exceptions import DBOptionError
+
+
+def test_inferred_ids_with_consecutive_autoincrement():
+    check_inferred_ids((1, 1), [{'name': 'a'}, {'name': 'b'}])
+
+
+@pytest.mark.parametrize('settings', [(2, 1), (1, 2)])
+def test_inferred_ids_rejects_non_consecutive_settings(settings):
+    with pytest.raises(DBOptionError):
+        check_inferred_ids(settings, [{'name': 'a'}])
+
+
+def test_inferred_ids_rejects_explicit_ids():
+    with pytest.raises(DBOptionError):
+        check_inferred_ids((1, 1), [{'name': 'a'}, {'id': 10, 'name': 'b'}])
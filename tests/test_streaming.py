@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from core.models import test as models
+from core.service import AsyncService, Service
+
+
+class StreamService(Service):
+    __model__ = models.Test
+
+
+class AsyncStreamService(AsyncService):
+    __model__ = models.Test
+
+
+def astream(service, **kws):
+    async def run():
+        return [instance async for instance in service.astream(**kws)]
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def service(database):
+    """id 1~10，刪除3、4、8留下間隔"""
+    service = StreamService()
+    service.bulk_create([{'name': str(i), 'is_active': i % 2 == 0} for i in range(1, 11)])
+    for id_ in (3, 4, 8):
+        service.delete(id_)
+    return service
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 3, 7, 1000])
+def test_iter_all_pages_without_gaps_or_repeats(service, batch_size):
+    assert [i.id for i in service.iter_all(batch_size=batch_size)] == [1, 2, 5, 6, 7, 9, 10]
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 7, 1000])
+def test_astream_pages_without_gaps_or_repeats(service, batch_size):
+    instances = astream(AsyncStreamService(), batch_size=batch_size)
+    assert [i.id for i in instances] == [1, 2, 5, 6, 7, 9, 10]
+    assert instances[0].test_column == '1測試後綴'
+
+
+def test_filters(service):
+    assert [i.id for i in service.iter_all(batch_size=2, is_active=True)] == [2, 6, 10]
+    assert [i.id for i in astream(AsyncStreamService(), batch_size=2, is_active=True)] == [2, 6, 10]
+
+
+def test_empty_table(database):
+    assert list(StreamService().iter_all(batch_size=2)) == []
+    assert astream(AsyncStreamService(), batch_size=2) == []
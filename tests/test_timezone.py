@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from core.database import db
+from utils import get_zone, local_now, local_now_naive, stamp_rows, utc_offset
+
+
+def test_get_zone_is_cached():
+    get_zone.cache_clear()
+    assert get_zone('Asia/Taipei') is get_zone('Asia/Taipei') is get_zone()
+    assert get_zone.cache_info().hits == 1
+    assert get_zone('UTC') is not get_zone()
+
+
+def test_local_now():
+    now = local_now()
+    assert now.utcoffset() == timedelta(hours=8)
+    naive = local_now_naive()
+    assert naive.tzinfo is None
+    assert abs(naive - now.replace(tzinfo=None)) < timedelta(seconds=5)
+    assert local_now('UTC').utcoffset() == timedelta(0)
+
+
+def test_utc_offset():
+    assert utc_offset() == '+08:00'
+    assert utc_offset('UTC') == '+00:00'
+    assert utc_offset('America/St_Johns') in ('-03:30', '-02:30')
+
+
+def test_stamp_rows():
+    rows = [{'name': 'a'}, {'name': 'b', 'created_at': datetime(2020, 1, 1)}]
+    stamped = stamp_rows(rows, 'created_at', 'updated_at')
+    assert rows == [{'name': 'a'}, {'name': 'b', 'created_at': datetime(2020, 1, 1)}]  # 不修改傳入的資料
+    assert stamped[0]['created_at'] == stamped[0]['updated_at'] == stamped[1]['updated_at']
+    assert stamped[0]['created_at'].tzinfo is None
+    assert stamped[1]['created_at'] == datetime(2020, 1, 1)  # 已有的欄位不覆蓋
+    now = datetime(2024, 5, 6)
+    assert stamp_rows([{}], 'created_at', now=now) == [{'created_at': now}]
+    assert stamp_rows([], 'created_at') == []
+
+
+@pytest.mark.parametrize('time_zone, init_command', [
+    ('Asia/Taipei', "SET time_zone = '+08:00'"),
+    ('UTC', "SET time_zone = '+00:00'"),
+    (None, None),
+])
+def test_mysql_session_time_zone(monkeypatch, time_zone, init_command):
+    monkeypatch.setattr(db, 'time_zone', time_zone)
+    options = db._engine_options('mysql://user@host/db')
+    assert options.get('connect_args', {}).get('init_command') == init_command
+    assert 'connect_args' not in db._engine_options('sqlite:///x.db')
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from core.database import db
+from core.models import test as models
+from core.service import AsyncService, Service
+
+
+class TxService(Service):
+    __model__ = models.Test
+
+
+class AsyncTxService(AsyncService):
+    __model__ = models.Test
+
+
+def names():
+    return sorted(TxService().scalar_column('name'))
+
+
+@pytest.fixture
+def rows(database):
+    TxService().bulk_create([{'name': 'a'}, {'name': 'b'}])
+
+
+def test_unit_of_work_shares_one_session(rows):
+    service = AsyncTxService()
+
+    async def run():
+        async with db.unit_of_work() as uow:
+            async with db.async_scope() as session:
+                assert session is uow.session
+            async with db.unit_of_work() as inner:
+                assert inner is uow
+            instance = await service.create(name='c')
+            assert (await service.first(name='c')).id == instance.id  # 未提交的寫入在範圍內可見
+            assert db.in_unit_of_work
+        assert not db.in_unit_of_work
+    asyncio.run(run())
+    assert names() == ['a', 'b', 'c']
+
+
+def test_unit_of_work_commits_every_write(rows):
+    service = AsyncTxService()
+
+    async def run():
+        async with db.unit_of_work():
+            a = await service.first(name='a')
+            await service.create(name='c')
+            await service.update(a, is_active=True)
+            await service.delete_where({'name': 'b'})
+    asyncio.run(run())
+    assert names() == ['a', 'c']
+    assert TxService().first(name='a').is_active
+
+
+def test_unit_of_work_rolls_back_every_write(rows):
+    service = AsyncTxService()
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            async with db.unit_of_work():
+                a = await service.first(name='a')
+                await service.create(name='c')
+                await service.update(a, is_active=True)
+                await service.delete_where({'name': 'b'})
+                raise RuntimeError
+    asyncio.run(run())
+    assert names() == ['a', 'b']
+    assert not TxService().first(name='a').is_active
+
+
+def test_transaction_shares_one_session(rows):
+    service = TxService()
+    with db.transaction() as session:
+        with db.session_scope() as inner:
+            assert inner is session
+        with db.transaction() as nested:
+            assert nested is session
+        instance = service.create(name='c')
+        assert service.first(name='c').id == instance.id
+        assert db.in_transaction
+    assert not db.in_transaction
+    assert names() == ['a', 'b', 'c']
+
+
+def test_transaction_commits_every_write(rows):
+    service = TxService()
+    with db.transaction():
+        service.create(name='c')
+        service.update(service.first(name='a'), is_active=True)
+        service.delete_where({'name': 'b'})
+    assert names() == ['a', 'c']
+    assert service.first(name='a').is_active
+
+
+def test_transaction_rolls_back_every_write(rows):
+    service = TxService()
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            service.create(name='c')
+            service.update(service.first(name='a'), is_active=True)
+            service.delete_where({'name': 'b'})
+            with db.transaction():
+                service.create(name='d')
+            raise RuntimeError
+    assert names() == ['a', 'b']
+    assert not service.first(name='a').is_active
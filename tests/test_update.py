@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from core.database import CachePolicy
+from core.models import test as models
+from core.service import AsyncService, Service
+from exceptions import DBOptionError
+
+
+class CachedService(Service):
+    __model__ = models.Test
+    __cache__ = CachePolicy(ttl=60, key_fields=['id', 'name'])
+
+
+class AsyncCachedService(AsyncService):
+    __model__ = models.Test
+    __cache__ = CachePolicy(ttl=60, key_fields=['id', 'name'])
+
+
+@pytest.fixture
+def service(database, fake_redis):
+    return CachedService()
+
+
+def test_update_returns_row_changed_by_other_writer(service):
+    instance = service.create(name='a')
+    service.update_where({'id': instance.id}, {'is_online': True})
+    updated = service.update(instance, is_active=True)
+    assert (updated.is_active, updated.is_online) == (True, True)
+    cached = service.get(instance.id)
+    assert (cached.is_active, cached.is_online) == (True, True)
+
+
+def test_update_without_values_refreshes_timestamps(service):
+    instance = service.create(name='a')
+    old = datetime(2000, 1, 1)
+    service.update_where({'id': instance.id}, {'updated_at': old})
+    stale = service.get(instance.id)
+    updated = service.update(stale)
+    assert updated.updated_at > old + timedelta(days=1)
+    assert service.get(instance.id).updated_at == updated.updated_at
+
+
+def test_async_update_returns_current_row(database, fake_redis):
+    sync_service, async_service = CachedService(), AsyncCachedService()
+    instance = sync_service.create(name='a')
+    sync_service.update_where({'id': instance.id}, {'is_online': True})
+    updated = asyncio.run(async_service.update(instance, is_active=True))
+    assert (updated.is_active, updated.is_online) == (True, True)
+
+
+def test_update_missing_row(service):
+    instance = service.create(name='a')
+    service.delete(instance)
+    with pytest.raises(DBOptionError):
+        service.update(instance, is_active=True)
+
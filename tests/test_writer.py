@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from core.models import test as models
+from core.service import AsyncService, Service
+from exceptions import DBOptionError
+
+
+class WriterService(AsyncService):
+    __model__ = models.Test
+
+
+class GatedService(WriterService):
+    """bulk_create等待放行，模擬寫入緩慢"""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+
+    async def bulk_create(self, rows, **kws):
+        await self.gate.wait()
+        return await super().bulk_create(rows, **kws)
+
+
+class ReadService(Service):
+    __model__ = models.Test
+
+
+def names():
+    return sorted(ReadService().scalar_column('name'))
+
+
+def test_mixed_keys_are_written_in_groups(database):
+    async def run():
+        async with WriterService().buffered_writer(max_rows=10) as writer:
+            await writer.add(name='a')
+            await writer.add(name='b', is_active=True)
+            await writer.add(name='c')
+        return writer
+    writer = asyncio.run(run())
+    assert writer.stats.rows == 3 and writer.stats.failed_rows == 0
+    assert dict(ReadService().values_list('name', 'is_active')) == {'a': False, 'b': True, 'c': False}
+
+
+def test_flush_when_max_rows_reached(database):
+    flushed = []
+
+    async def run():
+        async with WriterService().buffered_writer(max_rows=2, max_latency_ms=60_000,
+                                                   on_flush=lambda rows, _: flushed.append(rows)) as writer:
+            await writer.add(name='a')
+            await writer.add(name='b')
+            for _ in range(100):
+                if flushed:
+                    break
+                await asyncio.sleep(0.01)
+            assert flushed == [2]
+    asyncio.run(run())
+
+
+def test_flush_after_max_latency(database):
+    flushed = []
+
+    async def run():
+        async with WriterService().buffered_writer(max_rows=100, max_latency_ms=20,
+                                                   on_flush=lambda rows, _: flushed.append(rows)) as writer:
+            await writer.add(name='a')
+            await asyncio.sleep(0.5)
+            assert flushed == [1]
+    asyncio.run(run())
+
+
+def test_add_waits_when_queue_is_full(database):
+    service = GatedService()
+
+    async def run():
+        async with service.buffered_writer(max_rows=1, max_pending=1) as writer:
+            await writer.add(name='a')
+            await asyncio.sleep(0.05)  # 背景task取出第一筆後卡在寫入
+            await writer.add(name='b')
+            assert writer.pending == 1
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(writer.add(name='c'), 0.1)
+            service.gate.set()
+            await writer.add(name='c')
+    asyncio.run(run())
+    assert names() == ['a', 'b', 'c']
+
+
+def test_close_writes_remaining_rows(database):
+    async def run():
+        async with WriterService().buffered_writer(max_rows=1000, max_latency_ms=60_000) as writer:
+            await writer.add_many({'name': str(i)} for i in range(5))
+        return writer
+    writer = asyncio.run(run())
+    assert writer.pending == 0
+    assert names() == ['0', '1', '2', '3', '4']
+
+
+def test_on_error_receives_failed_batch_and_writer_continues(database):
+    errors = []
+
+    async def run():
+        await WriterService().create(name='dup')
+        async with WriterService().buffered_writer(max_rows=1, on_error=lambda rows, e: errors.append(rows)) as writer:
+            await writer.add(name='dup')
+            await asyncio.sleep(0.05)
+            await writer.add(name='ok')
+        return writer
+    writer = asyncio.run(run())
+    assert errors == [[{'name': 'dup'}]]
+    assert writer.stats.failed_rows == 1 and writer.stats.rows == 1
+    assert names() == ['dup', 'ok']
+
+
+def test_error_without_handler_stops_writer(database):
+    async def run():
+        await WriterService().create(name='dup')
+        with pytest.raises(DBOptionError):
+            async with WriterService().buffered_writer(max_rows=1) as writer:
+                await writer.add(name='dup')
+                await asyncio.sleep(0.05)
+                with pytest.raises(DBOptionError):
+                    await writer.add(name='later')
+    asyncio.run(run())
+    assert names() == ['dup']
@@ -1,10 +1,53 @@
-import pytz
-from delorean import Delorean
+"""
+時間工具
+時區物件快取(zoneinfo)，不經過pytz/Delorean轉換
+"""
 from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, Optional
+from zoneinfo import ZoneInfo
 from constants import LOCAL_TZ
 
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+@lru_cache(maxsize=None)
+def get_zone(name: str = LOCAL_TZ) -> ZoneInfo:
+    """時區(依名稱快取)"""
+    return ZoneInfo(name)
+
+
+def local_now(tz: str = LOCAL_TZ) -> datetime:
+    """當地時間(含時區)"""
+    return datetime.now(get_zone(tz))
+
+
+def local_now_naive(tz: str = LOCAL_TZ) -> datetime:
+    """當地時間(不含時區，寫入DATETIME欄位用)"""
+    return datetime.now(get_zone(tz)).replace(tzinfo=None)
+
+
+def local_now_str(tz: str = LOCAL_TZ, fmt: str = DATETIME_FORMAT) -> str:
+    """當地時間字串"""
+    return datetime.now(get_zone(tz)).strftime(fmt)
+
+
+def utc_offset(tz: str = LOCAL_TZ) -> str:
+    """目前與UTC的時差 '+08:00'(MySQL session time_zone使用，不需載入時區資料表)"""
+    offset = local_now(tz).strftime('%z')
+    return f'{offset[:3]}:{offset[3:]}'
+
 
 def taipei_now() -> str:
     """台北時間"""
-    ct = datetime.now(pytz.timezone(LOCAL_TZ))
-    return Delorean(datetime=ct).shift('Asia/Taipei').datetime.strftime('%Y-%m-%d %H:%M:%S')
+    return local_now_str('Asia/Taipei')
+
+
+def stamp_rows(rows: Iterable[dict], *fields: str, now: Optional[datetime] = None) -> list:
+    """
+    批次資料補上時間欄位(整批共用同一時間，只取一次時間)
+    stamp_rows(rows, 'created_at', 'updated_at')
+    只補缺少的欄位，回傳新的dict，不修改傳入的資料
+    """
+    stamp = dict.fromkeys(fields, local_now_naive() if now is None else now)
+    return [{**stamp, **row} for row in rows]